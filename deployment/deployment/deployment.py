@@ -26,7 +26,12 @@ class Deployment(object):
         "distro",
         "env",
         "nonewrelic",
-        "debug"
+        "debug",
+        "upload_threads",
+        "upload_part_mb",
+        "upload_retries",
+        "s3endpoint",
+        "keep_deploys"
     ])
 
     def __init__(self, log_filename, cfg):
@@ -47,8 +52,15 @@ class Deployment(object):
             self._cfg.access_key,
             self._cfg.secret_key,
             self._cfg.env,
+            concurrency=self._cfg.upload_threads,
+            part_size=self._cfg.upload_part_mb * 1024 * 1024,
+            retries=self._cfg.upload_retries,
+            endpoint=self._cfg.s3endpoint,
         )
-        return u.upload_dir(pkgpath)
+        s3dir = u.upload_dir(pkgpath)
+        if self._cfg.keep_deploys > 0:
+            u.collect_garbage(self._cfg.keep_deploys)
+        return s3dir
 
     def create_stack(self, s3dir, template_file, script_file):
         template_data = None
@@ -7,7 +7,7 @@ from splogger import Splogger
 
 class Packager:
     """ Packages up everything needed for deployment
-        into a directory, ready to be sync-ed to S3
+        into a directory, ready to be uploaded to S3
     """
     def __init__(self, rootdir, unattended=False, log_filename="/var/log/balihoo/fulfillment/packup.log",debug=False):
         self._rootdir = rootdir
@@ -63,6 +63,16 @@ class Packager:
         shutil.copy(os.path.join(launch_dir, "launcher.py"), tmpdir)
         shutil.copy(os.path.join(launch_dir, "component.py"), tmpdir)
         shutil.copy(os.path.join(launch_dir, "swfworker.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "waker.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "outputreader.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "hoststats.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "warmpool.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "workerhost.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "resources.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "heartbeat.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "metrics.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "properties.py"), tmpdir)
+        shutil.copy(os.path.join(launch_dir, "backlog.py"), tmpdir)
 
         self.info("gathering install splogger")
         splogger = os.path.join(self._rootdir, "deployment", "deployment", "splogger.py")
@@ -75,6 +85,8 @@ class Packager:
         self.info("gathering install script and deps")
         installscript = os.path.join(self._rootdir, "deployment", "scripts", "ffinstall.py")
         shutil.copy(installscript, tmpdir)
+        syncscript = os.path.join(self._rootdir, "deployment", "scripts", "ffsync.py")
+        shutil.copy(syncscript, tmpdir)
 
         if self._debug:
             debugdir = os.path.join(self._rootdir, "deployment", "debug")
@@ -1,40 +1,355 @@
-from inspect import currentframe, getframeinfo, getouterframes
 try:
     #python 2.7
     from collections import OrderedDict
 except ImportError:
     #python 2.6
     from ordereddict import OrderedDict
+from collections import namedtuple, deque
 
 from copy import deepcopy
+from threading import Thread, Lock, Condition
+import atexit
 import json
 import datetime
+import time
 import os, sys
 
+class BufferedFileWriter(object):
+    """ Keeps a log file open and writes entries in batches.
+    A background thread flushes the buffer every flush_interval seconds;
+    it is also flushed when it grows past buffer_size, on request and at exit.
+    The file is reopened when it is rotated away (its inode changes)
+    """
+    def __init__(self, filename, buffer_size=65536, flush_interval=1.0):
+        self._filename = filename
+        self._buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+        #guards the buffer
+        self._lock = Lock()
+        #guards the file; taken before the buffer lock is released to keep entries in order
+        self._io_lock = Lock()
+        self._file = None
+        self._inode = None
+        self._open()
+        atexit.register(self.close)
+        if flush_interval > 0:
+            def flusher():
+                while self._file:
+                    time.sleep(flush_interval)
+                    self.flush()
+            t = Thread(target=flusher, name="splogger-flush")
+            t.daemon = True
+            t.start()
+
+    def _open(self):
+        self._file = open(self._filename, "a")
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    def _reopen_if_rotated(self):
+        try:
+            rotated = os.stat(self._filename).st_ino != self._inode
+        except OSError:
+            #moved away and not recreated yet
+            rotated = True
+        if rotated:
+            self._file.close()
+            self._open()
+
+    def write(self, entry, flush=False):
+        """ buffers an entry
+        @param entry string - the text to write
+        @param flush boolean - write out the buffer right away
+        """
+        with self._lock:
+            if self._file is None:
+                #closed
+                return
+            self._buffer.append(entry)
+            self._buffered += len(entry)
+            full = self._buffered >= self._buffer_size
+        if flush or full:
+            self.flush()
+
+    def flush(self):
+        """ writes out anything buffered """
+        self._lock.acquire()
+        try:
+            if not self._file:
+                #closed: nothing can be written anymore
+                self._buffer = []
+                self._buffered = 0
+                return
+            if not self._buffer:
+                return
+            data = "".join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            self._io_lock.acquire()
+        finally:
+            self._lock.release()
+        try:
+            self._reopen_if_rotated()
+            self._file.write(data)
+            self._file.flush()
+        finally:
+            self._io_lock.release()
+
+    def close(self):
+        """ flushes and closes the file. Further writes are dropped """
+        self.flush()
+        with self._io_lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+class AsyncWriter(object):
+    """ Hands entries to a dedicated writer thread through a bounded ring buffer,
+    so logging never waits on I/O. When the buffer is full, the overflow policy
+    decides: BLOCK waits for room, DROP_OLDEST discards the oldest entry and
+    DROP_DEBUG discards DEBUG entries first, then the oldest.
+    Dropped entries are counted per level
+    """
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_DEBUG = "drop_debug"
+    POLICIES = [BLOCK, DROP_OLDEST, DROP_DEBUG]
+
+    def __init__(self, write, capacity=10000, overflow=DROP_DEBUG):
+        """ @param write function - called on the writer thread with (level, entry)
+        @param capacity int - max number of entries waiting to be written
+        @param overflow string - one of POLICIES
+        """
+        if overflow not in self.POLICIES:
+            raise ValueError("unknown overflow policy %s" % (overflow,))
+        self._write = write
+        self._capacity = capacity
+        self._overflow = overflow
+        self._entries = deque()
+        self._debug_entries = 0
+        self._dropped = {}
+        self._writing = False
+        self._stopped = False
+        self._cond = Condition(Lock())
+        t = Thread(target=self._run, name="splogger-writer")
+        t.daemon = True
+        t.start()
+        atexit.register(self.stop)
+
+    def dropped(self):
+        """ @returns dict - number of dropped entries per level """
+        with self._cond:
+            return dict(self._dropped)
+
+    def _drop(self, level):
+        self._dropped[level] = self._dropped.get(level, 0) + 1
+
+    def _make_room(self, level):
+        """ called with the lock held and the buffer full
+        @returns boolean - False if the new entry should be dropped instead
+        """
+        if self._overflow == self.DROP_DEBUG and self._debug_entries > 0:
+            for i, (l, _) in enumerate(self._entries):
+                if l == "DEBUG":
+                    del self._entries[i]
+                    self._debug_entries -= 1
+                    self._drop(l)
+                    return True
+        if self._overflow == self.DROP_DEBUG and level == "DEBUG":
+            return False
+        l, _ = self._entries.popleft()
+        if l == "DEBUG":
+            self._debug_entries -= 1
+        self._drop(l)
+        return True
+
+    def write(self, level, entry):
+        """ queues an entry for the writer thread """
+        with self._cond:
+            if self._stopped:
+                return
+            if len(self._entries) >= self._capacity:
+                if self._overflow == self.BLOCK:
+                    while len(self._entries) >= self._capacity and not self._stopped:
+                        self._cond.wait()
+                elif not self._make_room(level):
+                    self._drop(level)
+                    return
+            self._entries.append((level, entry))
+            if level == "DEBUG":
+                self._debug_entries += 1
+            self._cond.notify_all()
+
+    def _run(self):
+        """ writer thread: write out whatever is queued, in batches """
+        while True:
+            with self._cond:
+                while not self._entries and not self._stopped:
+                    self._cond.wait()
+                if not self._entries:
+                    return
+                batch = list(self._entries)
+                self._entries.clear()
+                self._debug_entries = 0
+                self._writing = True
+                #there is room again for blocked writers
+                self._cond.notify_all()
+            try:
+                for level, entry in batch:
+                    self._write(level, entry)
+            except Exception:
+                #nowhere left to report this; don't take the writer thread down
+                pass
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+    def drain(self):
+        """ waits until everything queued so far is written """
+        with self._cond:
+            while self._entries or self._writing:
+                self._cond.wait()
+
+    def stop(self):
+        """ writes out what is queued and stops the writer thread """
+        self.drain()
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+#file and line of the logging call
+CallerInfo = namedtuple('CallerInfo', ['filename', 'lineno'])
+
+#json string encoder, the same one json.dumps uses for strings
+_encode_str = json.encoder.encode_basestring_ascii
+_string_types = (str, type(u""))
+
+def _encode_key(key):
+    """ json encodes a field name the way json.dumps encodes dict keys """
+    if isinstance(key, _string_types):
+        return _encode_str(key)
+    #rare: let json.dumps convert the key, and strip the surrounding '{' and ': 0}'
+    return json.dumps({key: 0})[1:-4]
+
 class Splogger:
-    def __init__(self, filename=None, system=None, component=None, additional_fields=None, indirection=0):
+    #levels that are written out right away in buffered mode
+    FLUSH_LEVELS = ["ERROR", "EXCEPTION"]
+    #fields written for every entry, ahead of the static fields
+    EVENT_FIELDS = ["utctime", "level", "event", "file", "line"]
+    #environment variable holding the minimum level, used when none is passed in
+    LEVEL_ENV = "SPLOGGER_LEVEL"
+    #unknown values of LEVEL_ENV already reported, so every logger in the process doesn't repeat it
+    _reported_env_levels = set()
+
+    def __init__(self, filename=None, system=None, component=None, additional_fields=None, indirection=0,
+                 buffered=False, buffer_size=65536, flush_interval=1.0, capture_caller=True, level=None,
+                 asynchronous=False, queue_size=10000, overflow=AsyncWriter.DROP_DEBUG):
+        """ buffered mode keeps the log file open and writes in batches: when buffer_size
+        bytes are buffered, every flush_interval seconds, on ERROR and EXCEPTION, and at exit
+        capture_caller=False skips looking up the file and line of the logging call
+        level is the minimum level logged; defaults to $SPLOGGER_LEVEL, or everything.
+        An unknown level raises ValueError, one in $SPLOGGER_LEVEL is ignored with a warning
+        asynchronous mode writes on a dedicated thread, out of a buffer of queue_size
+        entries; overflow is the AsyncWriter policy applied when that buffer is full.
+        Log files written asynchronously are always buffered
+        """
         #if you call 'log' directly, we're 2 frames removed from the call you want to log
         #  -> if the called wrapped the log file, they should add 1 to indirection to log the right call
         self._indirection = indirection + 2
+        self._capture_caller = capture_caller
 
         #system and component
         self._system = system
         self._component = component
-        self._additional_fields = deepcopy(additional_fields) if additional_fields else {}
+        self.set_additional_fields(additional_fields)
         self._loglevels = ["DEBUG","INFO","WARN","ERROR","EXCEPTION"]
+        self.set_level(level or self._env_level())
         self._filename = filename
+        self._writer = None
+        self._async_writer = None
         if filename:
             if not self.verify_filename(filename):
                 self._filename = filename.replace("/", "_")
                 if not self.verify_filename(self._filename):
                     self._filename = "/tmp/splogger_defaut.log"
                     self.exception("unable to open log file %s" % (filename,))
+        if self._filename and (buffered or asynchronous):
+            self._writer = BufferedFileWriter(self._filename, buffer_size, flush_interval)
+        if asynchronous:
+            self._async_writer = AsyncWriter(self._write, queue_size, overflow)
 
     def filename(self):
         return self._filename
 
+    def set_additional_fields(self, additional_fields):
+        """ replaces the fields logged with every entry, and pre-encodes
+        everything that is the same for every entry: system, component
+        and these additional fields
+        """
+        self._additional_fields = deepcopy(additional_fields) if additional_fields else {}
+        static = OrderedDict()
+        if self._system: static["system"] = self._system
+        if self._component: static["component"] = self._component
+        for (k,v) in self._additional_fields.items():
+            static[k] = str(v).replace("\n", " ")
+        self._static_fields = static
+        #keys a per entry field cannot reuse without moving it: fall back to an OrderedDict
+        self._reserved_keys = set(self.EVENT_FIELDS) | set(static)
+        self._static_json = "".join(
+            ", %s: %s" % (_encode_key(k), json.dumps(v)) for (k,v) in static.items()
+        )
+
+    def flush(self):
+        """ writes out buffered or queued entries """
+        if self._async_writer:
+            self._async_writer.drain()
+        if self._writer:
+            self._writer.flush()
+
+    def close(self):
+        """ writes out queued entries, flushes and closes the log file, if buffered """
+        if self._async_writer:
+            self._async_writer.stop()
+        if self._writer:
+            self._writer.close()
+
+    def dropped(self):
+        """ @returns dict - number of entries dropped per level in asynchronous mode """
+        return self._async_writer.dropped() if self._async_writer else {}
+
     def add_loglevel(self, level):
         self._loglevels.append(str(level).upper())
+        self.set_level(self._level)
+
+    def _env_level(self):
+        """ the level in $SPLOGGER_LEVEL, or the lowest one if it is not set or
+        not a known level. A bad value must not stop the process from logging:
+        it is reported on stderr, once
+        """
+        level = os.environ.get(self.LEVEL_ENV, "").strip()
+        if not level:
+            return self._loglevels[0]
+        if level.upper() not in self._loglevels:
+            if level not in Splogger._reported_env_levels:
+                Splogger._reported_env_levels.add(level)
+                sys.stderr.write("splogger: unknown log level %s=%s, logging everything\n" % (self.LEVEL_ENV, level))
+            return self._loglevels[0]
+        return level
+
+    def set_level(self, level):
+        """ sets the minimum level to log. Levels rank in the order they are in
+        the level list; levels not in the list are always logged
+        """
+        level = str(level).upper()
+        if level not in self._loglevels:
+            raise ValueError("unknown log level %s" % (level,))
+        self._level = level
+        rank = self._loglevels.index(level)
+        self._suppressed = set(self._loglevels[:rank])
+
+    def enabled(self, level):
+        """ True if entries of this level are logged """
+        return str(level).upper() not in self._suppressed
 
     def verify_filename(self, filename):
         try:
@@ -77,64 +392,113 @@ class Splogger:
         return IncreasedIndirection()
 
     def caller_info(self):
-        """ gets the stack up to the current frame
-            and then digs down to the interesting call
-            to return a tuple containing the file and line info
+        """ digs down the stack to the interesting call
+            to return a tuple containing the file and line info.
+            Only that one frame is looked at; no source is read
         """
-        of = getouterframes(currentframe())
-        if len(of) > self._indirection:
-            return getframeinfo(of[self._indirection][0])
-        return None
+        if not self._capture_caller:
+            return None
+        try:
+            frame = sys._getframe(self._indirection)
+        except ValueError:
+            #not that many frames on the stack
+            return None
+        return CallerInfo(frame.f_code.co_filename, frame.f_lineno)
 
-    def debug(self, event, **kwargs):
+    def debug(self, event, *args, **kwargs):
+        if "DEBUG" in self._suppressed: return
         with self.increased_indirection():
-            self.log("DEBUG", event, **kwargs)
+            self.log("DEBUG", event, *args, **kwargs)
 
-    def info(self, event, **kwargs):
+    def info(self, event, *args, **kwargs):
+        if "INFO" in self._suppressed: return
         with self.increased_indirection():
-            self.log("INFO", event, **kwargs)
+            self.log("INFO", event, *args, **kwargs)
 
-    def warn(self, event, **kwargs):
+    def warn(self, event, *args, **kwargs):
+        if "WARN" in self._suppressed: return
         with self.increased_indirection():
-            self.log("WARN", event, **kwargs)
+            self.log("WARN", event, *args, **kwargs)
 
-    def error(self, event, **kwargs):
+    def error(self, event, *args, **kwargs):
+        if "ERROR" in self._suppressed: return
         with self.increased_indirection():
-            self.log("ERROR", event, **kwargs)
+            self.log("ERROR", event, *args, **kwargs)
 
-    def exception(self, event, **kwargs):
+    def exception(self, event, *args, **kwargs):
+        if "EXCEPTION" in self._suppressed: return
         with self.increased_indirection():
-            self.log("EXCEPTION", event, **kwargs)
+            self.log("EXCEPTION", event, *args, **kwargs)
 
-    def log(self, level, event, additional_fields=None):
+    def _encode_entry(self, utctime, level, event, filename, line, additional_fields):
+        """ encodes a whole entry at once; used when the per entry
+        fields override event or static fields
+        """
+        entry = OrderedDict()
+        entry["utctime"] = utctime
+        entry["level"] = level
+        entry["event"] = event
+        entry["file"] = filename
+        entry["line"] = line
+        entry.update(self._static_fields)
+        for (k,v) in additional_fields.items():
+            entry[k] = str(v).replace("\n", " ")
+        return "%s\n" % (json.dumps(entry),)
+
+    def log(self, level, event, *args, **kwargs):
         """ logs in splunk compliant format
         DEBUG level for application debugging
         INFO level for symantic logging
         WARN level for recoverable errors or automatic retry situations
         ERROR level for errors that are reported but not handled.
         EXCEPTION level for errors that are safely handled by the system
+        Any args are %-formatted into event, only if the level is logged.
+        The only keyword argument is additional_fields: a dict of fields for this entry
         """
 
         level = str(level).upper()
+        if level in self._suppressed:
+            return
+        additional_fields = kwargs.pop("additional_fields", None)
+        if kwargs:
+            raise TypeError("unexpected keyword arguments: %s" % (", ".join(kwargs),))
+        if args:
+            event = str(event) % args
         if level not in self._loglevels:
             self.log("EXCEPTION", "unconventional log level %s:" % (level,))
         ci = self.caller_info()
 
-        additional_fields = deepcopy(additional_fields) if additional_fields else {}
-        entry = OrderedDict()
-        entry["utctime"] = str(datetime.datetime.utcnow())
-        entry["level"] = level
-        entry["event"] = str(event).replace("\n", " ")
-        entry["file"] = ci.filename if ci else "unknown"
-        entry["line"] = ci.lineno if ci else "unknown"
-        if self._system: entry["system"] = self._system
-        if self._component: entry["component"] = self._component
-        for (k,v) in self._additional_fields.iteritems():
-            entry[k] = str(v).replace("\n", " ")
-        for (k,v) in additional_fields.iteritems():
-            entry[k] = str(v).replace("\n", " ")
-        json_str_entry = "%s\n" % (json.dumps(entry),)
-        if self._filename:
+        utctime = str(datetime.datetime.utcnow())
+        event = str(event).replace("\n", " ")
+        filename = ci.filename if ci else "unknown"
+        line = ci.lineno if ci else "unknown"
+        if additional_fields and not self._reserved_keys.isdisjoint(additional_fields):
+            json_str_entry = self._encode_entry(utctime, level, event, filename, line, additional_fields)
+        else:
+            #only encode what changes per entry; the static fields are encoded already
+            pieces = [
+                '{"utctime": ', _encode_str(utctime),
+                ', "level": ', _encode_str(level),
+                ', "event": ', _encode_str(event),
+                ', "file": ', _encode_str(filename),
+                ', "line": ', json.dumps(line),
+                self._static_json,
+            ]
+            if additional_fields:
+                for (k,v) in additional_fields.items():
+                    pieces.append(", %s: %s" % (_encode_key(k), _encode_str(str(v).replace("\n", " "))))
+            pieces.append("}\n")
+            json_str_entry = "".join(pieces)
+        if self._async_writer:
+            self._async_writer.write(level, json_str_entry)
+        else:
+            self._write(level, json_str_entry)
+
+    def _write(self, level, json_str_entry):
+        """ writes an encoded entry to the log file, or to stdout/stderr """
+        if self._writer:
+            self._writer.write(json_str_entry, flush=level in self.FLUSH_LEVELS)
+        elif self._filename:
             with open(self._filename, "a") as f:
                 f.write(json_str_entry)
         else:
@@ -0,0 +1,72 @@
+#call this as a package: python -m deployment.test.splogbench [-n lines]
+# measures Splogger lines/second for the kind of entries the launcher
+# writes for component output, compared to the original implementation
+from ..splogger import Splogger
+from inspect import currentframe, getframeinfo, getouterframes
+from collections import OrderedDict
+from copy import deepcopy
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+
+class LegacySplogger(Splogger):
+    """ Splogger with the original, per call caller lookup and encoding """
+
+    def caller_info(self):
+        of = getouterframes(currentframe())
+        if len(of) > self._indirection:
+            return getframeinfo(of[self._indirection][0])
+        return None
+
+    def log(self, level, event, additional_fields=None):
+        level = str(level).upper()
+        ci = self.caller_info()
+        additional_fields = deepcopy(additional_fields) if additional_fields else {}
+        entry = OrderedDict()
+        entry["utctime"] = str(datetime.datetime.utcnow())
+        entry["level"] = level
+        entry["event"] = str(event).replace("\n", " ")
+        entry["file"] = ci.filename if ci else "unknown"
+        entry["line"] = ci.lineno if ci else "unknown"
+        if self._system: entry["system"] = self._system
+        if self._component: entry["component"] = self._component
+        for (k,v) in self._additional_fields.items():
+            entry[k] = str(v).replace("\n", " ")
+        for (k,v) in additional_fields.items():
+            entry[k] = str(v).replace("\n", " ")
+        with open(self._filename, "a") as f:
+            f.write("%s\n" % (json.dumps(entry),))
+
+def run(log, lines):
+    """ logs like Launcher.log_component does
+    @returns float - lines per second
+    """
+    proc_data = { "pid" : "12345", "procname" : "htmlrenderer" }
+    line = "stdout: {\"utctime\":\"2015-01-01T00:00:00\",\"level\":\"INFO\",\"event\":\"Polling\"}\n"
+    start = time.time()
+    for i in range(lines):
+        log.info(line, additional_fields=proc_data)
+    log.flush()
+    return lines / (time.time() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Splogger throughput")
+    parser.add_argument('-n','--lines', help='number of lines to log per run', type=int, default=50000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    loggers = [
+        ("original", lambda f: LegacySplogger(f, component="bench")),
+        ("unbuffered", lambda f: Splogger(f, component="bench")),
+        ("buffered", lambda f: Splogger(f, component="bench", buffered=True)),
+        ("buffered, no caller", lambda f: Splogger(f, component="bench", buffered=True, capture_caller=False)),
+    ]
+    for name, make in loggers:
+        filename = os.path.join(tmpdir, name.replace(" ", "_").replace(",", "") + ".log")
+        rate = run(make(filename), args.lines)
+        print("%-20s %10.0f lines/s" % (name, rate))
+        os.remove(filename)
+    os.rmdir(tmpdir)
@@ -1,4 +1,5 @@
 #call this as a package: python -m packager.test.splogtest
+import os
 from ..splogger import Splogger
 
 def splog(msg, log):
@@ -17,4 +18,17 @@ console_log.debug("\"\\")
 fail_log = Splogger(filename="/var/log/balihoo/test")
 fail_log.exception("goes to /tmp/")
 
+#a bad level in the environment logs everything, warning once on stderr
+os.environ[Splogger.LEVEL_ENV] = "LOUD"
+env_log = Splogger()
+assert env_log.enabled("DEBUG")
+assert Splogger().enabled("DEBUG")
+del os.environ[Splogger.LEVEL_ENV]
+#a bad level passed in is a mistake in the code
+try:
+    Splogger(level="LOUD")
+    assert False, "unknown level accepted"
+except ValueError:
+    pass
+
 
@@ -0,0 +1,135 @@
+#call this as a package: python -m deployment.test.uploadtest
+# against a local S3 stand-in, like moto: python -m moto.server -p 5000
+# S3_ENDPOINT overrides where it is, http://localhost:5000 by default,
+# AWS_CLI the aws cli that scripts/ffsync.py downloads with, aws by default
+import os
+import sys
+import stat
+import shutil
+import subprocess
+import hashlib
+import tempfile
+import boto
+from boto.s3.connection import OrdinaryCallingFormat
+from boto.s3.multipart import MultiPartUpload
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+from ..uploader import Uploader
+
+ENDPOINT = os.environ.get("S3_ENDPOINT", "http://localhost:5000")
+AWS_CLI = os.environ.get("AWS_CLI", "aws")
+BUCKET = "uploadtest"
+FFSYNC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts", "ffsync.py")
+
+def connect():
+    url = urlparse(ENDPOINT)
+    return boto.connect_s3(aws_access_key_id="a", aws_secret_access_key="b", host=url.hostname, port=url.port,
+                           is_secure=False, calling_format=OrdinaryCallingFormat())
+
+def uploader(retries=3):
+    return Uploader(BUCKET, "us-west-2", "a", "b", "test", concurrency=4,
+                    part_size=Uploader.MIN_PART_SIZE, retries=retries, endpoint=ENDPOINT)
+
+def package(workdir, name, seed):
+    """ a package dir with a file big enough to go up in parts, and a small one """
+    path = os.path.join(workdir, name)
+    os.makedirs(os.path.join(path, "config"))
+    with open(os.path.join(path, "fulfillment.jar"), "wb") as f:
+        f.write(os.urandom(Uploader.MULTIPART_THRESHOLD + 1024))
+    with open(os.path.join(path, "config", "aws.properties"), "w") as f:
+        f.write("seed=%s\n" % (seed,))
+    return path
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def test_multipart_upload(workdir):
+    """ the big file goes up in parts, and comes back the same """
+    path = package(workdir, "multipart", 1)
+    s3dir = uploader().upload_dir(path)
+    bucket = connect().get_bucket(BUCKET)
+    manifest = bucket.get_key(s3dir + "/" + Uploader.MANIFEST).get_contents_as_string().decode("utf-8")
+    entries = dict((line.split(" ")[3], line.split(" ")[0]) for line in manifest.splitlines())
+    assert sorted(entries) == ["config/aws.properties", "fulfillment.jar"], entries
+    for relpath, h in entries.items():
+        with open(os.path.join(path, relpath), "rb") as f:
+            assert sha256(f.read()) == h, relpath
+        assert sha256(bucket.get_key(Uploader.BLOB_PREFIX + h).get_contents_as_string()) == h, relpath
+    #completed, not left behind
+    jar = Uploader.BLOB_PREFIX + entries["fulfillment.jar"]
+    assert not [u for u in bucket.get_all_multipart_uploads() if u.key_name == jar]
+
+def test_failed_complete_is_cancelled(workdir):
+    """ an upload that cannot be completed is cancelled, and fails with the error
+    that stopped it even when cancelling fails as well
+    """
+    complete, cancel = MultiPartUpload.complete_upload, MultiPartUpload.cancel_upload
+    cancelled = []
+    def fail_complete(self):
+        raise Exception("complete went wrong")
+    def fail_cancel(self):
+        cancelled.append(self.id)
+        raise Exception("cancel went wrong")
+    MultiPartUpload.complete_upload = fail_complete
+    MultiPartUpload.cancel_upload = fail_cancel
+    try:
+        uploader(retries=0).upload_dir(package(workdir, "failing", 2))
+        assert False, "upload did not fail"
+    except Exception as e:
+        assert "complete went wrong" in str(e), str(e)
+    finally:
+        MultiPartUpload.complete_upload, MultiPartUpload.cancel_upload = complete, cancel
+    assert len(cancelled) == 1, cancelled
+    #the cancel that failed on purpose
+    for upload in connect().get_bucket(BUCKET).get_all_multipart_uploads():
+        upload.cancel_upload()
+
+def ffsync(workdir, s3dir, dest, cache):
+    """ run scripts/ffsync.py against the local S3
+    @returns (int, string) - exit code and output
+    """
+    aws = os.path.join(workdir, "aws")
+    with open(aws, "w") as f:
+        f.write('#!/bin/sh\nexec %s --endpoint-url %s "$@"\n' % (AWS_CLI, ENDPOINT))
+    os.chmod(aws, 0o755)
+    proc = subprocess.Popen([sys.executable, FFSYNC, "s3://%s/%s" % (BUCKET, s3dir), dest,
+                             "--cache", cache, "--aws", aws, "--jobs", "4"],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0].decode("utf-8")
+    return proc.returncode, output
+
+def test_sync_round_trip(workdir):
+    """ a package uploaded by manifest comes back the same through ffsync, and a
+    blob that does not match its hash is refused
+    """
+    path = package(workdir, "sync", 3)
+    os.chmod(os.path.join(path, "fulfillment.jar"), 0o750)
+    s3dir = uploader().upload_dir(path)
+    dest = os.path.join(workdir, "sync-dest")
+    code, output = ffsync(workdir, s3dir, dest, os.path.join(workdir, "sync-cache"))
+    assert code == 0, output
+    for relpath in ("fulfillment.jar", os.path.join("config", "aws.properties")):
+        with open(os.path.join(path, relpath), "rb") as f, open(os.path.join(dest, relpath), "rb") as g:
+            assert f.read() == g.read(), relpath
+        assert stat.S_IMODE(os.stat(os.path.join(path, relpath)).st_mode) == \
+               stat.S_IMODE(os.stat(os.path.join(dest, relpath)).st_mode), relpath
+    #the blob of the small file, changed in the store: an empty cache downloads it again
+    with open(os.path.join(path, "config", "aws.properties"), "rb") as f:
+        h = sha256(f.read())
+    connect().get_bucket(BUCKET).new_key(Uploader.BLOB_PREFIX + h).set_contents_from_string("seed=tampered\n")
+    code, output = ffsync(workdir, s3dir, os.path.join(workdir, "sync-bad"), os.path.join(workdir, "sync-badcache"))
+    assert code != 0 and "missing or corrupt" in output, output
+    assert not os.path.exists(os.path.join(workdir, "sync-bad", "config")), output
+
+if __name__ == "__main__":
+    connect().create_bucket(BUCKET)
+    workdir = tempfile.mkdtemp(prefix="uploadtest-")
+    try:
+        test_multipart_upload(workdir)
+        test_failed_complete_is_cancelled(workdir)
+        test_sync_round_trip(workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("ok")
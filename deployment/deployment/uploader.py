@@ -1,37 +1,300 @@
 import boto.s3 as awss3
 import boto
+import boto.utils
+from boto.s3.connection import OrdinaryCallingFormat
+from boto.s3.multipart import MultiPartUpload
+from threading import Thread, Lock, local
 import os, sys
+import stat
+import hashlib
+import random
+import time
+import datetime
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+def file_hash(path):
+    """ @returns string - hex sha256 of a file's content """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
 class Uploader(object):
+    """ Uploads a package directory to S3 on a number of threads. Big files
+    go up as multipart uploads, their parts spread over the same threads.
+    Every file and part is retried on failure.
+    Files are stored once, as blobs named by the hash of their content; a
+    deploy uploads the blobs S3 does not have yet and a manifest listing the
+    files of the package. deployment/scripts/ffsync.py downloads it again.
+    collect_garbage deletes the blobs no recent deploy uses
+    """
 
-    def __init__(self, s3bucket, region, access_key, secret_key, env):
-        #self._conn = awss3.connect_to_region(
-        #    region,
-        self._conn = boto.connect_s3 (
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key
-        )
+    #content addressed store of package files, shared by all deploys in the bucket
+    BLOB_PREFIX = "blobs/"
+    #name of the manifest in the deploy's s3 dir. A line per file:
+    # <sha256> <octal mode> <size> <path relative to the package>
+    MANIFEST = "manifest"
+
+    #deploys write their manifest after their blobs: newer blobs may belong to one in progress
+    BLOB_MIN_AGE_DAYS = 7
+
+    #files at least this big are uploaded in parts
+    MULTIPART_THRESHOLD = 16 * 1024 * 1024
+    #S3 takes parts of at least 5MB, except for the last one
+    MIN_PART_SIZE = 5 * 1024 * 1024
+    #backoff between retries, in seconds
+    RETRY_BASE = 0.5
+    RETRY_CAP = 10.0
+
+    def __init__(self, s3bucket, region, access_key, secret_key, env,
+                 concurrency=8, part_size=8 * 1024 * 1024, retries=3, endpoint=None):
+        """ Uploader constructor
+        @param concurrency int - number of files or parts uploaded at the same time
+        @param part_size int - bytes per part of a multipart upload
+        @param retries int - times a file or part is retried before the upload fails
+        @param endpoint string - optional url of an S3 compatible service to use
+            instead of S3, like http://localhost:5000
+        """
         self._s3bucket_name = s3bucket
-        self._s3bucket = self._conn.get_bucket(self._s3bucket_name)
         self._env = env
+        self._access_key = access_key
+        self._secret_key = secret_key
+        self._endpoint = endpoint
+        self._concurrency = max(1, concurrency)
+        self._part_size = max(self.MIN_PART_SIZE, part_size)
+        self._retries = retries
+        #boto connections are not shared between threads
+        self._local = local()
+        self._lock = Lock()
+        #checks the bucket exists before anything is queued
+        self._bucket()
+
+    def _connect(self):
+        if not self._endpoint:
+            #self._conn = awss3.connect_to_region(
+            #    region,
+            return boto.connect_s3 (
+                aws_access_key_id=self._access_key,
+                aws_secret_access_key=self._secret_key
+            )
+        url = urlparse(self._endpoint)
+        return boto.connect_s3(
+            aws_access_key_id=self._access_key,
+            aws_secret_access_key=self._secret_key,
+            host=url.hostname,
+            port=url.port,
+            is_secure=url.scheme == "https",
+            calling_format=OrdinaryCallingFormat()
+        )
+
+    def _bucket(self):
+        """ the bucket, through a connection of the calling thread """
+        bucket = getattr(self._local, "bucket", None)
+        if bucket is None:
+            bucket = self._local.bucket = self._connect().get_bucket(self._s3bucket_name)
+        return bucket
+
+    def _retry(self, name, f, *args):
+        """ call f until it succeeds or runs out of retries, then raise """
+        attempt = 0
+        while True:
+            try:
+                return f(*args)
+            except Exception as e:
+                if attempt >= self._retries:
+                    raise
+                delay = random.uniform(0, min(self.RETRY_CAP, self.RETRY_BASE * (2 ** attempt)))
+                attempt += 1
+                print("retrying %s in %.1f seconds: %s" % (name, delay, str(e)))
+                time.sleep(delay)
+
+    def _progress(self, nbytes, files=0):
+        """ count uploaded bytes and files; report every finished file """
+        with self._lock:
+            self._done_bytes += nbytes
+            self._done_files += files
+            if files:
+                elapsed = max(time.time() - self._start, 0.001)
+                print("%d/%d files, %.1f/%.1f MB, %.1f MB/s" % (
+                    self._done_files, self._total_files,
+                    self._done_bytes / 1048576.0, self._total_bytes / 1048576.0,
+                    self._done_bytes / 1048576.0 / elapsed))
+
+    def _upload_file(self, localpath, s3path, size):
+        def put():
+            self._bucket().new_key(s3path).set_contents_from_filename(localpath)
+        self._retry(s3path, put)
+        print("uploaded %s to %s" % (localpath, s3path))
+        self._progress(size, 1)
+
+    def _start_multipart(self, localpath, s3path, size, jobs):
+        """ start a multipart upload and queue its parts. The part that finishes last completes it """
+        mp = self._retry(s3path, self._bucket().initiate_multipart_upload, s3path)
+        offsets = range(0, size, self._part_size)
+        state = { "left": len(offsets), "failed": False }
+
+        def part(number, offset):
+            if state["failed"]:
+                #another part gave up, the upload is cancelled
+                return
+            length = min(self._part_size, size - offset)
+            #bound to this thread's connection
+            upload = MultiPartUpload(self._bucket())
+            upload.key_name, upload.id = s3path, mp.id
+            def put():
+                with open(localpath, "rb") as f:
+                    f.seek(offset)
+                    upload.upload_part_from_file(f, number, size=length)
+            try:
+                self._retry("%s part %d" % (s3path, number), put)
+            except Exception:
+                with self._lock:
+                    first = not state["failed"]
+                    state["failed"] = True
+                if first:
+                    self._cancel(upload, s3path)
+                    raise
+                return
+            self._progress(length)
+            with self._lock:
+                state["left"] -= 1
+                last = state["left"] == 0 and not state["failed"]
+            if last:
+                try:
+                    self._retry(s3path, upload.complete_upload)
+                except Exception:
+                    self._cancel(upload, s3path)
+                    raise
+                print("uploaded %s to %s in %d parts" % (localpath, s3path, len(offsets)))
+                self._progress(0, 1)
+
+        for number, offset in enumerate(offsets):
+            jobs.put((part, (number + 1, offset)))
+
+    def _cancel(self, upload, s3path):
+        """ abort a multipart upload so S3 drops its parts. A failure to do so
+        is only reported, the error that led here is the one to raise
+        """
+        try:
+            upload.cancel_upload()
+        except Exception as e:
+            print("unable to cancel the upload of %s: %s" % (s3path, str(e)))
+
+    def _work(self, jobs, errors):
+        """ upload thread: run jobs until told to stop """
+        while True:
+            job = jobs.get()
+            try:
+                if job is None:
+                    return
+                f, args = job
+                f(*args)
+            except Exception as e:
+                with self._lock:
+                    errors.append(str(e))
+            finally:
+                jobs.task_done()
 
     def upload_dir(self, srcpath):
         if os.path.isdir(srcpath):
             subdirs = os.path.join("deployments", self._env)
             predirs, dirname = os.path.split(srcpath)
-            dirnameindex = len(predirs)
-            if dirnameindex > 0:
-                dirnameindex += 1
+            entries = []
             for root, subs, files in os.walk(srcpath):
-                #abs path may have been provided, but we
-                #only need the part from the dirname and on
-                reldir = os.path.join(subdirs, root[dirnameindex:])
                 for f in files:
-                    s3path = os.path.join(reldir, f)
                     localpath = os.path.join(root, f)
-                    s3key = self._s3bucket.new_key(s3path)
-                    s3key.set_contents_from_filename(localpath)
-                    print("uploaded %s to %s" % (localpath, s3path))
-            return os.path.join(subdirs,dirname)
+                    relpath = os.path.relpath(localpath, srcpath).replace(os.sep, "/")
+                    st = os.stat(localpath)
+                    entries.append((file_hash(localpath), stat.S_IMODE(st.st_mode), st.st_size, relpath, localpath))
+            existing = self._existing_blobs()
+            uploads = {}
+            for h, mode, size, relpath, localpath in entries:
+                if h not in existing:
+                    uploads[h] = (localpath, self.BLOB_PREFIX + h, size)
+            print("%d of %d files are new: %.1f of %.1f MB to upload" % (
+                len(uploads), len(entries),
+                sum(u[2] for u in uploads.values()) / 1048576.0, sum(e[2] for e in entries) / 1048576.0))
+            self._upload(list(uploads.values()))
+            #the manifest goes up last, once all its blobs are there
+            s3dir = os.path.join(subdirs, dirname)
+            manifest = "".join("%s %o %d %s\n" % e[:4] for e in sorted(entries, key=lambda e: e[3]))
+            manifest_path = os.path.join(s3dir, self.MANIFEST)
+            self._retry(manifest_path, lambda: self._bucket().new_key(manifest_path).set_contents_from_string(manifest))
+            print("uploaded manifest to %s" % (manifest_path,))
+            return s3dir
         else:
             raise Exception("Unable to upload: %s is not a directory" % (srcpath,))
+
+    def collect_garbage(self, keep):
+        """ delete the blobs that the last keep deploys of every environment do
+        not use, unless they were uploaded less than BLOB_MIN_AGE_DAYS ago.
+        Older deploys cannot be installed anymore once their blobs are gone
+        @param keep int - number of deploys per environment to keep the blobs of
+        @returns int - number of blobs deleted
+        """
+        bucket = self._bucket()
+        manifests = {}
+        for key in bucket.list(prefix="deployments/"):
+            if key.name.endswith("/" + self.MANIFEST):
+                manifests.setdefault(key.name.split("/")[1], []).append(key)
+        used = set()
+        for env, keys in manifests.items():
+            for key in sorted(keys, key=lambda k: k.last_modified, reverse=True)[:keep]:
+                manifest = self._retry(key.name, key.get_contents_as_string).decode("utf-8")
+                used.update(line.split(" ", 1)[0] for line in manifest.splitlines() if line)
+        if not used:
+            #nothing to go by, don't take everything down
+            return 0
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=self.BLOB_MIN_AGE_DAYS)
+        unused = [key.name for key in bucket.list(prefix=self.BLOB_PREFIX)
+                  if key.name[len(self.BLOB_PREFIX):] not in used
+                  and boto.utils.parse_ts(key.last_modified) < cutoff]
+        #up to 1000 keys per request
+        for i in range(0, len(unused), 1000):
+            self._retry("delete blobs", bucket.delete_keys, unused[i:i + 1000])
+        print("deleted %d blobs not used by the last %d deploys of %s" % (len(unused), keep, ", ".join(sorted(manifests))))
+        return len(unused)
+
+    def _existing_blobs(self):
+        """ @returns set of strings - hashes of the blobs already in the bucket """
+        return set(key.name[len(self.BLOB_PREFIX):] for key in self._bucket().list(prefix=self.BLOB_PREFIX))
+
+    def _upload(self, uploads):
+        """ upload files on the thread pool, biggest first so they don't finish last
+        @param uploads list of (local path, s3 path, size)
+        """
+        self._start = time.time()
+        self._done_bytes = self._done_files = 0
+        self._total_bytes = sum(u[2] for u in uploads)
+        self._total_files = len(uploads)
+        jobs = queue.Queue()
+        errors = []
+        for localpath, s3path, size in sorted(uploads, key=lambda u: -u[2]):
+            if size >= self.MULTIPART_THRESHOLD:
+                jobs.put((self._start_multipart, (localpath, s3path, size, jobs)))
+            else:
+                jobs.put((self._upload_file, (localpath, s3path, size)))
+        threads = [Thread(target=self._work, args=(jobs, errors), name="upload-%d" % (i,))
+                   for i in range(self._concurrency)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        #multipart jobs queue their parts before they are done, so this waits for those too
+        jobs.join()
+        for t in threads:
+            jobs.put(None)
+        for t in threads:
+            t.join()
+        elapsed = max(time.time() - self._start, 0.001)
+        print("uploaded %d files, %.1f MB in %.1f seconds: %.1f MB/s" % (
+            self._done_files, self._done_bytes / 1048576.0, elapsed, self._done_bytes / 1048576.0 / elapsed))
+        if errors:
+            raise Exception("Unable to upload: %s" % ("; ".join(errors),))
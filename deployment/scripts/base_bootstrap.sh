@@ -1,6 +1,7 @@
 #set up vars and init logfiles
 LOGFILE=/tmp/bootstrap.log
 FFDIR=/opt/balihoo/fulfillment
+FFCACHE=/var/cache/balihoo/fulfillment
 
 log() {
     echo "$1" >> ${LOGFILE} 2>&1
@@ -45,8 +46,13 @@ log "installed bundle"
 
 S3APPURL="s3://${S3BUCKET}/${S3DIR}"
 log "downloading fulfillment application"
-logdo "mkdir -p ${FFDIR}"
-logdo "/usr/local/bin/aws s3 sync ${S3APPURL} ${FFDIR}"
+logdo "mkdir -p ${FFDIR} ${FFCACHE}"
+#files are blobs named by their hash, listed in the manifest. ffsync fetches the ones
+# not in the cache, all of them on a new instance; it is one of them itself
+logdo "/usr/local/bin/aws s3 cp ${S3APPURL}/manifest ${FFCACHE}/manifest"
+FFSYNCHASH=$(awk '$4 == "ffsync.py" { print $1 }' ${FFCACHE}/manifest)
+logdo "/usr/local/bin/aws s3 cp s3://${S3BUCKET}/blobs/${FFSYNCHASH} ${FFCACHE}/ffsync.py"
+logdo "python ${FFCACHE}/ffsync.py ${S3APPURL} ${FFDIR} --cache ${FFCACHE}"
 
 OSID=$(uname -srvm | sed "s/\W/_/g")
 VEACTIVATE="source ${VEDIR}/activate"
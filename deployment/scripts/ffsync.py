@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#downloads a deployed package by its manifest, see deployment/uploader.py:
+# every file is a blob in s3://<bucket>/blobs/, named by the sha256 of its content.
+# Blobs are kept in a local cache: syncing again, to a later deploy, only downloads
+# the blobs that deploy added. A new instance starts with an empty cache and
+# downloads them all. Runs before the virtualenv exists: standard library and the aws cli only
+import os
+import argparse
+import hashlib
+import shutil
+import subprocess
+import tempfile
+from threading import Thread, Lock
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+BLOB_PREFIX = "blobs/"
+MANIFEST = "manifest"
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def read_manifest(path):
+    """ @returns list of (hash, mode, size, relative path) """
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                h, mode, size, relpath = line.split(" ", 3)
+                entries.append((h, int(mode, 8), int(size), relpath))
+    return entries
+
+def fetch_blobs(aws, bucket, hashes, cache, jobs):
+    """ download blobs into the cache by key, jobs at a time, verified against their name
+    @returns int - bytes downloaded
+    """
+    incoming = tempfile.mkdtemp(dir=cache, prefix="incoming-")
+    try:
+        hashes = sorted(hashes)
+        pending = queue.Queue()
+        for h in hashes:
+            pending.put(h)
+        errors = []
+        lock = Lock()
+
+        def work():
+            while True:
+                try:
+                    h = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    subprocess.check_call([aws, "s3", "cp", "--quiet",
+                        "s3://%s/%s%s" % (bucket, BLOB_PREFIX, h), os.path.join(incoming, h)])
+                except Exception as e:
+                    with lock:
+                        errors.append("%s: %s" % (h, str(e)))
+
+        threads = [Thread(target=work) for _ in range(max(1, min(jobs, len(hashes))))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise Exception("unable to download %d blobs: %s" % (len(errors), "; ".join(errors[:5])))
+        fetched = 0
+        for h in hashes:
+            path = os.path.join(incoming, h)
+            if not os.path.isfile(path) or file_hash(path) != h:
+                raise Exception("blob %s is missing or corrupt" % (h,))
+            fetched += os.path.getsize(path)
+            os.rename(path, os.path.join(cache, h))
+        return fetched
+    finally:
+        shutil.rmtree(incoming, ignore_errors=True)
+
+def install(entries, cache, dest):
+    """ copy blobs from the cache to their place in dest, skipping files that are already there
+    @returns int - number of files written
+    """
+    written = 0
+    for h, mode, size, relpath in entries:
+        path = os.path.join(dest, *relpath.split("/"))
+        if os.path.isfile(path) and os.path.getsize(path) == size and file_hash(path) == h:
+            os.chmod(path, mode)
+            continue
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp = path + ".ffsync"
+        shutil.copyfile(os.path.join(cache, h), tmp)
+        os.chmod(tmp, mode)
+        os.rename(tmp, path)
+        written += 1
+    return written
+
+def main():
+    parser = argparse.ArgumentParser("Download a deployed Fulfillment package by its manifest")
+    parser.add_argument('url', help='the s3 dir of the deploy, s3://<bucket>/deployments/<env>/<package>')
+    parser.add_argument('dest', help='directory to install the package in')
+    parser.add_argument('--cache', help='where to keep downloaded blobs', default='/var/cache/balihoo/fulfillment')
+    parser.add_argument('--aws', help='the aws cli', default='/usr/local/bin/aws')
+    parser.add_argument('--jobs', help='number of blobs downloaded at the same time', default='8')
+    args = parser.parse_args()
+
+    if not args.url.startswith("s3://"):
+        raise Exception("not an s3 url: %s" % (args.url,))
+    bucket = args.url[len("s3://"):].split("/", 1)[0]
+    for d in (args.cache, args.dest):
+        if not os.path.isdir(d):
+            os.makedirs(d)
+
+    manifest = os.path.join(args.cache, MANIFEST)
+    subprocess.check_call([args.aws, "s3", "cp", "--quiet", args.url.rstrip("/") + "/" + MANIFEST, manifest])
+    entries = read_manifest(manifest)
+    missing = set(e[0] for e in entries if not os.path.isfile(os.path.join(args.cache, e[0])))
+    fetched = fetch_blobs(args.aws, bucket, missing, args.cache, int(args.jobs)) if missing else 0
+    written = install(entries, args.cache, args.dest)
+    print("%d files, %d blobs downloaded (%.1f MB), %d from cache, %d files written" % (
+        len(entries), len(missing), fetched / 1048576.0, len(set(e[0] for e in entries)) - len(missing), written))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import boto.swf
+from properties import PropertiesLoader
+
+
+class SwfBacklog(object):
+    """ Backlog source: the number of pending activity tasks on a task list, from SWF """
+
+    def __init__(self, region_name):
+        """ @param region_name string - the SWF region, like us-west-2 """
+        self._swf = boto.swf.connect_to_region(region_name)
+
+    def pending(self, domain, task_list):
+        """ @returns int - number of tasks waiting to be picked up """
+        return int(self._swf.count_pending_activity_tasks(domain, task_list)["count"])
+
+
+class StaticBacklog(object):
+    """ Backlog source for tests and local runs: counts set by hand,
+    or read from a properties file of task_list=count lines, reread when it changes
+    """
+
+    def __init__(self, counts=None, path=None):
+        """ @param counts dictionary - task list -> pending count
+        @param path string - optional properties file with more counts
+        """
+        self._counts = dict(counts or {})
+        self._path = path
+        self._loader = PropertiesLoader()
+
+    def set(self, task_list, count):
+        self._counts[task_list] = count
+
+    def pending(self, domain, task_list):
+        """ @returns int - the count set for the task list, 0 if none, any domain """
+        if self._path:
+            value = self._loader.load(self._path).get(task_list)
+            if value is not None:
+                return int(value)
+        return self._counts.get(task_list, 0)
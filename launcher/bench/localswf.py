@@ -0,0 +1,165 @@
+import time
+import random
+import itertools
+from collections import deque
+from threading import Condition, Lock
+from boto.exception import SWFResponseError
+from boto.swf.exceptions import SWFTypeAlreadyExistsError
+
+
+class LocalSwf(object):
+    """ In-process stand-in for the part of the SWF Layer1 api the launcher
+    uses: registering an activity type, polling for activity tasks, responding
+    completed or failed, and counting pending tasks. Pass it to SwfWorker as
+    its connection. Tasks are added with schedule; every call can be slowed
+    down, throttled or made to fail, to see how the poller and responder cope.
+    Errors look like the ones boto raises for SWF
+    """
+
+    THROTTLED = { "__type": "com.amazon.coral.availability#ThrottlingException", "message": "Rate exceeded" }
+    UNAVAILABLE = { "__type": "com.amazon.coral.service#InternalFailure", "message": "injected error" }
+    UNKNOWN_TASK = { "__type": "com.amazonaws.swf.base.model#UnknownResourceFault", "message": "Unknown task token" }
+
+    def __init__(self, latency=0.0, jitter=0.0, max_rate=0, error_rate=0.0, poll_timeout=60.0, seed=None):
+        """ LocalSwf constructor
+        @param latency float - seconds every call takes, before it does anything
+        @param jitter float - up to this many seconds more, at random
+        @param max_rate float - calls per second over which calls are throttled, 0 for no limit
+        @param error_rate float - fraction of calls that fail with an internal error
+        @param poll_timeout float - seconds a poll waits for a task, SWF waits 60
+        @param seed - seeds the jitter and errors, for runs that can be repeated
+        """
+        self._latency = latency
+        self._jitter = jitter
+        self._max_rate = max_rate
+        self._error_rate = error_rate
+        self._poll_timeout = poll_timeout
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._available = Condition(self._lock)
+        #(domain, task list) -> deque of task tokens
+        self._pending = {}
+        #task token -> dictionary with the task and the times it went through
+        self._tasks = {}
+        self._types = set()
+        self._ids = itertools.count(1)
+        #token bucket for throttling
+        self._tokens = max_rate
+        self._refilled = time.time()
+        self._stats = { "calls": 0, "throttled": 0, "errors": 0, "polls": 0, "empty_polls": 0 }
+
+    def _call(self):
+        """ what happens to every call before it does its work: latency,
+        then throttling, then injected errors
+        """
+        with self._lock:
+            delay = self._latency + self._random.uniform(0, self._jitter)
+            fail = self._random.random() < self._error_rate
+            self._stats["calls"] += 1
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            if self._max_rate:
+                now = time.time()
+                self._tokens = min(self._max_rate, self._tokens + (now - self._refilled) * self._max_rate)
+                self._refilled = now
+                if self._tokens < 1:
+                    self._stats["throttled"] += 1
+                    raise SWFResponseError(400, "Bad Request", self.THROTTLED)
+                self._tokens -= 1
+            if fail:
+                self._stats["errors"] += 1
+                raise SWFResponseError(500, "Internal Server Error", self.UNAVAILABLE)
+
+    def schedule(self, domain, task_list, input):
+        """ add an activity task, as a decider would
+        @param input string - the task input
+        @returns string - the task token
+        """
+        with self._lock:
+            activity_id = str(next(self._ids))
+            token = "token-" + activity_id
+            self._tasks[token] = {
+                "activityId": activity_id,
+                "taskToken": token,
+                "input": input,
+                "scheduled": time.time(),
+                "started": None,
+                "closed": None,
+                "status": "SCHEDULED",
+                "result": None,
+            }
+            self._pending.setdefault((domain, task_list), deque()).append(token)
+            self._available.notify()
+        return token
+
+    def register_activity_type(self, domain, name, version, task_list=None, **kwargs):
+        self._call()
+        with self._lock:
+            if (domain, name, version) in self._types:
+                raise SWFTypeAlreadyExistsError(400, "Bad Request", {
+                    "__type": "com.amazonaws.swf.base.model#TypeAlreadyExistsFault",
+                    "message": "%s-%s" % (name, version),
+                })
+            self._types.add((domain, name, version))
+
+    def poll_for_activity_task(self, domain, task_list, identity=None):
+        """ waits up to the poll timeout for a task
+        @returns dictionary - the task, like SWF returns it, or without activityId if none came
+        """
+        self._call()
+        deadline = time.time() + self._poll_timeout
+        with self._lock:
+            self._stats["polls"] += 1
+            pending = self._pending.setdefault((domain, task_list), deque())
+            while not pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._stats["empty_polls"] += 1
+                    return { "startedEventId": 0 }
+                self._available.wait(remaining)
+            task = self._tasks[pending.popleft()]
+            task["started"] = time.time()
+            task["status"] = "STARTED"
+            return {
+                "activityId": task["activityId"],
+                "taskToken": task["taskToken"],
+                "input": task["input"],
+                "startedEventId": int(task["activityId"]),
+                "activityType": { "name": task_list, "version": "1" },
+                "workflowExecution": { "workflowId": "local", "runId": "local" },
+            }
+
+    def _close(self, task_token, status, result):
+        self._call()
+        with self._lock:
+            task = self._tasks.get(task_token)
+            if task is None or task["status"] != "STARTED":
+                raise SWFResponseError(400, "Bad Request", self.UNKNOWN_TASK)
+            task["closed"] = time.time()
+            task["status"] = status
+            task["result"] = result
+
+    def respond_activity_task_completed(self, task_token, result=None):
+        self._close(task_token, "COMPLETED", result)
+
+    def respond_activity_task_failed(self, task_token, details=None, reason=None):
+        self._close(task_token, "FAILED", details)
+
+    def count_pending_activity_tasks(self, domain, task_list):
+        self._call()
+        with self._lock:
+            return { "count": len(self._pending.get((domain, task_list), ())), "truncated": False }
+
+    def tasks(self):
+        """ @returns list of dictionaries - copies of all tasks, with the times
+        they were scheduled, started and closed, and their status and result
+        """
+        with self._lock:
+            return [dict(task) for task in self._tasks.values()]
+
+    def stats(self):
+        """ @returns dictionary - numbers of calls, throttled and failed calls, and polls """
+        with self._lock:
+            return dict(self._stats)
+
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#fake JVM component for the supervision benchmark, see supervision.py
+# called like the java command line: stub.py [-Dkey=value...] bench.<profile>_<n>
+# behaviour comes from the profile, in $LAUNCHER_BENCH_PROFILES:
+#   rate: stdout lines per second, 0 for none
+#   silent_after: seconds after which it stops talking, null for never
+#   deaf: ignore ping and quit on stdin
+#   lifetime: mean seconds until it crashes, exponentially distributed, null for never
+# the crash time is written to $LAUNCHER_BENCH_DIR/<pid>.exit, to measure how long
+# the launcher takes to notice
+import os
+import sys
+import json
+import time
+import random
+import select
+
+HEARTBEAT_PROPERTY = "-Dfulfillment.heartbeat="
+
+
+def launch_number(directory, name):
+    """ counts the launches of a component, so every relaunch gets its own random sequence """
+    path = os.path.join(directory, name + ".launches")
+    try:
+        with open(path) as f:
+            n = int(f.read()) + 1
+    except (IOError, ValueError):
+        n = 1
+    with open(path, "w") as f:
+        f.write(str(n))
+    return n
+
+
+def main(args):
+    classpath = args[-1]
+    heartbeat = [a[len(HEARTBEAT_PROPERTY):] for a in args if a.startswith(HEARTBEAT_PROPERTY)]
+    name = classpath.split(".")[-1]
+    profile = json.loads(os.environ["LAUNCHER_BENCH_PROFILES"])[name.rsplit("_", 1)[0]]
+    directory = os.environ["LAUNCHER_BENCH_DIR"]
+    rng = random.Random("%s-%s-%d" % (os.environ.get("LAUNCHER_BENCH_SEED", "0"), name, launch_number(directory, name)))
+
+    start = time.time()
+    rate = profile.get("rate") or 0
+    silent_after = profile.get("silent_after")
+    lifetime = profile.get("lifetime")
+    deaf = profile.get("deaf", False)
+    die_at = start + rng.expovariate(1.0 / lifetime) if lifetime else None
+    next_line = start
+    next_frame = start
+    frames = open(heartbeat[0], "w") if heartbeat else None
+    lines = 0
+
+    sys.stdout.write("%s started\n" % (name,))
+    sys.stdout.flush()
+    while True:
+        now = time.time()
+        if die_at is not None and now >= die_at:
+            with open(os.path.join(directory, "%d.exit" % (os.getpid(),)), "w") as f:
+                f.write(repr(time.time()))
+            sys.stderr.write("crashing\n")
+            sys.stderr.flush()
+            os._exit(1)
+        talking = rate and (silent_after is None or now - start < silent_after)
+        if talking and now >= next_line:
+            lines += 1
+            sys.stdout.write('{"utctime":"%s","level":"INFO","event":"working on task %d"}\n' % (now, lines))
+            sys.stdout.flush()
+            #don't burst to catch up after a stall
+            next_line = max(next_line + 1.0 / rate, now)
+        if frames and talking and now >= next_frame:
+            frames.write(json.dumps({"name": name, "status": "Working", "idle": 0, "completed": lines}) + "\n")
+            frames.flush()
+            next_frame = now + 1.0
+        wakes = [t for t in (next_line if talking else None, die_at) if t is not None]
+        timeout = max(0, min(wakes) - time.time()) if wakes else None
+        readable, _, _ = select.select([0], [], [], timeout)
+        if readable:
+            #unbuffered, so select never misses a line sitting in a buffer
+            data = os.read(0, 4096)
+            if not data:
+                #launcher gone
+                return 0
+            for command in data.decode().split():
+                if deaf:
+                    continue
+                if command == "ping":
+                    sys.stdout.write("pong\n")
+                    sys.stdout.flush()
+                elif command == "quit":
+                    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
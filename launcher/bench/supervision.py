@@ -0,0 +1,259 @@
+#call this as: python launcher/bench/supervision.py [-n 10,100,500] [-d seconds] [--seed n]
+# measures the launcher supervising stub components instead of JVMs, see stub.py:
+# launcher cpu, rss and threads, log lines/second, and how long it takes to notice
+# a crash and to relaunch. Every component count runs in a fresh process. Crash times
+# and the profile mix are seeded, so runs with the same arguments can be compared:
+# save one with --output, compare a later one against it with --compare
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+STUB = os.path.join(BENCH_DIR, "stub.py")
+
+#stub behaviours, see stub.py
+PROFILES = {
+    "chatty": { "rate": 20 },
+    "quiet": { "rate": 0.2 },
+    "crashy": { "rate": 2, "lifetime": 10 },
+    "silent": { "rate": 2, "silent_after": 2 },
+    "deaf": { "rate": 0, "deaf": True },
+}
+#percentage of the components running each profile
+DEFAULT_MIX = "chatty=40,quiet=30,crashy=15,silent=10,deaf=5"
+
+#short enough for silent and deaf stubs to go through ping, quit and terminate in a run
+TIMEOUTS = (3, 6, 9, 12)
+
+#metrics in the report, lower is better for all of them except lines/s
+COLUMNS = [
+    ("cpu", "cpu %", 100.0),
+    ("rss_mb", "rss MB", 1.0),
+    ("threads", "threads", 1),
+    ("log_lines_per_second", "lines/s", 1.0),
+    ("detect_p50", "detect p50 ms", 1000.0),
+    ("detect_p99", "detect p99 ms", 1000.0),
+    ("restart_p50", "restart p50 ms", 1000.0),
+    ("restart_p99", "restart p99 ms", 1000.0),
+]
+
+
+def parse_mix(mix):
+    """ @returns list of (profile, weight) """
+    pairs = [p.split("=") for p in mix.split(",") if p]
+    return [(name.strip(), float(weight)) for name, weight in pairs]
+
+
+def assign(count, mix):
+    """ spreads profiles over count components in proportion to their weights,
+    the same way every time
+    @returns list of profile names
+    """
+    total = sum(weight for _, weight in mix)
+    names = []
+    for i in range(count):
+        position = (i + 0.5) / count * total
+        for name, weight in mix:
+            if position < weight:
+                break
+            position -= weight
+        names.append(name)
+    return names
+
+
+def percentile(values, p):
+    """ nearest rank percentile, None without values """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+def count_lines(path):
+    try:
+        with open(path, "rb") as f:
+            return sum(1 for _ in f)
+    except IOError:
+        return 0
+
+
+def trial(args):
+    """ runs the launcher on stub components until the measurement is done,
+    then prints the result as a line of json and exits
+    """
+    from launcher import Launcher, Timeouts, RelaunchPolicy, LaunchPolicy
+    from hoststats import HostStats
+    import component
+
+    workdir = tempfile.mkdtemp(prefix="launcher-bench-")
+    profiles = dict(PROFILES)
+    if args.profiles:
+        with open(args.profiles) as f:
+            profiles.update(json.load(f))
+    os.environ["LAUNCHER_BENCH_PROFILES"] = json.dumps(profiles)
+    os.environ["LAUNCHER_BENCH_DIR"] = workdir
+    os.environ["LAUNCHER_BENCH_SEED"] = str(args.seed)
+
+    #the launcher inserts -D options after the first word, so that has to be the stub itself
+    java = os.path.join(workdir, "java")
+    with open(java, "w") as f:
+        f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, STUB))
+    os.chmod(java, 0o755)
+    component.Component.java_cmdline = staticmethod(lambda jar, nragent_path=None: [java])
+
+    #time a crash was noticed, and a relaunch done, by the crash time the stub wrote
+    detect, restart = [], []
+    crashed = {}
+    schedule_relaunch = Launcher.schedule_relaunch
+    launch = component.Component.launch
+
+    def timed_schedule_relaunch(self, c, relaunch):
+        path = os.path.join(workdir, "%d.exit" % (c.pid,))
+        try:
+            with open(path) as f:
+                crash = float(f.read())
+            os.remove(path)
+            detect.append(time.time() - crash)
+            crashed[c] = crash
+        except (IOError, ValueError):
+            #terminated or killed, not crashed
+            pass
+        return schedule_relaunch(self, c, relaunch)
+
+    def timed_launch(self):
+        pid = launch(self)
+        crash = crashed.pop(self, None)
+        if crash is not None:
+            restart.append(time.time() - crash)
+        return pid
+
+    Launcher.schedule_relaunch = timed_schedule_relaunch
+    component.Component.launch = timed_launch
+
+    logfile = os.path.join(workdir, "launcher.log")
+    launcher = Launcher(
+        os.path.join(workdir, "bench.jar"),
+        logfile,
+        launch_policy=LaunchPolicy(max_starting=args.count, startup_grace=30, max_cpu=1.0, min_free_mb=0),
+        heartbeat=not args.noheartbeat,
+    )
+    names = assign(args.count, parse_mix(args.mix))
+    launcher.launch(["bench.%s_%d" % (name, i) for i, name in enumerate(names)])
+
+    def measure():
+        host = HostStats()
+        pid = os.getpid()
+        time.sleep(args.warmup)
+        del detect[:], restart[:]
+        launcher._log.flush()
+        lines = count_lines(logfile)
+        first = host.processes([pid])[pid]
+        start = time.time()
+        samples = []
+        while time.time() - start < args.duration:
+            time.sleep(1.0)
+            samples.append(host.processes([pid])[pid])
+        elapsed = time.time() - start
+        launcher._log.flush()
+        result = {
+            "components": args.count,
+            "seed": args.seed,
+            "cpu": (samples[-1].cpu_seconds - first.cpu_seconds) / elapsed,
+            "rss_mb": max(s.rss_mb for s in samples),
+            "threads": max(s.threads for s in samples),
+            "log_lines_per_second": (count_lines(logfile) - lines) / elapsed,
+            "crashes": len(detect),
+            "detect_p50": percentile(detect, 50),
+            "detect_p99": percentile(detect, 99),
+            "restart_p50": percentile(restart, 50),
+            "restart_p99": percentile(restart, 99),
+        }
+        for c in list(launcher._components.values()):
+            c.kill()
+        launcher.shutdown()
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+        shutil.rmtree(workdir, ignore_errors=True)
+        os._exit(0)
+
+    thread = threading.Thread(target=measure, name="bench-measure")
+    thread.daemon = True
+    thread.start()
+    #on the main thread, like the real thing, so it can watch for child exits
+    launcher.monitor(RelaunchPolicy(base=0, cap=0, healthy_uptime=0), Timeouts(*TIMEOUTS))
+
+
+def run_trial(args, count):
+    """ runs a trial in a fresh process
+    @returns dictionary - the result
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--trial", str(count),
+               "-d", str(args.duration), "-w", str(args.warmup), "--seed", str(args.seed), "--mix", args.mix]
+    if args.profiles:
+        command += ["--profiles", args.profiles]
+    if args.noheartbeat:
+        command.append("--noheartbeat")
+    output = subprocess.check_output(command).decode()
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def format_row(values):
+    return "%-10s " % (values[0],) + " ".join("%14s" % (v,) for v in values[1:])
+
+
+def report(results, baseline=None):
+    """ prints a table of results, and the change against a baseline with the same component counts """
+    print(format_row(["components"] + [title for _, title, _ in COLUMNS]))
+    baseline = dict((r["components"], r) for r in baseline or [])
+    for result in results:
+        row = [result["components"]]
+        for key, _, scale in COLUMNS:
+            value = result[key]
+            row.append("-" if value is None else "%.1f" % (value * scale,))
+        print(format_row(row))
+        before = baseline.get(result["components"])
+        if before:
+            row = ["  vs base"]
+            for key, _, _ in COLUMNS:
+                if result[key] is None or not before.get(key):
+                    row.append("-")
+                else:
+                    row.append("%+.0f%%" % ((result[key] / before[key] - 1) * 100,))
+            print(format_row(row))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Launcher supervision benchmark")
+    parser.add_argument('-n','--components', help='comma separated numbers of components to run, one trial each', default='10,50,100,500')
+    parser.add_argument('-d','--duration', help='seconds to measure for, per trial', type=float, default=30)
+    parser.add_argument('-w','--warmup', help='seconds to let the components start before measuring', type=float, default=10)
+    parser.add_argument('--seed', help='seed for the stub crash times', type=int, default=1)
+    parser.add_argument('--mix', help='percentage of components per stub profile', default=DEFAULT_MIX)
+    parser.add_argument('--profiles', help='json file with stub profiles to add or override', default=None)
+    parser.add_argument('--noheartbeat', help='run the launcher without heartbeat channels', action="store_true", default=False)
+    parser.add_argument('--output', help='save the results as json', default=None)
+    parser.add_argument('--compare', help='json results of an earlier run to compare against', default=None)
+    parser.add_argument('--trial', help=argparse.SUPPRESS, type=int, default=None)
+    args = parser.parse_args()
+
+    if args.trial is not None:
+        args.count = args.trial
+        trial(args)
+
+    results = [run_trial(args, int(n)) for n in args.components.split(",")]
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
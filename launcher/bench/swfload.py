@@ -0,0 +1,121 @@
+#call this as: python launcher/bench/swfload.py [-n tasks] [-r tasks/second] [--pollers n]
+# load test of launch tasks: schedules tasks on a LocalSwf stand-in, which the
+# launcher polls, launches from through handle_tasks and completes with the pid,
+# and reports how long that took, from scheduling to the completed response.
+# Components are sleeping shell scripts, launched as many times as there are tasks.
+# Latency, throttling and errors can be injected into every swf call
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from launcher import Launcher, Timeouts, RelaunchPolicy, LaunchPolicy
+from swfworker import SwfWorker
+from localswf import LocalSwf
+import component
+
+DOMAIN = "local"
+#the task list the launcher polls: its name and version
+TASK_LIST = "launcher1"
+
+
+def percentiles(values):
+    """ @returns list of strings - p50, p90, p99 and max in milliseconds """
+    values = sorted(values)
+    if not values:
+        return ["-"] * 4
+    picks = [values[min(len(values) - 1, int(p / 100.0 * len(values)))] for p in (50, 90, 99)] + [values[-1]]
+    return ["%.1f" % (v * 1000,) for v in picks]
+
+
+def schedule(local, args):
+    """ schedules the tasks at the given rate, spread over the classes """
+    start = time.time()
+    for i in range(args.tasks):
+        delay = start + i / args.rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        local.schedule(DOMAIN, TASK_LIST, json.dumps({ "classname": "bench.load_%d" % (i % args.classes,) }))
+
+
+def report(local, poller, launcher, elapsed):
+    tasks = local.tasks()
+    statuses = {}
+    for task in tasks:
+        statuses[task["status"]] = statuses.get(task["status"], 0) + 1
+    pickup = [t["started"] - t["scheduled"] for t in tasks if t["started"]]
+    total = [t["closed"] - t["scheduled"] for t in tasks if t["closed"]]
+    print("tasks: %d in %.1f seconds, %s" % (len(tasks), elapsed,
+        ", ".join("%d %s" % (n, s.lower()) for s, n in sorted(statuses.items()))))
+    print("%-28s %10s %10s %10s %10s" % ("latency ms", "p50", "p90", "p99", "max"))
+    print("%-28s %10s %10s %10s %10s" % tuple(["scheduled to polled"] + percentiles(pickup)))
+    print("%-28s %10s %10s %10s %10s" % tuple(["scheduled to launched+done"] + percentiles(total)))
+    histogram = launcher._metrics.snapshot()["launcher_task_launch_latency_seconds"]
+    if histogram:
+        value = histogram[0]["value"]
+        print("polled to launched, avg ms: %.1f" % (value["sum"] / value["count"] * 1000,))
+    stats = poller.stats()
+    print("swf calls: %(calls)d, throttled %(throttled)d, errors %(errors)d, empty polls %(empty_polls)d" % local.stats())
+    print("poller: %s" % (", ".join("%s %s" % (k, stats[k]) for k in sorted(stats)),))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Launch task load test against a local swf stand-in")
+    parser.add_argument('-n','--tasks', help='number of launch tasks to schedule', type=int, default=200)
+    parser.add_argument('-r','--rate', help='tasks scheduled per second', type=float, default=20)
+    parser.add_argument('--classes', help='number of classes the tasks launch, round robin', type=int, default=10)
+    parser.add_argument('--pollers', help='number of concurrent polls', type=int, default=4)
+    parser.add_argument('--latency', help='seconds every swf call takes', type=float, default=0.02)
+    parser.add_argument('--jitter', help='up to this many seconds more per call, at random', type=float, default=0.01)
+    parser.add_argument('--maxrate', help='swf calls per second before throttling, 0 for no limit', type=float, default=0)
+    parser.add_argument('--errorrate', help='fraction of swf calls that fail', type=float, default=0)
+    parser.add_argument('--polltimeout', help='seconds a poll waits for a task', type=float, default=5)
+    parser.add_argument('--maxstarting', help='max number of components starting up at the same time', type=int, default=4)
+    parser.add_argument('--startupgrace', help='seconds a launched component counts as starting, unless it produces output sooner', type=float, default=30)
+    parser.add_argument('--timeout', help='seconds to wait for the last tasks after scheduling', type=float, default=60)
+    parser.add_argument('--seed', help='seed for the injected latency and errors', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="launcher-swfload-")
+    #stays up and quiet until killed; prints one line, so it is started right away
+    java = os.path.join(workdir, "java")
+    with open(java, "w") as f:
+        f.write("#!/bin/sh\necho started\nexec sleep 3600\n")
+    os.chmod(java, 0o755)
+    component.Component.java_cmdline = staticmethod(lambda jar, nragent_path=None: [java])
+
+    local = LocalSwf(args.latency, args.jitter, args.maxrate, args.errorrate, args.polltimeout, args.seed)
+    launcher = Launcher(
+        os.path.join(workdir, "bench.jar"),
+        os.path.join(workdir, "launcher.log"),
+        launch_policy=LaunchPolicy(max_starting=args.maxstarting, startup_grace=args.startupgrace, max_cpu=1.0, min_free_mb=0),
+        heartbeat=False,
+    )
+    worker = SwfWorker("us-west-2", "launcher", DOMAIN, "1", log=launcher._log, connection=local)
+    poller = launcher._task_poller = worker.start_async_polling(notify=launcher._waker.wake, pollers=args.pollers)
+
+    def run():
+        start = time.time()
+        schedule(local, args)
+        deadline = time.time() + args.timeout
+        while time.time() < deadline and not all(t["closed"] for t in local.tasks()):
+            time.sleep(0.1)
+        report(local, poller, launcher, time.time() - start)
+        for c in list(launcher._components.values()):
+            c.kill()
+        poller.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+        sys.stdout.flush()
+        os._exit(0)
+
+    thread = threading.Thread(target=run, name="swfload")
+    thread.daemon = True
+    thread.start()
+    launcher.monitor(RelaunchPolicy(base=1, cap=60, healthy_uptime=600), Timeouts(300, 600, 900, 1200))
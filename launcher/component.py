@@ -1,7 +1,10 @@
 import subprocess
 import time
 import os
-from threading import Thread
+from outputreader import OutputReader
+from heartbeat import Heartbeat
+from properties import PropertiesLoader
+import resources
 try:
     import Queue as queue
 except ImportError:
@@ -23,30 +26,58 @@ class Component(object):
         PINGING = "awaiting ping"
         RESPONSIVE = "responsive"
 
-    def __init__(self, jar, classpath, nragent_path=None):
+    def __init__(self, jar, classpath, nragent_path=None, notify=None, max_queued_lines=0, drop_output=False, reader=None,
+                 pool=None, heartbeat_dir=None, config=None, instance=1):
         """ Component constructor
         @param jar - string: the full path to the jarfile to run from
         @param classpath - string: the classpath of the main to run
         @param nragent_path - string: optional path to a new relic agent
+        @param notify - function: optional, called with the component whenever new output is available
+        @param max_queued_lines - int: max number of unread lines per stream, 0 is unbounded
+        @param drop_output - bool: when a stream's queue is full, drop new lines instead of
+            pausing the reader, which in turn blocks the process writing to the pipe
+        @param reader - OutputReader: optional, reads the output pipes. Share one
+            between components to read all of them on a single thread
+        @param pool - WarmPool: optional, launch by handing the main to an idle
+            pre-started JVM. Falls back to starting a new JVM when the pool is empty
+        @param heartbeat_dir - string: optional, directory for the fifo the process sends
+            heartbeat frames on. Once frames arrive, they decide when it was last heard from
+        @param config - PropertiesLoader: optional, reads the component's config. Share one
+            between components to parse included files once
+        @param instance - int: number of this instance among the running ones of the same class
         """
         self._name = classpath.split('.')[-1]
+        self._instance = instance
         self._proc = None
         self._launchtime = 0
         self._last_heard_from = 0
         self._waiting = False
+        self._crashes = 0
+        self._relaunch_at = 0
         self._pid = None
         self._responsiveness = Component.Responsiveness.NOT_RUNNING
-        self._stdout_queue = queue.Queue()
-        self._stderr_queue = queue.Queue()
-        self._stdout_thread = None
-        self._stderr_thread = None
-        self._cmdline = self._make_cmdline(jar, classpath, nragent_path)
-
-        self._cwd = os.path.dirname(jar)
-        #configs should be next to the jar, unless running local,
-        #  then they should be in the project root, above this pkg
-        if not os.path.exists(os.path.join(self._cwd, "config")):
-            self._cwd = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+        self._stdout_queue = queue.Queue(max_queued_lines)
+        self._stderr_queue = queue.Queue(max_queued_lines)
+        self._drop_output = drop_output
+        self._dropped = {"stdout": 0, "stderr": 0}
+        self._lines = {"stdout": 0, "stderr": 0}
+        self._launches = 0
+        self._sample = None
+        self._over_limits = set()
+        self._memory_terminated = None
+        self._retired = None
+        self._reported_drops = 0
+        self._paused = {"stdout": False, "stderr": False}
+        self._reader = reader or OutputReader()
+        self._notify = notify
+        self._pool = pool
+        self._classpath = classpath
+        self._cmdline = Component.java_cmdline(jar, nragent_path) + [classpath]
+        self._cwd = Component.working_dir(jar)
+        self._profile_errors = []
+        self._heartbeat_dir = heartbeat_dir
+        self._config = config or PropertiesLoader()
+        self._heartbeat = None
 
     def __str__(self):
         """ string containing pid, lauch time and responsiveness """
@@ -62,6 +93,19 @@ class Component(object):
     def name(self):
         return self._name
 
+    @property
+    def instance(self):
+        return self._instance
+
+    @property
+    def key(self):
+        """ unique among the components of a launcher: name and instance number """
+        return "%s#%d" % (self._name, self._instance)
+
+    @property
+    def classpath(self):
+        return self._classpath
+
     @property
     def pid(self):
         return self._pid
@@ -72,7 +116,16 @@ class Component(object):
 
     @property
     def last_heard_from(self):
-        return self._last_heard_from
+        """ last time the process was active: by its heartbeat frames once it
+        sends them, by its output otherwise
+        """
+        active = self._heartbeat.last_active() if self._heartbeat else None
+        return self._last_heard_from if active is None else active
+
+    @property
+    def heartbeat(self):
+        """ the last heartbeat frame received since launch, a dictionary, or None """
+        return self._heartbeat.frame if self._heartbeat else None
 
     @property
     def waiting(self):
@@ -82,12 +135,132 @@ class Component(object):
     def waiting(self, value):
         self._waiting = value
 
-    def _make_cmdline(self, jar, classpath, nragent_path):
-        """ construct the executable cmd line for this component """
+    @property
+    def crashes(self):
+        """ number of consecutive crashes, see Launcher.schedule_relaunch """
+        return self._crashes
+
+    @crashes.setter
+    def crashes(self, value):
+        self._crashes = value
+
+    @property
+    def relaunch_at(self):
+        """ time at which a dead component is due for relaunch """
+        return self._relaunch_at
+
+    @relaunch_at.setter
+    def relaunch_at(self, value):
+        self._relaunch_at = value
+
+    @property
+    def profile_errors(self):
+        """ errors applying the resource profile at the last launch """
+        return self._profile_errors
+
+    @property
+    def retired(self):
+        """ time the component was taken out of service, or None. A retired
+        component is drained instead of monitored and relaunched
+        """
+        return self._retired
+
+    @retired.setter
+    def retired(self, value):
+        self._retired = value
+
+    @property
+    def responsiveness(self):
+        return self._responsiveness
+
+    @property
+    def sample(self):
+        """ the last ProcessSample of the process, or None """
+        return self._sample
+
+    @sample.setter
+    def sample(self, value):
+        self._sample = value
+
+    @property
+    def over_limits(self):
+        """ the sample fields that were over their warning threshold at the last sample """
+        return self._over_limits
+
+    @over_limits.setter
+    def over_limits(self, value):
+        self._over_limits = value
+
+    @property
+    def memory_terminated(self):
+        """ time the process was terminated for going over the memory ceiling, or None """
+        return self._memory_terminated
+
+    @memory_terminated.setter
+    def memory_terminated(self, value):
+        self._memory_terminated = value
+
+    @property
+    def launches(self):
+        """ number of times the process was launched """
+        return self._launches
+
+    def lines_read(self, stream):
+        """ number of lines read from a stream, "stdout" or "stderr", in total """
+        return self._lines[stream]
+
+    def queued_lines(self, stream):
+        """ number of lines of a stream, "stdout" or "stderr", waiting to be read """
+        return (self._stdout_queue if stream == "stdout" else self._stderr_queue).qsize()
+
+    def dropped(self, stream):
+        """ number of lines of a stream, "stdout" or "stderr", dropped because the queue was full """
+        return self._dropped[stream]
+
+    @property
+    def dropped_lines(self):
+        """ total number of output lines dropped because a queue was full """
+        return sum(self._dropped.values())
+
+    @property
+    def reported_drops(self):
+        return self._reported_drops
+
+    @reported_drops.setter
+    def reported_drops(self, value):
+        self._reported_drops = value
+
+    def is_starting(self, grace):
+        """ True while the process is alive, has not produced any output since
+        launch and was launched less than grace seconds ago
+        @param grace - number: max number of seconds a launch counts as starting
+        """
+        return (self.is_alive() and
+                self._last_heard_from == self._launchtime and
+                self.heartbeat is None and
+                time.time() - self._launchtime < grace)
+
+    def has_output(self):
+        """ True if there is output queued that has not been read yet """
+        return not (self._stdout_queue.empty() and self._stderr_queue.empty())
+
+    @staticmethod
+    def java_cmdline(jar, nragent_path=None):
+        """ construct the java cmd line to run a main from the jar, without the main """
         cmdline = ["java"]
         if nragent_path:
             cmdline += ["-javaagent:" + nragent_path]
-        return cmdline + ["-cp", jar, classpath]
+        return cmdline + ["-cp", jar]
+
+    @staticmethod
+    def working_dir(jar):
+        """ directory to run the jar in """
+        cwd = os.path.dirname(jar)
+        #configs should be next to the jar, unless running local,
+        #  then they should be in the project root, above this pkg
+        if not os.path.exists(os.path.join(cwd, "config")):
+            cwd = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+        return cwd
 
     def is_alive(self):
         """ use the availability o"""
@@ -97,23 +270,47 @@ class Component(object):
         return False
 
     def launch(self):
-        """ launches a new process for this component """
+        """ launches a new process for this component, or adopts an idle one from the pool """
         if not self.is_alive():
-            self._proc = subprocess.Popen(
-                self._cmdline,
-                #run in the jar dir, config uses relative paths from cwd. Unless local, then use the dir this script is in...
-                cwd=self._cwd,
-                #if output is piped, it HAS to be consumed to avoid deadlock due to full pipes
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                bufsize = 1
-            )
+            #read at every launch, so changes apply on the next restart
+            profile, self._profile_errors = resources.load_profile(
+                self._config.for_class(os.path.join(self._cwd, "config"), self._name))
+            jvm_args = resources.jvm_args(profile)
+            self.close()
+            self._heartbeat = Heartbeat(self._heartbeat_dir, self._name) if self._heartbeat_dir else None
+            properties = { Heartbeat.PROPERTY: self._heartbeat.path } if self._heartbeat else {}
+            #pooled JVMs are already running, without this component's heap options
+            self._proc = self._pool.take(self._classpath, properties) if self._pool and not jvm_args else None
+            if self._proc is not None:
+                self._profile_errors += resources.apply_to_pid(profile, self._proc.pid)
+            else:
+                self._proc = subprocess.Popen(
+                    resources.wrap_cmdline(profile, self._cmdline[:1] + jvm_args +
+                        ["-D%s=%s" % p for p in properties.items()] + self._cmdline[1:]),
+                    #run in the jar dir, config uses relative paths from cwd. Unless local, then use the dir this script is in...
+                    cwd=self._cwd,
+                    #if output is piped, it HAS to be consumed to avoid deadlock due to full pipes
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    bufsize = 1
+                )
+            self._profile_errors += resources.join_cgroup(profile, self._proc.pid)
             self._launchtime = time.time()
+            self._launches += 1
+            self._sample = None
+            self._over_limits = set()
+            self._memory_terminated = None
             self._last_heard_from = self._launchtime
             self._waiting = False
             self._pid = self._proc.pid
             self._responsiveness = Component.Responsiveness.LAUNCHED
+            #start reading right away, so output wakes up the monitor
+            self._paused = {"stdout": False, "stderr": False}
+            self._reader.add(self._proc.stdout, self._make_put(self._stdout_queue, "stdout"))
+            self._reader.add(self._proc.stderr, self._make_put(self._stderr_queue, "stderr"))
+            if self._heartbeat:
+                self._reader.add(self._heartbeat.pipe, self._heartbeat.put)
         return self._pid
 
     def _act_on_proc(self, status, f):
@@ -135,14 +332,14 @@ class Component(object):
     def ping(self):
         """ send a ping to the process and update status """
         def f():
-            self._proc.stdin.write("ping")
+            self._proc.stdin.write("ping\n")
             self._proc.stdin.flush()
         return self._act_on_proc(Component.Responsiveness.PINGING, f)
 
     def quit(self):
         """ send 'quit' to the process and update status """
         def f():
-            self._proc.stdin.write("quit")
+            self._proc.stdin.write("quit\n")
             self._proc.stdin.flush()
         return self._act_on_proc(Component.Responsiveness.QUITTING, f)
 
@@ -154,56 +351,86 @@ class Component(object):
         """ send SIG_KILL to the process and update status """
         return self._act_on_proc(Component.Responsiveness.KILLING, self._proc.kill)
 
-    def _setup_out(self, t, q, s):
-        """ create a new thread to read stdout from the process
-        read asynchronously into a queue
-        @param t Thread: thread to check
+    def close(self):
+        """ let go of the heartbeat channel of the last launch: stop reading it,
+        close the fifo and remove it. For a component no longer managed, or
+        before launching it again. The process itself is left alone
+        """
+        if self._heartbeat:
+            self._reader.remove(self._heartbeat.pipe)
+            self._heartbeat.close()
+            self._heartbeat = None
+
+    def _make_put(self, q, stream):
+        """ create the function the reader uses to queue a line of output
         @param q Queue: queue to write to
-        @param s stream: io stream to read
+        @param stream string: name of the stream
+        @returns function - queues a line, returns False if the queue is full
+            and the reader has to hold on to the line
         """
-        if not (t and t.is_alive()):
-            if self.is_alive():
-                def reader():
-                    try:
-                        for line in iter(s.readline, b''):
-                            q.put(line)
-                    except IOError:
-                        q.put("IOError")
-                t = Thread(target=reader)
-                t.start()
-                return t
-        return None
-
-    def stdout(self):
-        """ generator to read from stdout """
-        t = self._setup_out(
-            self._stdout_thread,
-            self._stdout_queue,
-            self._proc.stdout,
-        )
-        if not t is None:
-            self._stdout_thread = t
-        try:
-            line = self._stdout_queue.get_nowait()
-            self._last_heard_from = time.time()
+        notify = self._notify
+        dropped = self._dropped
+        paused = self._paused
+        def notify_first():
+            #only the first line of a batch needs to wake up the monitor
+            if notify and q.qsize() == 1:
+                notify(self)
+        def put(line):
+            try:
+                q.put_nowait(line)
+                notify_first()
+                return True
+            except queue.Full:
+                if self._drop_output:
+                    dropped[stream] += 1
+                    return True
+            #mark paused before retrying: either the retry succeeds,
+            # or the next drain sees the flag and resumes the reader
+            paused[stream] = True
+            try:
+                q.put_nowait(line)
+                paused[stream] = False
+                notify_first()
+                return True
+            except queue.Full:
+                return False
+        return put
+
+    def _drain(self, q, max_lines):
+        """ generator to read all queued lines
+        @param q Queue: queue to read from
+        @param max_lines int or None: maximum number of lines to read, None reads all
+        """
+        count = 0
+        while max_lines is None or count < max_lines:
+            try:
+                line = q.get_nowait()
+            except queue.Empty:
+                break
+            if count == 0:
+                self._last_heard_from = time.time()
+            count += 1
             yield line
-        except queue.Empty:
-           pass
-
-    def stderr(self):
-        """ generator to read from stderr """
-        t = self._setup_out(
-            self._stderr_thread,
-            self._stderr_queue,
-            self._proc.stderr,
-        )
-        if not t is None:
-            self._stderr_thread = t
-        try:
-            line = self._stderr_queue.get_nowait()
-            self._last_heard_from = time.time()
+
+    def _read(self, q, pipe, stream, max_lines):
+        """ generator to read queued lines of a stream, and resume
+        the reader if it paused because the queue was full
+        """
+        for line in self._drain(q, max_lines):
+            self._lines[stream] += 1
             yield line
-        except queue.Empty:
-           pass
+        if self._paused[stream] and not q.full():
+            self._paused[stream] = False
+            self._reader.resume(pipe)
 
+    def stdout(self, max_lines=None):
+        """ generator to read from stdout
+        @param max_lines int or None: maximum number of lines to read, None reads all
+        """
+        return self._read(self._stdout_queue, self._proc.stdout, "stdout", max_lines)
 
+    def stderr(self, max_lines=None):
+        """ generator to read from stderr
+        @param max_lines int or None: maximum number of lines to read, None reads all
+        """
+        return self._read(self._stderr_queue, self._proc.stderr, "stderr", max_lines)
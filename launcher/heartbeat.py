@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import itertools
+
+
+class Heartbeat(object):
+    """ Receiving end of a component's heartbeat channel: a fifo the worker
+    writes status frames to, a line of json each. The path is passed to the
+    JVM in the fulfillment.heartbeat system property. Workers sharing a JVM
+    in a workerhost share the fifo, and tag their frames with a worker field
+    """
+
+    PROPERTY = "fulfillment.heartbeat"
+
+    _ids = itertools.count()
+
+    def __init__(self, directory, name):
+        """ creates the fifo and opens it without blocking
+        @param directory string - where to create the fifo
+        @param name string - component name, part of the fifo name
+        """
+        self._path = os.path.join(directory, "%s-%d.fifo" % (name, next(Heartbeat._ids)))
+        os.mkfifo(self._path, 0o600)
+        fd = os.open(self._path, os.O_RDONLY | os.O_NONBLOCK)
+        #hold the fifo open for writing as well, so it does not read as
+        # end of file before the worker opens it, or between two writers
+        self._writer = os.open(self._path, os.O_WRONLY | os.O_NONBLOCK)
+        self._pipe = os.fdopen(fd, "rb", 0)
+        #(time received, frame); replaced as a whole, it is read from another thread
+        self._last = (None, None)
+        #worker field -> (time received, frame) of the last tagged frame
+        self._workers = {}
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def pipe(self):
+        """ file object to read frames from, see OutputReader.add """
+        return self._pipe
+
+    @property
+    def frame(self):
+        """ the last frame received, a dictionary, or None """
+        return self._last[1]
+
+    @property
+    def received(self):
+        """ time the last frame was received, or None """
+        return self._last[0]
+
+    def last_active(self, worker=None):
+        """ time the worker was last active according to its frames:
+        the time of the last frame minus the seconds it reported being idle.
+        A task in flight counts as activity until it runs past its start to
+        close timeout; from then on the worker is as good as hung, a deadlock
+        or a call that never returns. Without a timeout, it always counts
+        @param worker string - optional, judge by the frames tagged with this
+            worker only, rather than by the last frame of any
+        @returns float or None - None if no frame was received yet
+        """
+        received, frame = self._last if worker is None else self._workers.get(worker, (None, None))
+        if frame is None:
+            return None
+        if not frame.get("inflight"):
+            return received - self._seconds(frame, "idle")
+        overdue = self._seconds(frame, "task") - self._seconds(frame, "tasktimeout")
+        if not frame.get("tasktimeout") or overdue <= 0:
+            return received
+        return received - overdue
+
+    @staticmethod
+    def _seconds(frame, field):
+        """ a number of seconds from a frame, 0 if missing or not a number """
+        try:
+            return float(frame.get(field, 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def put(self, line):
+        """ takes a line read from the fifo, see OutputReader.add.
+        Anything that is not a json object is ignored
+        """
+        try:
+            frame = json.loads(line.decode("utf-8"))
+        except ValueError:
+            return True
+        if isinstance(frame, dict):
+            self._last = (time.time(), frame)
+            worker = frame.get("worker")
+            if worker is not None and not isinstance(worker, (dict, list)):
+                self._workers[worker] = self._last
+        return True
+
+    def close(self):
+        """ stop listening. The reader sees end of file once the worker's end
+        is closed too, and lets go of the fifo
+        """
+        if self._writer is not None:
+            os.close(self._writer)
+            self._writer = None
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
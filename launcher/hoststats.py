@@ -0,0 +1,116 @@
+import os
+import time
+import multiprocessing
+from collections import namedtuple
+
+#container class for a sample of a single process
+# cpu: fraction of one cpu used since the previous sample, None for the first
+# cpu_seconds: user + system cpu time used so far
+# rss_mb: resident memory
+# threads: number of threads
+# fds: number of open file descriptors, None if not readable
+ProcessSample = namedtuple('ProcessSample', ["cpu", "cpu_seconds", "rss_mb", "threads", "fds"])
+
+class HostStats(object):
+    """ Cheap host cpu and memory readings, straight from /proc.
+    Readings are None when they are not available on this platform
+    """
+
+    def __init__(self, proc="/proc"):
+        """ @param proc string - mount point of procfs """
+        self._proc = proc
+        self._last_cpu = None
+        #pid -> (time, cpu seconds) of the previous process sample
+        self._last_process = {}
+        self._ticks = float(self._sysconf("SC_CLK_TCK", 100))
+        self._page_mb = self._sysconf("SC_PAGE_SIZE", 4096) / (1024.0 * 1024.0)
+        try:
+            self._cpus = multiprocessing.cpu_count()
+        except NotImplementedError:
+            self._cpus = 1
+
+    @staticmethod
+    def _sysconf(name, default):
+        try:
+            return os.sysconf(name)
+        except (ValueError, OSError, AttributeError):
+            return default
+
+    def _read(self, name):
+        with open(os.path.join(self._proc, name)) as f:
+            return f.read()
+
+    def cpu_busy(self):
+        """ fraction of cpu time spent busy, across all cpus, since the previous
+        call. The first call falls back to the 1 minute load average per cpu
+        @returns float or None
+        """
+        try:
+            fields = [int(v) for v in self._read("stat").split("\n", 1)[0].split()[1:]]
+        except (IOError, OSError, ValueError):
+            return self._load_per_cpu()
+        #user nice system idle iowait irq softirq steal ...
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        total = sum(fields[:8])
+        last, self._last_cpu = self._last_cpu, (idle, total)
+        if last is None or total <= last[1]:
+            return self._load_per_cpu()
+        return 1.0 - float(idle - last[0]) / (total - last[1])
+
+    def _load_per_cpu(self):
+        try:
+            return os.getloadavg()[0] / self._cpus
+        except (OSError, AttributeError):
+            return None
+
+    def mem_available_mb(self):
+        """ memory available for new processes without swapping
+        @returns float or None
+        """
+        try:
+            meminfo = {}
+            for line in self._read("meminfo").splitlines():
+                key, value = line.split(":", 1)
+                meminfo[key] = int(value.split()[0])
+        except (IOError, OSError, ValueError):
+            return None
+        if "MemAvailable" in meminfo:
+            kb = meminfo["MemAvailable"]
+        else:
+            #older kernels
+            kb = meminfo.get("MemFree", 0) + meminfo.get("Buffers", 0) + meminfo.get("Cached", 0)
+        return kb / 1024.0
+
+    def processes(self, pids):
+        """ samples cpu, memory, threads and fds of a number of processes.
+        Reads a couple of /proc files per process, no subprocesses
+        @param pids list of ints - processes to sample
+        @returns dictionary - pid -> ProcessSample, without pids that are gone
+        """
+        now = time.time()
+        samples = {}
+        last, self._last_process = self._last_process, {}
+        for pid in pids:
+            try:
+                stat = self._read(os.path.join(str(pid), "stat"))
+            except (IOError, OSError):
+                continue
+            #the command name is in parentheses and may contain spaces
+            fields = stat[stat.rfind(")") + 2:].split()
+            try:
+                #state is field 3 of the man page, so index = field - 3
+                cpu_seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+                threads = int(fields[17])
+                rss_mb = int(fields[21]) * self._page_mb
+            except (IndexError, ValueError):
+                continue
+            try:
+                fds = len(os.listdir(os.path.join(self._proc, str(pid), "fd")))
+            except OSError:
+                fds = None
+            cpu = None
+            if pid in last and now > last[pid][0]:
+                cpu = (cpu_seconds - last[pid][1]) / (now - last[pid][0])
+            self._last_process[pid] = (now, cpu_seconds)
+            samples[pid] = ProcessSample(cpu, cpu_seconds, rss_mb, threads, fds)
+        return samples
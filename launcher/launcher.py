@@ -2,9 +2,13 @@
 import sys, os
 import argparse
 import time
-import re
+import math
+import signal
+import shutil
+import tempfile
 
-from collections import namedtuple
+from collections import namedtuple, deque
+from threading import Lock
 
 running_local = False
 try:
@@ -18,11 +22,46 @@ except ImportError:
     running_local = True
 
 #imports that depend on path changes if local
-from swfworker import SwfWorker, Task, PollInfo
+from swfworker import SwfWorker, Task, PollInfo, backoff_delay
 from component import Component
+from waker import Waker
+from outputreader import OutputReader
+from hoststats import HostStats
+from warmpool import WarmPool
+from workerhost import WorkerHost
+from metrics import Metrics, MetricsServer
+from properties import PropertiesLoader
+from backlog import SwfBacklog, StaticBacklog
 
 #container class for timeout values
 Timeouts = namedtuple('Timeouts', ["ping", "quit", "terminate", "kill"])
+#container class for component output handling
+# lines_per_pass: max lines logged per stream per monitor pass, 0 for no limit
+# queued_lines: max unread lines buffered per stream, 0 for no limit
+# drop: drop lines when the buffer is full instead of blocking the process
+OutputLimits = namedtuple('OutputLimits', ["lines_per_pass", "queued_lines", "drop"])
+#container class for launcher logging
+# level: minimum level logged, None for $SPLOGGER_LEVEL or all levels
+# asynchronous: write the log on a dedicated thread, so the monitor never waits on I/O
+# queue_size: max number of entries waiting for the writer thread
+# overflow: what to do when that queue is full; see Splogger's AsyncWriter
+LogOptions = namedtuple('LogOptions', ["level", "asynchronous", "queue_size", "overflow"])
+#container class for launch admission
+# max_starting: max number of components starting up at the same time
+# startup_grace: seconds a launched component counts as starting, unless it produces output sooner
+# max_cpu: no launches while another is starting and the host cpu is busier than this fraction
+# min_free_mb: no launches while less memory than this is available
+LaunchPolicy = namedtuple('LaunchPolicy', ["max_starting", "startup_grace", "max_cpu", "min_free_mb"])
+#container class for sampling component processes; thresholds of 0 are disabled
+# interval: seconds between samples of cpu, memory, threads and fds from /proc
+# warn_rss_mb, warn_cpu, warn_threads, warn_fds: log a warning when a process goes over
+# max_rss_mb: terminate a process that goes over, so it is relaunched
+ProcessLimits = namedtuple('ProcessLimits', ["interval", "warn_rss_mb", "max_rss_mb", "warn_cpu", "warn_threads", "warn_fds"])
+#container class for relaunching dead components
+# base: seconds of backoff after the first crash; doubles with each crash after that, with jitter
+# cap: max seconds of backoff
+# healthy_uptime: a component that ran at least this many seconds starts over at base
+RelaunchPolicy = namedtuple('RelaunchPolicy', ["base", "cap", "healthy_uptime"])
 
 class Launcher(object):
     """ Launcher both launches and monitors components.
@@ -62,23 +101,213 @@ class Launcher(object):
         "com.balihoo.fulfillment.dashboard.dashboard": False,
     }
 
-    def __init__(self, jar, logfile, cfgfile=None, nragent_path=None):
+    #longest the monitor sleeps without any event; guards against missed wakeups
+    MAX_WAIT = 60.0
+    #how far past a deadline to wake up, so the timeout is exceeded
+    DEADLINE_SLACK = 0.01
+    #back off after an unhandled exception in the monitor loop
+    ERROR_WAIT = 0.2
+    #how often to recheck the host while launches wait for admission
+    ADMISSION_WAIT = 1.0
+    #how often the monitor updates the component metrics
+    METRICS_INTERVAL = 5.0
+    #how long shutdown waits for queued swf task responses to go out
+    RESPONSE_WAIT = 5.0
+    #how often to check the launcher config for changes
+    CONFIG_POLL = 5.0
+    #per class instance bounds and pending swf tasks per instance, in the class config
+    INSTANCES_MIN = "launcher.instances.min"
+    INSTANCES_MAX = "launcher.instances.max"
+    INSTANCES_TASKS = "launcher.instances.tasks"
+
+    DEFAULT_OUTPUT_LIMITS = OutputLimits(lines_per_pass=1000, queued_lines=10000, drop=False)
+
+    DEFAULT_LOG_OPTIONS = LogOptions(level=None, asynchronous=False, queue_size=10000, overflow="drop_debug")
+    DEFAULT_LAUNCH_POLICY = LaunchPolicy(max_starting=4, startup_grace=30, max_cpu=0.9, min_free_mb=256)
+    DEFAULT_PROCESS_LIMITS = ProcessLimits(interval=15, warn_rss_mb=1024, max_rss_mb=0, warn_cpu=1.0,
+                                           warn_threads=1000, warn_fds=800)
+
+    def __init__(self, jar, logfile, cfgfile=None, nragent_path=None, output_limits=None, log_options=None, pollers=1,
+                 launch_policy=None, warm_pool=0, hostcfg=None, heartbeat=True, metrics_port=0,
+                 process_limits=None, launchercfg=None, backlog=None, scale_interval=30):
         """ constructs the launcher. There is commonly just one (per jar anyway)
         @param jar string - the path to the jar file to use
         @param logfile string - path to the logfile used by Splogger
         @param cfgfile string - path to the config file used to set up the SwfWorker
                                 if ommitted, no SwfWorker is created
         @param nragent_path - the option new relic agent passed on the java cmdline
+        @param output_limits OutputLimits object - how component output is buffered
+        @param log_options LogOptions object - how the launcher logs
+        @param pollers int - number of concurrent SWF long polls for launch tasks
+        @param launch_policy LaunchPolicy object - when queued launches are started
+        @param warm_pool int - number of idle pre-started JVMs to launch components in, 0 to disable
+        @param hostcfg string - path to the config file grouping worker classes into
+                                shared JVMs. If ommitted, each class runs in its own JVM
+        @param heartbeat bool - give each component a channel to send heartbeat frames on
+        @param metrics_port int - local port to serve metrics on, 0 to disable
+        @param process_limits ProcessLimits object - how component processes are sampled
+        @param launchercfg string - path to a config file with timeouts, relaunch settings
+                                and enabled classes, applied while running whenever it changes
+        @param backlog object - source of pending task counts to scale instances by, with a
+                                pending(domain, task_list) method. Defaults to SwfBacklog with a
+                                cfgfile; without either, classes scale to their minimum only
+        @param scale_interval float - seconds between instance count checks
         """
         self._jar = jar
         self._nragent_path = nragent_path
+        self._output_limits = output_limits or self.DEFAULT_OUTPUT_LIMITS
+        self._launch_policy = launch_policy or self.DEFAULT_LAUNCH_POLICY
+        #launches waiting for admission: (class name, swf task or None)
+        self._pending_launches = deque()
+        self._host = HostStats()
+        self._process_limits = process_limits or self.DEFAULT_PROCESS_LIMITS
+        self._next_sample = 0
         self._components = {}
-        self._log = Splogger(logfile)
-        self._task_poller = self._make_task_poller(cfgfile) if cfgfile else None
+        log_options = log_options or self.DEFAULT_LOG_OPTIONS
+        self._log = Splogger(
+            logfile,
+            buffered=True,
+            level=log_options.level,
+            asynchronous=log_options.asynchronous,
+            queue_size=log_options.queue_size,
+            overflow=log_options.overflow,
+        )
+        self._reported_log_drops = 0
+        self._waker = Waker()
+        #keys of the components with output to log, added on the reader thread
+        self._output_ready = set()
+        self._output_lock = Lock()
+        #set when the next monitor pass has to check every component, not just
+        # the ones with output: a child exited, or the wait timed out
+        self._sweep = True
+        #the next deadline, as of the last pass that checked every component
+        self._deadline = None
+        #a single thread reads the output of all components
+        self._reader = OutputReader()
+        #parses each config file once, until it changes
+        self._config = PropertiesLoader()
+        self._metrics = self._make_metrics()
+        self._metrics_server = MetricsServer(self._metrics, metrics_port) if metrics_port else None
+        self._next_metrics = 0
+        self._task_poller = self._make_task_poller(cfgfile, pollers) if cfgfile else None
+        self._pool = None
+        if warm_pool > 0:
+            self._pool = WarmPool(Component.java_cmdline(jar, nragent_path), Component.working_dir(jar), warm_pool)
+        self._heartbeat_dir = tempfile.mkdtemp(prefix="launcher-heartbeat-") if heartbeat else None
+        #worker host group name -> fully qualified classes it runs
+        self._host_groups = self._parse_host_groups(hostcfg) if hostcfg else {}
+        self._launchercfg = launchercfg
+        #the launcher config last applied, the PropertiesLoader returns the same object until it changes
+        self._launcher_props = None
+        self._next_reload = 0
+        #classes launched by default, kept in line with the enabled set. None when classes were given
+        self._managed = None
+        #set by monitor: values from the command line, and the ones in effect after the launcher config
+        self._base_timeouts = self._timeouts = None
+        self._base_relaunch = self._relaunch = None
+        self._backlog = backlog if backlog is not None or not cfgfile else SwfBacklog(self._parse_config(cfgfile)['region'])
+        self._scale_interval = scale_interval
+        self._next_scale = 0
+        #component name -> pending tasks at the last check
+        self._backlogs = {}
 
-    def _make_task_poller(self, cfgfile):
+    def _make_metrics(self):
+        """ declares the launcher metrics. Counters of events are updated where
+        they happen, component state by the monitor, see update_metrics; the rest
+        is looked up when the metrics are read
+        @returns Metrics object
+        """
+        m = Metrics()
+        for name, kind, help in [
+            ("launches_total", m.COUNTER, "components launched, including relaunches"),
+            ("relaunches_total", m.COUNTER, "dead components relaunched"),
+            ("launch_failures_total", m.COUNTER, "components that could not be launched"),
+            ("task_launch_latency_seconds", m.HISTOGRAM, "time from receiving an swf launch task to launching"),
+            ("monitor_pass_seconds", m.HISTOGRAM, "time spent in one pass of the monitor loop"),
+            ("pending_launches", m.GAUGE, "launches waiting for admission"),
+            ("log_dropped_total", m.COUNTER, "launcher log entries dropped"),
+            ("component_up", m.GAUGE, "1 if the component process is alive"),
+            ("component_uptime_seconds", m.GAUGE, "seconds since the component was launched, 0 if dead"),
+            ("component_launches_total", m.COUNTER, "times the component was launched"),
+            ("component_crashes", m.GAUGE, "consecutive crashes of the component"),
+            ("component_output_lines_total", m.COUNTER, "lines of component output read"),
+            ("component_queued_lines", m.GAUGE, "lines of component output waiting to be logged"),
+            ("component_dropped_lines_total", m.COUNTER, "lines of component output dropped"),
+            ("component_heartbeat", m.GAUGE, "values from the last heartbeat frame"),
+            ("component_instances", m.GAUGE, "running instances of the component, not counting draining ones"),
+            ("component_backlog", m.GAUGE, "pending swf tasks on the component's task list, as last checked"),
+            ("scale_ups_total", m.COUNTER, "instances launched to keep up with a backlog"),
+            ("scale_downs_total", m.COUNTER, "instances drained for lack of a backlog"),
+            ("component_cpu", m.GAUGE, "fraction of one cpu used by the component process"),
+            ("component_rss_mb", m.GAUGE, "resident memory of the component process"),
+            ("component_threads", m.GAUGE, "threads of the component process"),
+            ("component_fds", m.GAUGE, "open file descriptors of the component process"),
+            ("swf", m.GAUGE, "swf launch task poller and responder stats"),
+        ]:
+            m.describe(name, kind, help)
+        m.add_collector(self._collect_metrics)
+        return m
+
+    def _collect_metrics(self, m):
+        """ metrics collector, run by the thread reading the metrics: the values
+        that are safe to read from any thread. Component state is not, see update_metrics
+        """
+        m.set("pending_launches", len(self._pending_launches))
+        m.set("log_dropped_total", sum(self._log.dropped().values()))
+        if self._task_poller:
+            for key, value in self._task_poller.stats().items():
+                m.set("swf", value, stat=key)
+
+    def update_metrics(self):
+        """ every metrics interval, sets the current values for all components.
+        Run by the monitor: checking a process is alive reaps it, which must not
+        race the monitor's own checks
+        """
+        if time.time() < self._next_metrics:
+            return
+        self._next_metrics = time.time() + self.METRICS_INTERVAL
+        m = self._metrics
+        now = time.time()
+        instances = {}
+        components = list(self._components.values())
+        for component in components:
+            labels = dict(component=component.name, instance=str(component.instance))
+            alive = component.is_alive()
+            instances.setdefault(component.name, 0)
+            if alive and component.retired is None:
+                instances[component.name] = instances.get(component.name, 0) + 1
+            m.set("component_up", 1 if alive else 0, **labels)
+            m.set("component_uptime_seconds", now - component.launchtime if alive else 0, **labels)
+            m.set("component_launches_total", component.launches, **labels)
+            m.set("component_crashes", component.crashes, **labels)
+            for stream in ("stdout", "stderr"):
+                m.set("component_output_lines_total", component.lines_read(stream), stream=stream, **labels)
+                m.set("component_queued_lines", component.queued_lines(stream), stream=stream, **labels)
+                m.set("component_dropped_lines_total", component.dropped(stream), stream=stream, **labels)
+            sample = component.sample if alive else None
+            for field in ("cpu", "rss_mb", "threads", "fds"):
+                value = getattr(sample, field) if sample else None
+                if value is None:
+                    m.remove("component_" + field, **labels)
+                else:
+                    m.set("component_" + field, value, **labels)
+            for key, value in (component.heartbeat or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    m.set("component_heartbeat", value, field=key, **labels)
+        for name, count in instances.items():
+            m.set("component_instances", count, component=name)
+        #drop the series of instances that are gone, drained or scaled down,
+        # and the instance counts of classes no longer running at all
+        current = set((c.name, str(c.instance)) for c in components)
+        m.prune(lambda labels: "instance" not in labels or (labels.get("component"), labels["instance"]) in current)
+        m.prune(lambda labels: labels.get("component") in instances, "component_instances")
+        for name, count in self._backlogs.items():
+            m.set("component_backlog", count, component=name)
+
+    def _make_task_poller(self, cfgfile, pollers):
         """ creates an async Swf task poller
         @param cfgfile string - path to config file
+        @param pollers int - number of concurrent long polls
         @returns PollInfo object - contains tasks received async from SWF
         """
         cfg = self._parse_config(cfgfile)
@@ -86,73 +315,527 @@ class Launcher(object):
             name = "launcher",
             version = "1",
             region_name = cfg['region'],
-            domain = cfg['domain']
+            domain = cfg['domain'],
+            log = self._log
         )
-        return w.start_async_polling()
+        return w.start_async_polling(notify=self._waker.wake, pollers=pollers)
+
+    def _parse_host_groups(self, hostcfg):
+        """ parse the worker host config: one group per line, a group name
+        followed by the comma separated classes it runs
+        @param hostcfg string - path to config file
+        @returns dictionary of group name to list of fully qualified class names
+        """
+        groups = {}
+        for group, value in self._config.load(hostcfg).items():
+            classes = [c.strip() for c in value.split(",") if c.strip()]
+            groups[group] = [self.resolve_class_name(c) for c in classes]
+        return groups
 
     def _parse_config(self, cfgfile):
-        """ parse the aws config file for SWF settings
+        """ parse the aws config file for SWF settings, including the files it includes
         @param cfgfile string - path to config file
         @returns dictionary containing config values
         """
-        cfg = {}
-        rx = re.compile("^([\w-]+)\s*=\s*([\w-]+)\s*$")
-        with open(cfgfile) as f:
-            for line in f:
-                mo = rx.match(line)
-                if mo:
-                    groups = mo.groups()
-                    if len(groups) == 2:
-                        cfg[groups[0]] = groups[1]
-        return cfg
+        return self._config.load(cfgfile)
+
+    def class_config(self, class_name):
+        """ the merged config of a class, from config/<name>.properties and its includes
+        @param class_name string - part or all of a classname
+        @returns dictionary containing config values, empty if there is no config
+        """
+        name = self.resolve_class_name(class_name).split('.')[-1]
+        return self._config.for_class(os.path.join(Component.working_dir(self._jar), "config"), name)
+
+    @staticmethod
+    def proc_data(component):
+        """ the fields that identify a component process in the log
+        @returns dictionary - pid, procname and instance number
+        """
+        return {
+            "pid" : str(component.pid),
+            "procname" : str(component.name),
+            "instance" : str(component.instance)
+        }
 
     def log_component(self, component):
         """ reads any stdout and stderr from the component
         and log it along with pid and procname information
         """
-        proc_data = {
-            "pid" : str(component.pid),
-            "procname" : str(component.name)
-        }
+        proc_data = self.proc_data(component)
+
+        max_lines = self._output_limits.lines_per_pass or None
+
+        for line in component.stdout(max_lines):
+            self._log.info("stdout: %s", line, additional_fields=proc_data)
 
-        for line in component.stdout():
-            self._log.info("stdout: %s" % (line,), additional_fields=proc_data)
+        for line in component.stderr(max_lines):
+            self._log.error("stderr: %s", line, additional_fields=proc_data)
 
-        for line in component.stderr():
-            self._log.error("stderr: %s" % (line,), additional_fields=proc_data)
+        dropped = component.dropped_lines
+        if dropped > component.reported_drops:
+            self._log.warn(
+                "output queue full: dropped %d lines" % (dropped - component.reported_drops,),
+                additional_fields=proc_data
+            )
+            component.reported_drops = dropped
 
-    def monitor(self, seconds_between_launch, timeouts):
+    def log_profile_errors(self, component):
+        """ log what went wrong applying a component's resource profile at launch.
+        The component runs regardless, just without those limits
+        """
+        for error in component.profile_errors:
+            self._log.warn(
+                "resource profile not applied: %s" % (error,),
+                additional_fields=self.proc_data(component)
+            )
+
+    def report_log_drops(self):
+        """ logs the number of log entries dropped by an asynchronous log
+        since the last report
+        """
+        dropped = self._log.dropped()
+        total = sum(dropped.values())
+        if total > self._reported_log_drops:
+            self._log.warn(
+                "log queue full: dropped %d entries",
+                total - self._reported_log_drops,
+                additional_fields=dropped
+            )
+            self._reported_log_drops = total
+
+    def _watch_children(self):
+        """ wake up the monitor loop as soon as a child process exits.
+        Only possible from the main thread; otherwise deaths are noticed
+        at the next deadline
+        """
+        try:
+            signal.signal(signal.SIGCHLD, self._child_exited)
+            #don't let SIGCHLD interrupt blocking reads in the reader threads
+            signal.siginterrupt(signal.SIGCHLD, False)
+        except ValueError:
+            self._log.warn("not on the main thread: unable to watch for child exits")
+
+    def _child_exited(self, signum, frame):
+        """ SIGCHLD handler: wake up the monitor for a pass over every component """
+        self._sweep = True
+        self._waker.wake()
+
+    def _output_available(self, component):
+        """ called on the reader thread when a component has output, after a
+        quiet spell: wake up the monitor to log it
+        """
+        with self._output_lock:
+            self._output_ready.add(component.key)
+        self._waker.wake()
+
+    def next_deadline(self, timeouts):
+        """ finds the next point in time at which the monitor has to act
+        without being woken up: a responsiveness timeout or a relaunch
+        @param timeouts Timeouts object - see monitor
+        @returns float or None - the time of the next deadline, None if there is none
+        """
+        deadlines = [self._next_sample] if self._components else []
+        if self._launchercfg:
+            deadlines.append(self._next_reload)
+        if self._components:
+            deadlines.append(self._next_scale)
+        for component in self._components.values():
+            if component.retired is not None and component.is_alive():
+                #draining: next escalation
+                elapsed = time.time() - component.retired
+                pending = [t - timeouts.quit for t in (timeouts.terminate, timeouts.kill) if t - timeouts.quit >= elapsed]
+                if pending:
+                    deadlines.append(component.retired + min(pending))
+            elif component.is_alive():
+                tlhf = time.time() - component.last_heard_from
+                pending = [t for t in timeouts if t >= tlhf]
+                if pending:
+                    deadlines.append(component.last_heard_from + min(pending))
+                if isinstance(component, WorkerHost):
+                    for worker in component.exited_workers():
+                        deadlines.append(worker.relaunch_at if worker.waiting else time.time())
+            else:
+                deadlines.append(component.relaunch_at if component.waiting else time.time())
+        return min(deadlines) if deadlines else None
+
+    def wait(self, timeouts, swept):
+        """ sleeps until something happens: a child exits, a component produces
+        output, an SWF task comes in, or the next deadline is due
+        @param timeouts Timeouts object - see monitor
+        @param swept boolean - the pass before checked every component, so the
+            deadline is worked out again. Output only moves deadlines later
+        """
+        with self._output_lock:
+            if self._output_ready:
+                #more output queued than drained in one pass
+                return
+        if swept:
+            self._deadline = self.next_deadline(timeouts)
+        filling = self._pool and self._pool.idle() < self._pool.size
+        timeout = self.ADMISSION_WAIT if self._pending_launches or filling else self.MAX_WAIT
+        if self._deadline is not None:
+            #timeouts are exceeded, not reached: go just past the deadline
+            timeout = min(timeout, max(0, self._deadline - time.time()) + self.DEADLINE_SLACK)
+        if self._metrics_server:
+            timeout = min(timeout, max(0, self._next_metrics - time.time()))
+        if not self._waker.wait(timeout):
+            self._sweep = True
+
+    def due_components(self):
+        """ the keys of the components the next monitor pass checks: all of
+        them when a child exited, the wait timed out or a deadline is due;
+        otherwise only the ones that have output, so a chatty component does
+        not cost a pass over every other one
+        @returns (list of strings, boolean) - the keys, and whether they are all of them
+        """
+        with self._output_lock:
+            ready, self._output_ready = self._output_ready, set()
+        due = self._deadline is None or time.time() >= self._deadline
+        if self._sweep or due:
+            self._sweep = False
+            return list(self._components), True
+        return [key for key in ready if key in self._components], False
+
+    def monitor(self, relaunch, timeouts):
         """ endless loop to monitor, terminate or restart components
-        Also looks for SWF tasks to come in
-        @param seconds_between_launch integer - minimum number of seconds between
-               launch of the same process. This is the time from the last launch
-               time, not the time it terminated.
+        Also looks for SWF tasks to come in. The loop is event driven: it
+        sleeps until woken up by a child exit, component output, an SWF task
+        or the next responsiveness or relaunch deadline. Output alone only gets
+        the components that produced it checked
+        @param relaunch RelaunchPolicy object - how long to wait before relaunching
+               a dead component, tracked per component
         @param timeouts Timeouts object - container with the different timeout
                values to monitor
+        Both can be changed while running through the launcher config
         """
+        self._base_timeouts = self._timeouts = timeouts
+        self._base_relaunch = self._relaunch = relaunch
+        self._watch_children()
         while True:
             try:
+                start = time.time()
+                self.reload_config()
+                timeouts, relaunch = self._timeouts, self._relaunch
                 self.handle_tasks()
-                for name in self._components:
-                    component = self._components[name]
+                keys, swept = self.due_components()
+                for key in keys:
+                    component = self._components[key]
                     self.log_component(component)
-                    if component.is_alive():
+                    if component.has_output():
+                        #over the lines per pass: the rest in the next pass
+                        with self._output_lock:
+                            self._output_ready.add(key)
+                    if component.retired is not None:
+                        self.drain(component, timeouts)
+                    elif component.is_alive():
                         self.check_responsiveness(component, timeouts)
+                        if isinstance(component, WorkerHost):
+                            self.check_hosted_workers(component, relaunch)
                     else:
-                        time_since_last_launch = time.time() - component.launchtime
                         if not component.waiting:
+                            time_since_last_launch = time.time() - component.launchtime
+                            delay = self.schedule_relaunch(component, relaunch)
                             self._log.error(
-                                "died after %f seconds" % (time_since_last_launch),
-                                additional_fields={ "pid" : str(component.pid), "procname" : name }
+                                "died after %f seconds, relaunch in %f seconds" % (time_since_last_launch, delay),
+                                additional_fields=self.proc_data(component)
                             )
-                        if time_since_last_launch > seconds_between_launch:
-                            pid = component.launch()
-                            self._log.warn("relaunched", additional_fields={ "pid" : str(pid), "procname" : name })
-                        else:
-                            component.waiting = True
+                            #its relaunch is a new deadline
+                            self._sweep = True
+                        if time.time() >= component.relaunch_at:
+                            component.launch()
+                            self._metrics.inc("launches_total")
+                            self._metrics.inc("relaunches_total")
+                            self._log.warn("relaunched", additional_fields=self.proc_data(component))
+                            self.log_profile_errors(component)
+                #after the components are checked, so their output counts as started
+                self.autoscale()
+                self.admit_launches()
+                self.sample_processes()
+                self.fill_pool()
+                self.report_log_drops()
+                self.update_metrics()
+                self._metrics.observe("monitor_pass_seconds", time.time() - start)
+                self.wait(timeouts, swept)
             except Exception as e:
                 self._log.warn("unhandled exception: %s" % (str(e),))
-            time.sleep(0.2)
+                self._sweep = True
+                time.sleep(self.ERROR_WAIT)
+
+    def shutdown(self):
+        """ clean up after the launcher: stop polling for swf tasks, kill the idle
+        warm pool JVMs and remove the heartbeat fifos. The components keep running
+        """
+        if self._task_poller:
+            self._task_poller.stop(self.RESPONSE_WAIT)
+        if self._pool:
+            self._pool.close()
+        for component in self._components.values():
+            component.close()
+        if self._heartbeat_dir:
+            shutil.rmtree(self._heartbeat_dir, ignore_errors=True)
+            self._heartbeat_dir = None
+
+    def reload_config(self):
+        """ applies the launcher config if it changed since the last check:
+        timeouts and relaunch settings replace the command line values, classes
+        enabled by default are launched and disabled ones drained.
+        Running components are not touched otherwise
+        Keys: ping, quit, terminate, kill, launchdelay, relaunchbase, healthyuptime,
+              and enabled.<class>=true|false to override ALL_CLASSES
+        """
+        if not self._launchercfg or time.time() < self._next_reload:
+            return
+        self._next_reload = time.time() + self.CONFIG_POLL
+        props = self._config.load(self._launchercfg)
+        if props is self._launcher_props:
+            return
+        self._launcher_props = props
+        try:
+            timeouts = Timeouts(*[float(props.get(field, value)) for field, value in zip(Timeouts._fields, self._base_timeouts)])
+            relaunch = self._base_relaunch._replace(
+                cap=float(props.get("launchdelay", self._base_relaunch.cap)),
+                base=float(props.get("relaunchbase", self._base_relaunch.base)),
+                healthy_uptime=float(props.get("healthyuptime", self._base_relaunch.healthy_uptime)),
+            )
+        except ValueError as e:
+            self._log.error("invalid launcher config, keeping the current settings: %s" % (str(e),))
+            return
+        if timeouts != self._timeouts or relaunch != self._relaunch:
+            self._log.info("launcher config reloaded: %s %s" % (str(timeouts), str(relaunch)))
+        self._timeouts, self._relaunch = timeouts, relaunch
+        if self._managed is not None:
+            enabled = set(self.enabled_classes())
+            for class_name in sorted(enabled - self._managed):
+                self._log.info("enabled, launching", additional_fields={ "procname" : class_name })
+                self.enable(class_name)
+            for class_name in sorted(self._managed - enabled):
+                self._log.info("disabled, draining", additional_fields={ "procname" : class_name })
+                self.retire(class_name)
+            self._managed = enabled
+
+    def enabled_classes(self):
+        """ the classes launched by default: enabled in ALL_CLASSES, unless
+        overridden by an enabled.<class> key in the launcher config
+        @returns list of fully qualified class names
+        """
+        enabled = dict(self.ALL_CLASSES)
+        props = self._config.load(self._launchercfg) if self._launchercfg else {}
+        for key, value in props.items():
+            if key.startswith("enabled."):
+                enabled[self.resolve_class_name(key[len("enabled."):])] = value.strip().lower() == "true"
+        return [c for c in enabled if enabled[c]]
+
+    def enable(self, class_name):
+        """ launch a class that was enabled, or stop draining it if it still runs """
+        classpath = self.resolve_class_name(class_name)
+        instances = self.instances(classpath)
+        if instances:
+            #relaunched as usual once they have quit
+            for component in instances:
+                component.retired = None
+            return
+        for host in self._components.values():
+            if isinstance(host, WorkerHost) and host.retire_worker(classpath, False):
+                return
+        self.launch([classpath])
+
+    def retire(self, class_name):
+        """ drain a class that was disabled: drop queued launches, ask it to
+        quit and don't relaunch it. Escalates like an unresponsive component
+        """
+        classpath = self.resolve_class_name(class_name)
+        self._pending_launches = deque(p for p in self._pending_launches if p[0] != classpath)
+        instances = self.instances(classpath)
+        if instances:
+            for component in instances:
+                component.retired = time.time()
+                component.quit()
+            return
+        for host in self._components.values():
+            if isinstance(host, WorkerHost) and host.retire_worker(classpath, True):
+                return
+
+    def instances(self, classpath):
+        """ the components running a class, draining ones included
+        @param classpath string - fully qualified class name
+        @returns list of Component objects, by instance number
+        """
+        instances = [c for c in self._components.values()
+                     if c.classpath == classpath and not isinstance(c, WorkerHost)]
+        return sorted(instances, key=lambda c: c.instance)
+
+    def autoscale(self):
+        """ every scale interval, brings the number of instances of each class
+        within the bounds of its config, and in between, in line with its backlog:
+        one instance per launcher.instances.tasks pending swf tasks. Scales up
+        by queueing launches, down by draining one instance per interval, an idle
+        one if the heartbeats tell. Only the enabled classes are scaled when the
+        launcher follows the launcher config, otherwise the classes it runs.
+        Classes without launcher.instances.* settings, and classes in worker hosts,
+        are left alone
+        """
+        if time.time() < self._next_scale:
+            return
+        self._next_scale = time.time() + self._scale_interval
+        if self._managed is not None:
+            #disabled classes are draining, not to be launched again
+            classes = set(self._managed)
+        else:
+            classes = set(c.classpath for c in self._components.values() if not isinstance(c, WorkerHost))
+        hosted = set(c for members in self._host_groups.values() for c in members)
+        for classpath in sorted(classes - hosted):
+            try:
+                self.scale(classpath)
+            except Exception as e:
+                self._log.warn("unable to scale: %s" % (str(e),), additional_fields={ "procname" : classpath })
+
+    def scale(self, classpath):
+        """ launches or drains instances of a class, see autoscale
+        @param classpath string - fully qualified class name
+        """
+        cfg = self.class_config(classpath)
+        if self.INSTANCES_MIN not in cfg and self.INSTANCES_MAX not in cfg:
+            return
+        instances = self.instances(classpath)
+        if any(c.retired is not None for c in instances):
+            #wait for the instance being drained to be gone before scaling again
+            return
+        low = int(cfg.get(self.INSTANCES_MIN, 1))
+        high = max(low, int(cfg.get(self.INSTANCES_MAX, low)))
+        name = classpath.split('.')[-1]
+        desired = low
+        if high > low and self._backlog is not None:
+            pending = self._backlog.pending(cfg.get("domain"), cfg.get("name", "") + cfg.get("version", ""))
+            self._backlogs[name] = pending
+            per_instance = max(1, float(cfg.get(self.INSTANCES_TASKS, 1)))
+            desired = min(high, max(low, int(math.ceil(pending / per_instance))))
+        queued = len([p for p in self._pending_launches if self.resolve_class_name(p[0]) == classpath])
+        current = len(instances) + queued
+        if desired > current:
+            self._log.info("scaling up from %d to %d instances" % (current, desired), additional_fields={ "procname" : name })
+            self._metrics.inc("scale_ups_total", desired - current)
+            self._pending_launches.extend((classpath, None) for _ in range(desired - current))
+        elif desired < current:
+            if queued:
+                #drop a launch that has not started yet rather than drain a running instance
+                for p in reversed(self._pending_launches):
+                    if p[1] is None and self.resolve_class_name(p[0]) == classpath:
+                        self._pending_launches.remove(p)
+                        break
+                else:
+                    return
+                self._log.info("scaling down, dropped a queued launch", additional_fields={ "procname" : name })
+                return
+            #idle ones first, then the most recent
+            idle = lambda c: (c.heartbeat or {}).get("inflight") == 0
+            component = sorted(instances, key=lambda c: (idle(c), c.instance))[-1]
+            proc_data = self.proc_data(component)
+            self._log.info("scaling down from %d to %d instances: draining" % (current, desired), additional_fields=proc_data)
+            self._metrics.inc("scale_downs_total")
+            component.retired = time.time()
+            component.quit()
+
+    def drain(self, component, timeouts):
+        """ terminate or kill a retired component that takes too long to quit,
+        and stop managing it once it is gone
+        @param component Component object - a retired component
+        @param timeouts Timeouts object - the time between quit and terminate or kill
+            is the same as for unresponsive components
+        """
+        proc_data = self.proc_data(component)
+        if not component.is_alive():
+            component.close()
+            del self._components[component.key]
+            self._log.info("drained", additional_fields=proc_data)
+            return
+        elapsed = time.time() - component.retired
+        if elapsed > timeouts.kill - timeouts.quit:
+            if component.kill():
+                self._log.error("still draining after %f seconds: kill" % (elapsed,), additional_fields=proc_data)
+        elif elapsed > timeouts.terminate - timeouts.quit:
+            if component.terminate():
+                self._log.warn("still draining after %f seconds: terminate" % (elapsed,), additional_fields=proc_data)
+
+    def sample_processes(self):
+        """ every sample interval, samples all live component processes in one
+        batch, logs the ones over a warning threshold and terminates the ones
+        over the memory ceiling
+        """
+        limits = self._process_limits
+        if time.time() < self._next_sample:
+            return
+        self._next_sample = time.time() + limits.interval
+        live = [c for c in self._components.values() if c.is_alive()]
+        samples = self._host.processes([c.pid for c in live])
+        for component in live:
+            sample = samples.get(component.pid)
+            component.sample = sample
+            proc_data = self.proc_data(component)
+            if component.memory_terminated is not None:
+                #terminated at an earlier sample and still alive, whatever it said since: kill
+                if component.kill():
+                    self._log.error(
+                        "still alive %f seconds after terminate for memory: kill" % (time.time() - component.memory_terminated,),
+                        additional_fields=proc_data
+                    )
+                continue
+            if not sample:
+                continue
+            #warn when a value goes over its threshold, not on every sample it stays over
+            over = set()
+            for field, limit in [("rss_mb", limits.warn_rss_mb), ("cpu", limits.warn_cpu),
+                                 ("threads", limits.warn_threads), ("fds", limits.warn_fds)]:
+                value = getattr(sample, field)
+                if limit and value is not None and value > limit:
+                    over.add(field)
+                    if field not in component.over_limits:
+                        self._log.warn("%s %s over %s" % (field, value, limit), additional_fields=proc_data)
+            component.over_limits = over
+            if limits.max_rss_mb and sample.rss_mb > limits.max_rss_mb:
+                #terminate first; still alive at the next sample, kill
+                component.memory_terminated = time.time()
+                component.terminate()
+                self._log.error(
+                    "rss %f MB over the %f MB ceiling: terminate" % (sample.rss_mb, limits.max_rss_mb),
+                    additional_fields=proc_data
+                )
+
+    def schedule_relaunch(self, component, relaunch):
+        """ picks the time to relaunch a component that just died: exponential
+        backoff with jitter on consecutive crashes. A component that ran for
+        the healthy uptime is relaunched right away, and its backoff starts over
+        @param component Component or HostedWorker object - the dead component
+        @param relaunch RelaunchPolicy object - see monitor
+        @returns float - seconds until the relaunch
+        """
+        uptime = time.time() - component.launchtime
+        if uptime >= relaunch.healthy_uptime:
+            component.crashes = 0
+        delay = backoff_delay(component.crashes - 1, relaunch.base, relaunch.cap) if component.crashes else 0
+        component.crashes += 1
+        component.relaunch_at = time.time() + delay
+        component.waiting = True
+        return delay
+
+    def check_hosted_workers(self, host, relaunch):
+        """ restart the workers that exited inside a running worker host,
+        with the same backoff as restarting components
+        @param host WorkerHost object - the host to check
+        @param relaunch RelaunchPolicy object - see monitor
+        """
+        for worker in host.exited_workers():
+            proc_data = { "pid" : str(host.pid), "procname" : worker.name, "host" : host.name }
+            if not worker.waiting:
+                time_since_last_launch = time.time() - worker.launchtime
+                delay = self.schedule_relaunch(worker, relaunch)
+                self._log.error(
+                    "died after %f seconds, relaunch in %f seconds" % (time_since_last_launch, delay),
+                    additional_fields=proc_data
+                )
+            if time.time() >= worker.relaunch_at:
+                host.start_worker(worker.classpath)
+                self._log.warn("relaunched", additional_fields=proc_data)
 
     def check_responsiveness(self, component, timeouts):
         """ checks to see if a component has been responsive, and if not take
@@ -164,10 +847,11 @@ class Launcher(object):
         #time_since_last_heard_from
         tlhf = time.time() - component.last_heard_from
         if tlhf > timeouts.ping:
-            proc_data = {
-                "pid" : str(component.pid),
-                "procname" : str(component.name)
-            }
+            proc_data = self.proc_data(component)
+            if component.heartbeat:
+                proc_data["status"] = str(component.heartbeat.get("status"))
+                if component.heartbeat.get("inflight"):
+                    proc_data["task"] = str(component.heartbeat.get("task"))
             if tlhf > timeouts.kill:
                 #not even responding to terminate. Well, you asked for it: death is imminent
                 if component.kill():
@@ -184,28 +868,87 @@ class Launcher(object):
                 #haven't heard from you in a while, just checking in
                 if component.ping():
                     self._log.info("no response for %f seconds: ping" % (tlhf), additional_fields=proc_data)
-        else:
+        elif component.memory_terminated is None:
+            #output does not call off a terminate for memory
             component.responsive()
 
     def handle_tasks(self):
-        """ handles any SWF tasks that may have come in.
+        """ queues a launch for every SWF task that came in.
         Do nothing if there is no task_poller defined
         """
         if self._task_poller:
             task = self._task_poller.get()
-            if task:
+            while task:
                 try:
-                    class_name = str(task.params["classname"])
-                    component = self.launch_new_component(class_name, self._nragent_path)
-                    if not component:
-                        raise Exception("unable to launch %s" % (class_name,))
-                    task.complete(str(component.pid))
+                    self._pending_launches.append((str(task.params["classname"]), task))
                 except Exception as e:
-                    self._log.error("failed to launch component from swf task: %s" % (e.message,))
-                    try:
-                        task.fail(e.message)
-                    except Exception as e:
-                        self._log.error("failed to fail swf task: %s" % (e.message,))
+                    self._log.error("invalid swf task: %s" % (str(e),))
+                    self._fail_task(task, e)
+                task = self._task_poller.get()
+
+    def _fail_task(self, task, e):
+        """ report a failed launch task to SWF """
+        try:
+            task.fail(str(e))
+        except Exception as e:
+            self._log.error("failed to fail swf task: %s" % (str(e),))
+
+    def can_admit(self):
+        """ decides if a queued launch can start now: few enough components are
+        starting, there is memory to spare and, while anything else is starting,
+        cpu to spare
+        @returns boolean
+        """
+        policy = self._launch_policy
+        starting = len([c for c in self._components.values() if c.is_starting(policy.startup_grace)])
+        if self._pool:
+            starting += self._pool.starting(policy.startup_grace)
+        if starting >= policy.max_starting:
+            return False
+        free_mb = self._host.mem_available_mb()
+        if free_mb is not None and free_mb < policy.min_free_mb:
+            return False
+        if starting > 0:
+            busy = self._host.cpu_busy()
+            if busy is not None and busy > policy.max_cpu:
+                return False
+        return True
+
+    def admit_launches(self):
+        """ starts queued launches for as long as the launch policy admits them.
+        Launches from SWF tasks complete the task with the pid, or fail it
+        """
+        while self._pending_launches and self.can_admit():
+            class_name, task = self._pending_launches.popleft()
+            component = self.launch_new_component(class_name, self._nragent_path)
+            if task:
+                if component:
+                    self._metrics.observe("task_launch_latency_seconds", time.time() - task.received)
+                    task.complete(str(component.pid))
+                else:
+                    self._log.error("failed to launch component from swf task: %s" % (class_name,))
+                    self._fail_task(task, "unable to launch %s" % (class_name,))
+
+    def start_launches(self):
+        """ starts every queued launch now, for callers that do not run the monitor.
+        Waits on the launch policy between launches, reading output meanwhile so
+        components that have started stop counting as starting
+        """
+        while self._pending_launches:
+            for component in list(self._components.values()):
+                self.log_component(component)
+            self.admit_launches()
+            if self._pending_launches:
+                time.sleep(self.ADMISSION_WAIT)
+
+    def fill_pool(self):
+        """ replace the JVMs taken from the warm pool, if there is one. Pool JVMs
+        are admitted like launches, after the queued launches
+        """
+        if self._pool:
+            started = self._pool.fill(lambda: not self._pending_launches and self.can_admit(), self._relaunch)
+            if started:
+                self._log.debug("started %d warm pool JVMs" % (started,))
 
     def resolve_class_name(self, class_name):
         """ try to find the class_name in the list and return the properly
@@ -221,21 +964,40 @@ class Launcher(object):
         return class_name
 
     def launch_new_component(self, class_name, nragent_path=None):
-        """ start up a brand new component. This can be of the same class as an existing one
-        @param class_name string: part or all of a classname
+        """ start up a brand new component. This can be of the same class as an existing one,
+        it then runs as another instance
+        @param class_name string: part or all of a classname, or the name of a worker host group
         @param nragent_path - the option new relic agent passed on the java cmdline
         @returns Component object or None - if successful, the launched component
         """
-        if class_name not in self.ALL_CLASSES:
+        options = dict(
+            notify=self._output_available,
+            max_queued_lines=self._output_limits.queued_lines,
+            drop_output=self._output_limits.drop,
+            reader=self._reader,
+            pool=self._pool,
+            heartbeat_dir=self._heartbeat_dir,
+            config=self._config,
+        )
+        if class_name not in self._host_groups and class_name not in self.ALL_CLASSES:
             class_name = self.resolve_class_name(class_name)
-        component = Component(self._jar, class_name, nragent_path)
-        name = component.name
+        #the lowest instance number not in use by the class
+        name = class_name.split('.')[-1]
+        used = set(c.instance for c in self._components.values() if c.name == name)
+        options["instance"] = min(set(range(1, len(used) + 2)) - used)
+        if class_name in self._host_groups:
+            component = WorkerHost(self._jar, class_name, self._host_groups[class_name], nragent_path, **options)
+        else:
+            component = Component(self._jar, class_name, nragent_path, **options)
         try:
-            pid = component.launch()
-            self._log.info("Launched", additional_fields={ "pid" : str(pid), "procname" : name })
-            self._components[name] = component
+            component.launch()
+            self._metrics.inc("launches_total")
+            self._log.info("Launched", additional_fields=self.proc_data(component))
+            self.log_profile_errors(component)
+            self._components[component.key] = component
             return component
         except Exception as e:
+            self._metrics.inc("launch_failures_total")
             self._log.error(
                 "Unable to launch: %s" % (str(e),),
                 additional_fields={ "jar": self._jar, "procname" : name }
@@ -245,17 +1007,27 @@ class Launcher(object):
             self._log.info("Managing %d processes" % (len(self._components),))
 
     def launch(self, classes=None):
-        """ launch a each class provided, or the default set if none are provided
+        """ queue a launch of each class provided, or the default set if none are provided.
+        The monitor starts them as the launch policy admits
         @params classes list of strings or None - the list of class names with a main
             that can be launched in the jar
         """
         if classes == None or len(classes) < 1:
-            #select all the enabled classes if none are provided
-            classes = [c for c in self.ALL_CLASSES if self.ALL_CLASSES[c]]
+            #select all the enabled classes if none are provided, and keep
+            # following the enabled set as the launcher config changes
+            classes = self.enabled_classes()
+            self._managed = set(classes)
 
+        #classes in a worker host group are launched with the whole group
+        hosted = dict((c, group) for group, members in self._host_groups.items() for c in members)
+        groups = []
         for class_name in classes:
-            self.launch_new_component(class_name, self._nragent_path)
-            time.sleep(5)
+            group = hosted.get(self.resolve_class_name(class_name))
+            if group is None:
+                self._pending_launches.append((class_name, None))
+            elif group not in groups:
+                groups.append(group)
+                self._pending_launches.append((group, None))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("Launch the Fulfillment application")
@@ -265,7 +1037,9 @@ if __name__ == "__main__":
     parser.add_argument('classes', metavar='C', type=str, nargs='*', help='classes to run')
     parser.add_argument('-j','--jarname', help='the path of the jar to run from', default=jar)
     parser.add_argument('-l','--logfile', help='the log file', default='/var/log/balihoo/fulfillment/launcher.log')
-    parser.add_argument('-d','--launchdelay', help='minumum number of seconds between launch of the same process', default='600')
+    parser.add_argument('-d','--launchdelay', help='max number of seconds to wait before relaunching a process that keeps crashing', default='600')
+    parser.add_argument('--relaunchbase', help='seconds to wait before relaunching after the second crash in a row, doubled for every crash after that', default='1')
+    parser.add_argument('--healthyuptime', help='seconds a process has to run for its relaunch backoff to start over', default='600')
     parser.add_argument('-p','--ping', help='number of seconds after which to ping a quiet process', default='300')
     parser.add_argument('-q','--quit', help='number of seconds after which to tell a process to quit', default='600')
     parser.add_argument('-t','--terminate', help='number of seconds after which to terminate (SIGTERM) a quiet process', default='900')
@@ -274,6 +1048,33 @@ if __name__ == "__main__":
     parser.add_argument('--newrelicagent', help='path to the newrelic agent to use for monitoring', default="/opt/balihoo/newrelic-agent.jar")
     parser.add_argument('--nonewrelic', help='disable newrelic agent', action="store_true", default=False)
     parser.add_argument('--noworker', help='disable swf worker', action="store_true", default=False)
+    parser.add_argument('--loglevel', help='minimum level to log (DEBUG, INFO, WARN, ERROR, EXCEPTION); defaults to $SPLOGGER_LEVEL or DEBUG',
+        type=str.upper, choices=["DEBUG", "INFO", "WARN", "ERROR", "EXCEPTION"], default=None)
+    parser.add_argument('--asynclog', help='write the log on a dedicated thread', action="store_true", default=False)
+    parser.add_argument('--logqueue', help='max number of log entries waiting to be written in async mode', default='10000')
+    parser.add_argument('--logoverflow', help='what to do when the async log queue is full',
+        choices=["block", "drop_oldest", "drop_debug"], default="drop_debug")
+    parser.add_argument('--pollers', help='number of concurrent swf long polls for launch tasks', default='1')
+    parser.add_argument('--maxstarting', help='max number of components starting up at the same time', default='4')
+    parser.add_argument('--startupgrace', help='seconds a launched component counts as starting, unless it produces output sooner', default='30')
+    parser.add_argument('--maxcpu', help='hold launches while another starts and host cpu use is above this fraction', default='0.9')
+    parser.add_argument('--minfreemem', help='hold launches while less than this many MB of memory is available', default='256')
+    parser.add_argument('--warmpool', help='number of idle pre-started JVMs to launch components in, 0 to disable', default='0')
+    parser.add_argument('--hostconfig', help='path to the config file grouping worker classes into shared JVMs', default=None)
+    parser.add_argument('--noheartbeat', help='judge responsiveness by output only, not by heartbeat frames', action="store_true", default=False)
+    parser.add_argument('--metricsport', help='local port to serve metrics on (/metrics, /metrics.json), 0 to disable', default='0')
+    parser.add_argument('--sampleinterval', help='seconds between samples of component cpu, memory, threads and fds', default='15')
+    parser.add_argument('--warnrss', help='log a warning when a component uses more than this many MB of memory, 0 to disable', default='1024')
+    parser.add_argument('--maxrss', help='terminate a component that uses more than this many MB of memory, 0 to disable', default='0')
+    parser.add_argument('--warncpu', help='log a warning when a component uses more than this fraction of one cpu, 0 to disable', default='1.0')
+    parser.add_argument('--warnthreads', help='log a warning when a component has more threads than this, 0 to disable', default='1000')
+    parser.add_argument('--warnfds', help='log a warning when a component has more open files than this, 0 to disable', default='800')
+    parser.add_argument('--launcherconfig', help='config file with timeouts, relaunch settings and enabled classes, reloaded when it changes', default=None)
+    parser.add_argument('--scaleinterval', help='seconds between checks of the swf backlog, to scale the instances of each class', default='30')
+    parser.add_argument('--backlogfile', help='read pending task counts from this file of task_list=count lines instead of swf, for testing', default=None)
+    parser.add_argument('--maxlines', help='max number of output lines logged per stream per pass, 0 for no limit', default='1000')
+    parser.add_argument('--maxqueued', help='max number of unread output lines buffered per stream, 0 for no limit', default='10000')
+    parser.add_argument('--dropoutput', help='drop output when the buffer is full instead of blocking the process', action="store_true", default=False)
 
     args = parser.parse_args()
 
@@ -285,7 +1086,41 @@ if __name__ == "__main__":
     if not args.noworker:
         config_file = args.config
 
-    launcher = Launcher(args.jarname, args.logfile, config_file, nragent_path)
+    output_limits = OutputLimits(
+        lines_per_pass=int(args.maxlines),
+        queued_lines=int(args.maxqueued),
+        drop=args.dropoutput,
+    )
+
+    log_options = LogOptions(
+        level=args.loglevel,
+        asynchronous=args.asynclog,
+        queue_size=int(args.logqueue),
+        overflow=args.logoverflow,
+    )
+
+    launch_policy = LaunchPolicy(
+        max_starting=int(args.maxstarting),
+        startup_grace=float(args.startupgrace),
+        max_cpu=float(args.maxcpu),
+        min_free_mb=float(args.minfreemem),
+    )
+
+    process_limits = ProcessLimits(
+        interval=float(args.sampleinterval),
+        warn_rss_mb=float(args.warnrss),
+        max_rss_mb=float(args.maxrss),
+        warn_cpu=float(args.warncpu),
+        warn_threads=int(args.warnthreads),
+        warn_fds=int(args.warnfds),
+    )
+
+    backlog = StaticBacklog(path=args.backlogfile) if args.backlogfile else None
+
+    launcher = Launcher(args.jarname, args.logfile, config_file, nragent_path, output_limits, log_options,
+                        int(args.pollers), launch_policy, int(args.warmpool),
+                        args.hostconfig, not args.noheartbeat, int(args.metricsport),
+                        process_limits, args.launcherconfig, backlog, float(args.scaleinterval))
     launcher.launch(args.classes)
     timeouts = Timeouts(
         ping=int(args.ping),
@@ -293,6 +1128,16 @@ if __name__ == "__main__":
         terminate=int(args.terminate),
         kill=int(args.kill),
     )
-    launcher.monitor(int(args.launchdelay), timeouts)
+    relaunch = RelaunchPolicy(
+        base=float(args.relaunchbase),
+        cap=float(args.launchdelay),
+        healthy_uptime=float(args.healthyuptime),
+    )
+    #exit through the finally on terminate, like on ctrl-c
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        launcher.monitor(relaunch, timeouts)
+    finally:
+        launcher.shutdown()
 
 
@@ -0,0 +1,199 @@
+import json
+import bisect
+from threading import Thread, Lock
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+class Metrics(object):
+    """ Registry of counters, gauges and histograms, keyed by name and labels.
+    Updates are a dictionary operation under a lock, cheap enough for the
+    monitor loop and the swf threads. Collectors run when the metrics are
+    read, for values that are cheaper to look up than to keep up to date
+    """
+
+    COUNTER = "counter"
+    GAUGE = "gauge"
+    HISTOGRAM = "histogram"
+
+    #histogram bucket upper bounds, in seconds
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0)
+
+    def __init__(self, prefix="launcher_"):
+        """ @param prefix string - prepended to every metric name """
+        self._prefix = prefix
+        self._lock = Lock()
+        #name -> (type, help, buckets)
+        self._meta = {}
+        #name -> {labels tuple: value}, histogram values are [bucket counts..., count, sum]
+        self._values = {}
+        self._collectors = []
+
+    def describe(self, name, kind, help, buckets=None):
+        """ declare a metric, before it is updated
+        @param name string - metric name, without prefix
+        @param kind string - COUNTER, GAUGE or HISTOGRAM
+        @param help string - description
+        @param buckets tuple - histogram bucket upper bounds, ascending
+        """
+        with self._lock:
+            self._meta[name] = (kind, help, tuple(buckets or self.DEFAULT_BUCKETS))
+            self._values.setdefault(name, {})
+
+    def add_collector(self, f):
+        """ @param f function - called with this object whenever metrics are read """
+        self._collectors.append(f)
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name, value=1, **labels):
+        """ add to a counter """
+        key = self._key(labels)
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """ set a gauge, or a counter kept elsewhere """
+        key = self._key(labels)
+        with self._lock:
+            self._values[name][key] = value
+
+    def remove(self, name, **labels):
+        """ forget a labelled value, e.g. of a component that is gone """
+        with self._lock:
+            self._values[name].pop(self._key(labels), None)
+
+    def prune(self, keep, *names):
+        """ forget the labelled values of the given metrics, or of all of them,
+        that keep returns False for
+        @param keep function - called with a dictionary of the labels of each value
+        """
+        with self._lock:
+            for name in names or list(self._values):
+                values = self._values[name]
+                for key in [k for k in values if k and not keep(dict(k))]:
+                    del values[key]
+
+    def observe(self, name, value, **labels):
+        """ add an observation to a histogram """
+        key = self._key(labels)
+        with self._lock:
+            buckets = self._meta[name][2]
+            values = self._values[name]
+            counts = values.get(key)
+            if counts is None:
+                counts = values[key] = [0] * (len(buckets) + 2)
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def _collect(self):
+        for f in self._collectors:
+            f(self)
+
+    def snapshot(self):
+        """ all current values, histograms as count, sum and cumulative buckets
+        @returns dictionary - name -> list of {"labels": ..., "value": ...}
+        """
+        self._collect()
+        result = {}
+        with self._lock:
+            for name, values in self._values.items():
+                kind, _, buckets = self._meta[name]
+                entries = []
+                for key, value in values.items():
+                    if kind == self.HISTOGRAM:
+                        value = {
+                            "count": value[-2],
+                            "sum": value[-1],
+                            "buckets": dict(zip([str(b) for b in buckets], _cumulative(value[:-2]))),
+                        }
+                    entries.append({"labels": dict(key), "value": value})
+                result[self._prefix + name] = entries
+        return result
+
+    def render(self):
+        """ all current values in the Prometheus text exposition format
+        @returns string
+        """
+        self._collect()
+        lines = []
+        with self._lock:
+            for name in sorted(self._values):
+                kind, help, buckets = self._meta[name]
+                full = self._prefix + name
+                lines.append("# HELP %s %s" % (full, help))
+                lines.append("# TYPE %s %s" % (full, kind))
+                for key, value in sorted(self._values[name].items()):
+                    if kind == self.HISTOGRAM:
+                        counts = _cumulative(value[:-2])
+                        for bound, count in zip([str(b) for b in buckets] + ["+Inf"], counts):
+                            lines.append("%s_bucket%s %d" % (full, _labels(key + (("le", bound),)), count))
+                        lines.append("%s_count%s %d" % (full, _labels(key), value[-2]))
+                        lines.append("%s_sum%s %s" % (full, _labels(key), repr(float(value[-1]))))
+                    else:
+                        lines.append("%s%s %s" % (full, _labels(key), repr(float(value))))
+        return "\n".join(lines) + "\n"
+
+
+def _cumulative(counts):
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{%s}" % (",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in key),)
+
+
+class MetricsServer(object):
+    """ Serves a Metrics object over http on a daemon thread:
+    /metrics in the Prometheus text format, /metrics.json as a json snapshot
+    """
+
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        """ @param metrics Metrics object - what to serve
+        @param port int - port to listen on
+        @param host string - address to listen on, local only by default
+        """
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.render(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                #keep requests out of stderr
+                pass
+
+        self._server = HTTPServer((host, port), Handler)
+        self._thread = Thread(target=self._server.serve_forever, name="metrics-server")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def stop(self):
+        self._server.shutdown()
@@ -0,0 +1,166 @@
+import os
+import select
+import errno
+from threading import Thread, Lock
+
+from waker import Waker
+
+
+class OutputReader(object):
+    """ Reads the output pipes of any number of processes on a single thread.
+    Pipes are multiplexed with poll and read without blocking; complete
+    lines are handed to a per pipe put function.
+    """
+
+    READ_SIZE = 65536
+    POLL_FLAGS = select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR
+
+    class _Stream(object):
+        """ read state of a single pipe """
+        def __init__(self, pipe, put):
+            self.pipe = pipe
+            self.fd = pipe.fileno()
+            self.put = put
+            #partial line read so far
+            self.partial = b''
+            #complete lines not accepted yet by put
+            self.backlog = []
+            self.paused = False
+            self.eof = False
+
+    def __init__(self):
+        self._poller = select.poll()
+        self._streams = {}
+        self._changes = []
+        self._lock = Lock()
+        self._waker = Waker()
+        self._poller.register(self._waker.fileno(), select.POLLIN)
+        self._thread = None
+
+    def add(self, pipe, put):
+        """ start reading from a pipe
+        @param pipe file object - the pipe to read from
+        @param put function - called with each line read. Returns False when
+            the line cannot be accepted; the line is kept and reading from this
+            pipe pauses until resume is called
+        """
+        self._change(self._add, OutputReader._Stream(pipe, put))
+        self._start()
+
+    def resume(self, pipe):
+        """ resume reading from a pipe paused because put returned False
+        @param pipe file object - the pipe passed to add
+        """
+        self._change(self._resume, pipe.fileno())
+
+    def remove(self, pipe):
+        """ stop reading from a pipe, paused or not, and close it
+        @param pipe file object - the pipe passed to add
+        """
+        self._change(self._discard, (pipe.fileno(), pipe))
+
+    def _change(self, f, arg):
+        """ queue a change to be made on the reader thread, which owns the poller """
+        with self._lock:
+            self._changes.append((f, arg))
+        self._waker.wake()
+
+    def _start(self):
+        """ start the reader thread, if not yet running """
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="output-reader")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        """ reader thread: wait for any pipe to become readable and read it """
+        while True:
+            with self._lock:
+                changes, self._changes = self._changes, []
+            for f, arg in changes:
+                f(arg)
+            try:
+                events = self._poller.poll()
+            except (select.error, OSError, IOError) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                if fd == self._waker.fileno():
+                    self._waker.clear()
+                elif fd in self._streams:
+                    self._read(self._streams[fd])
+
+    def _add(self, stream):
+        """ register a new stream with the poller """
+        self._streams[stream.fd] = stream
+        self._poller.register(stream.fd, self.POLL_FLAGS)
+
+    def _remove(self, stream):
+        """ stop polling a stream that is not paused """
+        if self._streams.get(stream.fd) is stream:
+            del self._streams[stream.fd]
+            self._poller.unregister(stream.fd)
+
+    def _discard(self, change):
+        """ forget a stream and close its pipe, on the reader thread so the fd is
+        not reused while it is still registered
+        """
+        fd, pipe = change
+        stream = self._streams.get(fd)
+        if stream is not None and stream.pipe is pipe:
+            del self._streams[fd]
+            if not stream.paused:
+                self._poller.unregister(fd)
+        pipe.close()
+
+    def _resume(self, fd):
+        """ deliver any lines held back and resume polling """
+        stream = self._streams.get(fd)
+        if stream and stream.paused:
+            if self._deliver(stream, []):
+                stream.paused = False
+                if stream.eof:
+                    del self._streams[fd]
+                else:
+                    self._poller.register(fd, self.POLL_FLAGS)
+
+    def _deliver(self, stream, lines):
+        """ hand lines to the stream's put function, backlog first
+        @returns boolean - False if the stream was paused
+        """
+        backlog = stream.backlog + lines if stream.backlog else lines
+        for i, line in enumerate(backlog):
+            if not stream.put(line):
+                stream.backlog = backlog[i:]
+                if not stream.paused:
+                    stream.paused = True
+                    self._poller.unregister(stream.fd)
+                return False
+        stream.backlog = []
+        return True
+
+    def _read(self, stream):
+        """ read whatever is available and split it into lines """
+        try:
+            data = os.read(stream.fd, self.READ_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            stream.eof = True
+            if self._deliver(stream, [b"IOError"]):
+                self._remove(stream)
+            return
+        if not data:
+            #end of file: the process closed the pipe, likely exited.
+            # a paused stream is removed once its backlog is delivered
+            stream.eof = True
+            lines = [stream.partial] if stream.partial else []
+            stream.partial = b''
+            if self._deliver(stream, lines):
+                self._remove(stream)
+            return
+        lines = (stream.partial + data).split(b'\n')
+        stream.partial = lines.pop()
+        self._deliver(stream, [line + b'\n' for line in lines])
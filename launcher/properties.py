@@ -0,0 +1,101 @@
+import os
+import re
+from collections import OrderedDict
+
+
+class PropertiesLoader(object):
+    """ Reads the config/*.properties files the workers use, following their
+    include= directives. Parsed files are memoized by path and mtime, so a
+    file included by many others is parsed once, and again only after it
+    changes. Like commons PropertiesConfiguration's getString, the first
+    value of a key wins, includes counting at the place they are included.
+    Values are kept as written; commas are not split into lists
+    """
+
+    INCLUDE = "include"
+
+    _rx = re.compile(r"^\s*([^#!=:\s](?:\\.|[^=:\s\\])*)\s*[=:\s]\s*(.*?)\s*$")
+
+    def __init__(self):
+        #path -> (mtime, [(key, value)...]) of single files, includes unresolved
+        self._files = {}
+        #path -> ([(path, mtime)...] of all files involved, merged OrderedDict)
+        self._merged = {}
+
+    def load(self, path):
+        """ the merged properties of a file and everything it includes.
+        Missing files, included or not, count as empty
+        @param path string - the properties file
+        @returns OrderedDict - key -> value; do not modify, it is shared
+        """
+        path = os.path.abspath(path)
+        cached = self._merged.get(path)
+        if cached and all(self._mtime(p) == mtime for p, mtime in cached[0]):
+            return cached[1]
+        involved = []
+        merged = OrderedDict()
+        self._merge(path, merged, involved, set())
+        self._merged[path] = (involved, merged)
+        return merged
+
+    def for_class(self, config_dir, name):
+        """ the merged properties of a component, from config/<name>.properties
+        @param config_dir string - the config directory
+        @param name string - the component name, its class name without the package
+        @returns OrderedDict - see load
+        """
+        return self.load(os.path.join(config_dir, name + ".properties"))
+
+    def _merge(self, path, merged, involved, seen):
+        """ add the entries of a file to merged, resolving includes relative to it """
+        if path in seen:
+            #include loop
+            return
+        seen.add(path)
+        for key, value in self._entries(path, involved):
+            if key == self.INCLUDE:
+                self._merge(os.path.join(os.path.dirname(path), value), merged, involved, seen)
+            elif key not in merged:
+                merged[key] = value
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _entries(self, path, involved):
+        """ the entries of a single file, from the cache if it did not change """
+        mtime = self._mtime(path)
+        involved.append((path, mtime))
+        cached = self._files.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        entries = self._parse(path) if mtime is not None else []
+        self._files[path] = (mtime, entries)
+        return entries
+
+    def _parse(self, path):
+        """ key/value pairs of a file, in order. Handles comments and
+        backslash continued lines; keys may be separated by =, : or whitespace
+        """
+        entries = []
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except IOError:
+            return entries
+        logical = ""
+        for line in lines:
+            if not logical and line.lstrip()[:1] in ("#", "!"):
+                continue
+            if line.endswith("\\") and not line.endswith("\\\\"):
+                logical += line[:-1].lstrip() if logical else line[:-1]
+                continue
+            logical += line.lstrip() if logical else line
+            mo = self._rx.match(logical)
+            if mo:
+                entries.append((mo.group(1).replace("\\", ""), mo.group(2)))
+            logical = ""
+        return entries
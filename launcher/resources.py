@@ -0,0 +1,152 @@
+import os
+import subprocess
+from collections import namedtuple
+
+#container class for the resources a component may use, any value can be None
+# xmx, xms: max and initial JVM heap, like 512m
+# cpus: cpu affinity list, as taskset takes it, like 0-1,3
+# nice: scheduling niceness, -20 to 19
+# ionice: io scheduling class[:level], like idle or best-effort:7
+# cgroup: cgroup v2 to run in, relative to CGROUP_MOUNT, like fulfillment/htmlrenderer
+# memory_max: cgroup memory.max, like 1G
+# cpu_max: cgroup cpu.max, like 150% of a cpu, or quota and period: 150000 100000
+ResourceProfile = namedtuple('ResourceProfile',
+    ["xmx", "xms", "cpus", "nice", "ionice", "cgroup", "memory_max", "cpu_max"])
+
+#the properties each ResourceProfile field is read from
+PROPERTY_PREFIX = "launcher."
+CGROUP_MOUNT = "/sys/fs/cgroup"
+IONICE_CLASSES = { "realtime": "1", "best-effort": "2", "idle": "3" }
+NICE_RANGE = (-20, 19)
+
+
+def load_profile(props):
+    """ the resource profile of a component, from the launcher.* properties
+    of its config:
+        launcher.xmx, launcher.xms, launcher.cpus, launcher.nice, launcher.ionice,
+        launcher.cgroup, launcher.cgroup.memory_max, launcher.cgroup.cpu_max
+    Invalid values are left out of the profile and reported
+    @param props dictionary - the component's properties, see PropertiesLoader.for_class
+    @returns (ResourceProfile object or None, list of strings) - the profile, None if no
+        limits are configured, and the errors in it
+    """
+    keys = ["xmx", "xms", "cpus", "nice", "ionice", "cgroup", "cgroup.memory_max", "cgroup.cpu_max"]
+    values = [props.get(PROPERTY_PREFIX + key) or None for key in keys]
+    errors = []
+    nice = keys.index("nice")
+    if values[nice] is not None:
+        try:
+            value = int(values[nice])
+            if not NICE_RANGE[0] <= value <= NICE_RANGE[1]:
+                raise ValueError("out of range %d to %d" % NICE_RANGE)
+            values[nice] = str(value)
+        except ValueError as e:
+            errors.append("%snice %s: %s" % (PROPERTY_PREFIX, values[nice], str(e)))
+            values[nice] = None
+    if not any(values):
+        return None, errors
+    return ResourceProfile(*values), errors
+
+
+def jvm_args(profile):
+    """ java options for the heap limits in a profile
+    @returns list of strings
+    """
+    args = []
+    if profile and profile.xmx:
+        args.append("-Xmx" + profile.xmx)
+    if profile and profile.xms:
+        args.append("-Xms" + profile.xms)
+    return args
+
+
+def wrap_cmdline(profile, cmdline):
+    """ prefix a command line with the tools that set its affinity and
+    priorities. They exec the command, so its pid stays the same
+    @returns list of strings
+    """
+    prefix = []
+    if profile and profile.cpus:
+        prefix += ["taskset", "-c", profile.cpus]
+    if profile and profile.ionice:
+        prefix += ["ionice"] + _ionice_args(profile.ionice)
+    if profile and profile.nice:
+        prefix += ["nice", "-n", profile.nice]
+    return prefix + cmdline
+
+
+def _ionice_args(ionice):
+    cls, _, level = ionice.partition(":")
+    args = ["-c", IONICE_CLASSES.get(cls, cls)]
+    if level:
+        args += ["-n", level]
+    return args
+
+
+def apply_to_pid(profile, pid):
+    """ set affinity and priorities of a process that is already running,
+    and all of its threads. Niceness and io priority are per thread on Linux,
+    so they are set on every thread there is now; threads started later
+    inherit them from the thread that starts them
+    @returns list of strings - errors, empty if all went well
+    """
+    commands = []
+    if profile and profile.cpus:
+        commands.append(["taskset", "-a", "-p", "-c", profile.cpus, str(pid)])
+    tids = _threads(pid) if profile and (profile.ionice or profile.nice) else []
+    if profile and profile.ionice:
+        commands.append(["ionice"] + _ionice_args(profile.ionice) + ["-p"] + tids)
+    if profile and profile.nice:
+        commands.append(["renice", "-n", profile.nice, "-p"] + tids)
+    errors = []
+    for command in commands:
+        try:
+            with open(os.devnull, "w") as devnull:
+                subprocess.check_call(command, stdout=devnull, stderr=devnull)
+        except (OSError, subprocess.CalledProcessError) as e:
+            errors.append("%s: %s" % (command[0], str(e)))
+    return errors
+
+
+def _threads(pid):
+    """ @returns list of strings - the thread ids of a process, just the pid if they cannot be listed """
+    try:
+        return sorted(os.listdir("/proc/%d/task" % (pid,)), key=int)
+    except OSError:
+        return [str(pid)]
+
+
+def join_cgroup(profile, pid):
+    """ move a process into the profile's cgroup, creating it and setting
+    its limits first. Needs write access to the cgroup tree, and the memory
+    and cpu controllers enabled in the parent
+    @returns list of strings - errors, empty if all went well
+    """
+    if not profile or not profile.cgroup:
+        return []
+    path = os.path.join(CGROUP_MOUNT, profile.cgroup)
+    limits = [("memory.max", profile.memory_max), ("cpu.max", _cpu_max(profile.cpu_max))]
+    errors = []
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for filename, value in limits:
+            if value:
+                _write(os.path.join(path, filename), value)
+        _write(os.path.join(path, "cgroup.procs"), str(pid))
+    except (IOError, OSError) as e:
+        errors.append("cgroup %s: %s" % (path, str(e)))
+    return errors
+
+
+def _cpu_max(cpu_max):
+    """ cpu.max from a percentage of a cpu, or passed as is """
+    if cpu_max and cpu_max.endswith("%"):
+        period = 100000
+        return "%d %d" % (int(float(cpu_max[:-1]) * period / 100), period)
+    return cpu_max
+
+
+def _write(path, value):
+    with open(path, "w") as f:
+        f.write(value)
@@ -1,8 +1,12 @@
 import boto
 import boto.swf.layer2 as swf
-from boto.swf.exceptions import SWFTypeAlreadyExistsError, SWFDomainAlreadyExistsError
-from threading import Thread, Event
+from boto.swf.layer1 import Layer1
+from boto.swf.exceptions import SWFTypeAlreadyExistsError, SWFDomainAlreadyExistsError, SWFLimitExceededError
+from threading import Thread, Event, Lock, Condition
 from collections import namedtuple
+import itertools
+import heapq
+import random
 import time
 import json
 
@@ -15,30 +19,189 @@ class UnknownRegionException(Exception):
     """ explicit exception (over keyerror) when a region cannot be resolved """
     pass
 
-class PollInfo(namedtuple('PollInfo', ['stop', 'get'])):
-    """ container class for access to async swf task polling """
+class PollInfo(namedtuple('PollInfo', ['stop', 'get', 'stats'])):
+    """ container class for access to async swf task polling
+    stats returns a dict of poller metrics: in flight polls, queue depth etc.
+    """
     pass
 
-class Task(namedtuple('Task', ['params', 'complete', 'fail'])):
-    """ wrapper for a SWF task. Attaches complete and fail functions """
+class Task(namedtuple('Task', ['params', 'complete', 'fail', 'received'])):
+    """ wrapper for a SWF task. Attaches complete and fail functions,
+    and the time it was received
+    """
     pass
 
+def backoff_delay(attempt, base, cap):
+    """ exponential backoff with full jitter
+    @param attempt int - number of consecutive failures so far, starting at 0
+    @param base float - delay in seconds for the first attempt
+    @param cap float - maximum delay in seconds
+    @returns float - seconds to wait
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def is_throttled(e):
+    """ True if the exception is SWF telling us to slow down """
+    if isinstance(e, SWFLimitExceededError):
+        return True
+    return "Throttling" in str(getattr(e, "error_code", None) or getattr(e, "body", None) or e)
+
+class Responder(object):
+    """ Sends task responses (complete, fail) to SWF on a background thread,
+    so callers never wait on SWF. Failed responses are retried with backoff,
+    unless SWF rejected the request itself (e.g. the task timed out). A response
+    waiting for its retry goes back in the queue with the time it is due, so it
+    does not hold up the responses behind it
+    """
+
+    RETRY_BASE = 0.5
+    RETRY_CAP = 30.0
+    MAX_ATTEMPTS = 8
+
+    def __init__(self, log=None):
+        """ @param log Splogger - optional, used to report failed responses """
+        self._log = log
+        #heap of (not before, sequence, submitted, attempt, name, f, args); the
+        # sequence keeps responses due at the same time in the order they came in
+        self._pending = []
+        self._sequence = itertools.count()
+        self._stopped = False
+        self._lock = Lock()
+        self._ready = Condition(self._lock)
+        self._stats = {
+            "responses": 0,
+            "response_retries": 0,
+            "response_failures": 0,
+            "response_latency_total": 0.0,
+            "response_latency_max": 0.0,
+        }
+        self._thread = Thread(target=self._run, name="swf-responder")
+        #does not keep the process alive; stop sends what is queued
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, name, f, *args):
+        """ queue a response; returns immediately
+        @param name string - what is being sent, for reporting
+        @param f function - sends the response
+        @param args - arguments for f
+        """
+        now = time.time()
+        with self._ready:
+            heapq.heappush(self._pending, (now, next(self._sequence), now, 0, name, f, args))
+            self._ready.notify()
+
+    def _retryable(self, e):
+        """ SWF client errors (4xx) other than throttling won't succeed on retry """
+        status = getattr(e, "status", None)
+        if isinstance(status, int) and 400 <= status < 500:
+            return is_throttled(e)
+        return True
+
+    def _send(self, submitted, attempt, name, f, args):
+        """ send one response, and queue it again for a retry if that fails """
+        try:
+            f(*args)
+        except Exception as e:
+            attempt += 1
+            with self._ready:
+                retry = attempt < self.MAX_ATTEMPTS and self._retryable(e) and not self._stopped
+                if retry:
+                    self._stats["response_retries"] += 1
+                    due = time.time() + backoff_delay(attempt - 1, self.RETRY_BASE, self.RETRY_CAP)
+                    heapq.heappush(self._pending, (due, next(self._sequence), submitted, attempt, name, f, args))
+                else:
+                    self._stats["response_failures"] += 1
+            if not retry and self._log:
+                self._log.error("swf %s failed after %d attempts: %s", name, attempt, e)
+            return
+        latency = time.time() - submitted
+        with self._lock:
+            self._stats["responses"] += 1
+            self._stats["response_latency_total"] += latency
+            self._stats["response_latency_max"] = max(self._stats["response_latency_max"], latency)
+
+    def _next(self):
+        """ wait for the next response that is due
+        @returns tuple or None - the arguments of _send, None once stopped and all sent
+        """
+        with self._ready:
+            while True:
+                if self._pending and (self._stopped or self._pending[0][0] <= time.time()):
+                    return heapq.heappop(self._pending)[2:]
+                if self._stopped:
+                    return None
+                self._ready.wait(self._pending[0][0] - time.time() if self._pending else None)
+
+    def _run(self):
+        """ responder thread: send responses as they are due until stopped """
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            self._send(*item)
+
+    def stats(self):
+        """ @returns dict - a snapshot of the response metrics """
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["responses_pending"] = len(self._pending)
+        total = snapshot.pop("response_latency_total")
+        snapshot["response_latency_avg"] = total / snapshot["responses"] if snapshot["responses"] else 0.0
+        return snapshot
+
+    def stop(self, timeout=None):
+        """ send what is queued, without further retries, and stop the thread
+        @param timeout float - optional, seconds to wait for the queued responses to go out
+        """
+        with self._ready:
+            self._stopped = True
+            self._ready.notify()
+        if timeout is not None:
+            self._thread.join(timeout)
+
 class SwfWorker(swf.ActivityWorker):
     """ Extension of the SWF Activity worker supporting asynchronous polling """
 
-    def __init__(self, region_name, name, domain, version):
-        """ construct the worker, and register it """
+    #backoff after failed polls, in seconds
+    POLL_BACKOFF_BASE = 1.0
+    POLL_BACKOFF_CAP = 60.0
+
+    def __init__(self, region_name, name, domain, version, log=None, connection=None):
+        """ construct the worker, and register it
+        @param log Splogger - optional, used to report polling errors
+        @param connection - optional, a Layer1 compatible object to talk to instead of
+            SWF in the region, like the LocalSwf stand-in used for load tests
+        """
+        self._log = log
         region = self.resolve_region(region_name)
+        #boto makes a Layer1 before it can be replaced, and that needs credentials
+        self._credentials = {} if connection is None else { "aws_access_key_id": "local", "aws_secret_access_key": "local" }
         task_list = name + version
         super(SwfWorker, self).__init__(
             region=region,
             domain=domain,
             name=name,
             task_list=task_list,
-            version=version
+            version=version,
+            **self._credentials
         )
+        self._connection = connection
+        if connection is not None:
+            self._swf = connection
         self.register()
 
+    def connect(self):
+        """ a connection of its own for a thread: boto connections are not thread safe
+        @returns Layer1 - a new connection to SWF in the worker's region, or the
+            connection given to the worker
+        """
+        if self._connection is not None:
+            return self._connection
+        return Layer1(self._credentials.get("aws_access_key_id"),
+                      self._credentials.get("aws_secret_access_key"),
+                      region=self.region)
+
     def resolve_region(self, region_name):
         """ resolves a region object from a region name """
         region_list = boto.swf.regions()
@@ -58,8 +221,11 @@ class SwfWorker(swf.ActivityWorker):
             domain=self.domain,
             name=self.name,
             version=self.version,
-            task_list=self.task_list
+            task_list=self.task_list,
+            **self._credentials
         )
+        #through the worker's connection, in case it is not SWF
+        at._swf = self._swf
         try:
             at.register()
         except SWFTypeAlreadyExistsError:
@@ -74,31 +240,80 @@ class SwfWorker(swf.ActivityWorker):
             return task
         return None
 
-    def start_async_polling(self):
-        """ starts a thread to poll swf into a queue
-        task are wrapped into Task objects
+    def start_async_polling(self, notify=None, pollers=1):
+        """ starts threads to poll swf into a queue
+        task are wrapped into Task objects. Each poller thread, and the Responder,
+        has a connection of its own, and polls through it rather than through the
+        worker, which keeps the last task token of whoever polled last.
+        Task complete and fail return right away; a Responder sends them
+        @param notify function - optional, called whenever a task is queued
+        @param pollers int - number of concurrent long polls
         @returns PollInfo object - contains methods to
-            get a task or stop the thread
+            get a task, get poll stats or stop the threads
         """
         e = Event()
         q = queue.Queue()
-        complete = self.complete
-        fail = self.fail
+        lock = Lock()
+        stats = {
+            "pollers": pollers,
+            "in_flight": 0,
+            "polls": 0,
+            "tasks": 0,
+            "errors": 0,
+            "throttled": 0,
+        }
+        responder = Responder(self._log)
+        #only used on the responder thread
+        responses = self.connect()
+        complete = lambda token, result: responder.submit("complete", responses.respond_activity_task_completed, token, result)
+        fail = lambda token, details: responder.submit("fail", responses.respond_activity_task_failed, token, details)
+
+        def _count(key, n=1):
+            with lock:
+                stats[key] += n
+
+        def _poll(connection):
+            """ one long poll, counted while in flight """
+            _count("in_flight")
+            try:
+                return connection.poll_for_activity_task(self.domain, self.task_list)
+            finally:
+                _count("in_flight", -1)
+                _count("polls")
 
         def _run():
-            """ function to run by the thread
-            closes over self.poll and constructs new Task
-            objects that close over self.fail and self.complete
+            """ function to run by the poller threads
+            polls through its own connection and constructs new Task
+            objects that close over the responder's complete and fail
             """
+            connection = self.connect()
+            failures = 0
             while not e.is_set():
-                task = self.poll()
+                try:
+                    task = _poll(connection)
+                    failures = 0
+                except Exception as ex:
+                    throttled = is_throttled(ex)
+                    _count("throttled" if throttled else "errors")
+                    delay = backoff_delay(failures, self.POLL_BACKOFF_BASE, self.POLL_BACKOFF_CAP)
+                    failures += 1
+                    if self._log:
+                        log = self._log.warn if throttled else self._log.error
+                        log("swf poll failed, retrying in %.1f seconds: %s", delay, ex)
+                    e.wait(delay)
+                    continue
                 if 'activityId' in task:
+                    _count("tasks")
                     token = task['taskToken']
                     q.put(Task(
                         params=json.loads(task['input']),
-                        complete=lambda result=None: complete(token, result),
-                        fail=lambda details=None: fail(token, details),
+                        #bound now: the next task replaces token before this one is done
+                        complete=lambda result=None, token=token: complete(token, result),
+                        fail=lambda details=None, token=token: fail(token, details),
+                        received=time.time(),
                     ))
+                    if notify:
+                        notify()
 
         def _get ():
             """ local function to return as part of the pollinfo
@@ -109,13 +324,35 @@ class SwfWorker(swf.ActivityWorker):
                 return q.get_nowait()
             except queue.Empty:
                 pass
-            except Exception as e:
-                self._log.warn("exception getting task from queue: %s" % (str(e),))
+            except Exception as ex:
+                if self._log:
+                    self._log.warn("exception getting task from queue: %s", ex)
             return None
 
-        t = Thread(target=_run)
-        t. start()
-        return PollInfo(stop=e.set, get=_get)
+        def _stats():
+            """ local function to return as part of the pollinfo
+            @returns dict - a snapshot of the poller metrics
+            """
+            with lock:
+                snapshot = dict(stats)
+            snapshot["queued"] = q.qsize()
+            snapshot.update(responder.stats())
+            return snapshot
+
+        def _stop(timeout=None):
+            """ local function to return as part of the pollinfo
+            to stop polling and responding. A poll in flight is not waited for
+            @param timeout float - optional, seconds to wait for queued responses to go out
+            """
+            e.set()
+            responder.stop(timeout)
+
+        for i in range(pollers):
+            t = Thread(target=_run, name="swf-poller-%d" % (i,))
+            #a long poll does not hold up exiting
+            t.daemon = True
+            t.start()
+        return PollInfo(stop=_stop, get=_get, stats=_stats)
 
 if __name__ == "__main__":
     w = SwfWorker(region_name="us-west-2", domain="fauxfillment", name="launcher", version="1")
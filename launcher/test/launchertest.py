@@ -0,0 +1,219 @@
+#call this as: python launcher/test/launchertest.py
+# runs the launcher on shell script components, stepping its monitor by hand
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+
+from launcher import Launcher, Timeouts, RelaunchPolicy
+from backlog import StaticBacklog
+import component
+from workerhost import WorkerHost
+
+TIMEOUTS = Timeouts(10, 20, 30, 40)
+RELAUNCH = RelaunchPolicy(base=1, cap=10, healthy_uptime=100)
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    #the config is reloaded by mtime, which may not have moved within the test
+    mtime = time.time() + (os.path.getmtime(path) if os.path.exists(path) else 0) % 1 + 1
+    os.utime(path, (mtime, mtime))
+
+
+def make_launcher(workdir, backlog, heartbeat=False):
+    """ a launcher following the enabled set of its launcher config, running a
+    class with two to four instances. Components echo their input until told to quit
+    """
+    java = os.path.join(workdir, "java")
+    write(java, '#!/bin/sh\necho started\nwhile read l; do [ "$l" = quit ] && exit 0; done\n')
+    os.chmod(java, 0o755)
+    component.Component.java_cmdline = staticmethod(lambda jar, nragent_path=None: [java])
+    os.mkdir(os.path.join(workdir, "config"))
+    write(os.path.join(workdir, "config", "one.properties"),
+          "name=One\nversion=1\ndomain=test\n"
+          "launcher.instances.min=2\nlauncher.instances.max=4\nlauncher.instances.tasks=1\n")
+    launchercfg = os.path.join(workdir, "launcher.properties")
+    write(launchercfg, "enabled.one=true\n")
+    Launcher.ALL_CLASSES = { "test.one": True }
+    launcher = Launcher(os.path.join(workdir, "test.jar"), os.path.join(workdir, "launcher.log"),
+                        heartbeat=heartbeat, launchercfg=launchercfg, backlog=backlog, scale_interval=0)
+    #what monitor sets up before its loop
+    launcher._base_timeouts = launcher._timeouts = TIMEOUTS
+    launcher._base_relaunch = launcher._relaunch = RELAUNCH
+    launcher.launch()
+    return launcher, launchercfg
+
+
+def step(launcher):
+    """ one pass of the monitor loop, without waiting """
+    launcher.reload_config()
+    for key in list(launcher._components):
+        c = launcher._components[key]
+        launcher.log_component(c)
+        if c.retired is not None:
+            launcher.drain(c, TIMEOUTS)
+    launcher.autoscale()
+    launcher.admit_launches()
+    launcher._next_metrics = 0
+    launcher.update_metrics()
+
+
+def settle(launcher, done, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        step(launcher)
+        if done():
+            return
+        time.sleep(0.05)
+    raise AssertionError("launcher did not settle: %s" % (sorted(launcher._components),))
+
+
+def cleanup(launcher, workdir):
+    for c in launcher._components.values():
+        c.kill()
+    launcher._log.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def queued(launcher):
+    return [p for p in launcher._pending_launches if p[0] == "test.one"]
+
+
+def test_disabled_class_is_not_scaled():
+    """ disabling a class drains its instances; autoscale must not launch it again """
+    workdir = tempfile.mkdtemp(prefix="launcher-test-")
+    backlog = StaticBacklog({ "One1": 3 })
+    launcher, launchercfg = make_launcher(workdir, backlog)
+    try:
+        settle(launcher, lambda: len(launcher.instances("test.one")) == 3)
+        assert launcher._metrics.snapshot()["launcher_component_up"]
+        #reading the metrics, on the server's thread, must not reap children
+        is_alive = component.Component.is_alive
+        component.Component.is_alive = lambda self: 1 / 0
+        try:
+            launcher._metrics.snapshot()
+        finally:
+            component.Component.is_alive = is_alive
+        write(launchercfg, "enabled.one=false\n")
+        launcher._next_reload = 0
+        step(launcher)
+        assert all(c.retired is not None for c in launcher.instances("test.one"))
+        assert not queued(launcher), launcher._pending_launches
+        settle(launcher, lambda: not launcher.instances("test.one"))
+        step(launcher)
+        assert not queued(launcher), launcher._pending_launches
+        assert not launcher.instances("test.one")
+        #no metrics left for the drained instances
+        series = [(name, entry["labels"]) for name, entries in launcher._metrics.snapshot().items()
+                  for entry in entries if "instance" in entry["labels"] or name.endswith("_instances")]
+        assert not series, series
+    finally:
+        cleanup(launcher, workdir)
+
+
+def test_no_scaling_while_draining():
+    """ a scaled down instance is gone before the class is scaled again """
+    workdir = tempfile.mkdtemp(prefix="launcher-test-")
+    backlog = StaticBacklog({ "One1": 3 })
+    launcher, launchercfg = make_launcher(workdir, backlog)
+    try:
+        settle(launcher, lambda: len(launcher.instances("test.one")) == 3)
+        backlog.set("One1", 0)
+        launcher.autoscale()
+        draining = [c for c in launcher.instances("test.one") if c.retired is not None]
+        assert len(draining) == 1, draining
+        #more work right away: no launch while the instance drains
+        backlog.set("One1", 4)
+        launcher.autoscale()
+        assert not queued(launcher), launcher._pending_launches
+        settle(launcher, lambda: len(launcher.instances("test.one")) == 4
+                                 and all(c.retired is None for c in launcher.instances("test.one")))
+    finally:
+        cleanup(launcher, workdir)
+
+
+def test_drained_component_lets_go_of_heartbeat():
+    """ a drained component's heartbeat fifo is removed, and no longer read """
+    workdir = tempfile.mkdtemp(prefix="launcher-test-")
+    launcher, launchercfg = make_launcher(workdir, StaticBacklog({}), heartbeat=True)
+    try:
+        settle(launcher, lambda: len(launcher.instances("test.one")) == 2)
+        assert len(os.listdir(launcher._heartbeat_dir)) == 2
+        write(launchercfg, "enabled.one=false\n")
+        launcher._next_reload = 0
+        for c in launcher.instances("test.one"):
+            c.kill()
+        settle(launcher, lambda: not launcher.instances("test.one"))
+        assert not os.listdir(launcher._heartbeat_dir)
+        reader = launcher._reader
+        deadline = time.time() + 5
+        while time.time() < deadline and (reader._streams or reader._changes):
+            time.sleep(0.01)
+        assert not reader._streams, reader._streams
+    finally:
+        cleanup(launcher, workdir)
+        launcher.shutdown()
+
+
+def test_launch_without_monitor():
+    """ launch only queues; start_launches starts the queue without the monitor loop """
+    workdir = tempfile.mkdtemp(prefix="launcher-test-")
+    launcher, launchercfg = make_launcher(workdir, StaticBacklog({}))
+    try:
+        assert queued(launcher) and not launcher.instances("test.one")
+        launcher.start_launches()
+        assert not launcher._pending_launches, launcher._pending_launches
+        assert len(launcher.instances("test.one")) == 1
+        assert launcher.instances("test.one")[0].is_alive()
+    finally:
+        cleanup(launcher, workdir)
+
+
+def test_hung_hosted_worker():
+    """ workers in a host share its heartbeat: one that stops sending frames is
+    not covered by the frames of the other
+    """
+    workdir = tempfile.mkdtemp(prefix="launcher-test-")
+    java = os.path.join(workdir, "java")
+    write(java, '#!/bin/sh\nwhile read l; do [ "$l" = quit ] && exit 0; done\n')
+    os.chmod(java, 0o755)
+    component.Component.java_cmdline = staticmethod(lambda jar, nragent_path=None: [java])
+    host = WorkerHost(os.path.join(workdir, "test.jar"), "group", ["test.busy", "test.hung"],
+                      heartbeat_dir=workdir)
+    try:
+        host.launch()
+        now = time.time()
+        for w in host.workers:
+            w.launchtime = now - 100
+        with open(host._heartbeat.path, "w") as fifo:
+            fifo.write('{"worker": "test.hung", "idle": 50, "inflight": 0}\n')
+            fifo.write('{"worker": "test.busy", "idle": 0, "inflight": 0}\n')
+        deadline = time.time() + 5
+        while host._heartbeat.last_active("test.busy") is None and time.time() < deadline:
+            time.sleep(0.01)
+        assert host._heartbeat.last_active() >= now
+        assert now - 51 <= host.last_heard_from <= now - 49, now - host.last_heard_from
+        #restarted since: the old frames don't count against it
+        host.start_worker("test.hung")
+        assert host.last_heard_from >= now
+    finally:
+        host.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_disabled_class_is_not_scaled()
+    test_no_scaling_while_draining()
+    test_drained_component_lets_go_of_heartbeat()
+    test_launch_without_monitor()
+    test_hung_hosted_worker()
+    print("ok")
+    sys.stdout.flush()
+    #without waiting for the output reader thread, which reads pipes until the end
+    os._exit(0)
@@ -0,0 +1,82 @@
+#call this as: python launcher/test/swfworkertest.py
+# polls tasks from a LocalSwf stand-in and checks every response goes to its own task
+import os
+import sys
+import json
+import time
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+sys.path.insert(0, os.path.join(os.path.dirname(TEST_DIR), "bench"))
+
+from swfworker import SwfWorker, Responder
+from localswf import LocalSwf
+import swfworker
+
+DOMAIN = "local"
+TIMEOUT = 10
+
+
+def wait_for(f, what):
+    deadline = time.time() + TIMEOUT
+    while time.time() < deadline:
+        value = f()
+        if value:
+            return value
+        time.sleep(0.01)
+    raise AssertionError("timed out waiting for %s" % (what,))
+
+
+def test_out_of_order_responses():
+    """ two tasks queued before either is done, answered last one first """
+    local = LocalSwf(poll_timeout=0.1)
+    worker = SwfWorker("us-west-2", "launcher", DOMAIN, "1", connection=local)
+    first = local.schedule(DOMAIN, "launcher1", json.dumps({ "n": 1 }))
+    second = local.schedule(DOMAIN, "launcher1", json.dumps({ "n": 2 }))
+    poller = worker.start_async_polling(pollers=1)
+    try:
+        tasks = [wait_for(poller.get, "task %d" % (i,)) for i in (1, 2)]
+        wait_for(lambda: poller.stats()["tasks"] == 2, "both polls")
+        tasks = dict((task.params["n"], task) for task in tasks)
+        tasks[2].fail("two")
+        tasks[1].complete("one")
+        closed = wait_for(lambda: all(t["closed"] for t in local.tasks()) and local.tasks(), "responses")
+    finally:
+        poller.stop()
+    closed = dict((t["taskToken"], t) for t in closed)
+    assert closed[first]["status"] == "COMPLETED", closed[first]
+    assert closed[first]["result"] == "one", closed[first]
+    assert closed[second]["status"] == "FAILED", closed[second]
+    assert closed[second]["result"] == "two", closed[second]
+
+
+def test_retry_does_not_hold_up_responses():
+    """ a response waiting for its retry lets the ones behind it through """
+    sent = []
+    failures = [Exception("unavailable")]
+    def send(name):
+        if name == "first" and failures:
+            raise failures.pop()
+        sent.append((name, time.time()))
+    backoff_delay = swfworker.backoff_delay
+    swfworker.backoff_delay = lambda attempt, base, cap: 1.0
+    responder = Responder()
+    try:
+        start = time.time()
+        responder.submit("first", send, "first")
+        responder.submit("second", send, "second")
+        wait_for(lambda: len(sent) == 2, "both responses")
+    finally:
+        responder.stop()
+        swfworker.backoff_delay = backoff_delay
+    assert [name for name, _ in sent] == ["second", "first"], sent
+    assert sent[0][1] - start < 0.5, sent
+    assert sent[1][1] - start >= 1.0, sent
+    stats = responder.stats()
+    assert stats["responses"] == 2 and stats["response_retries"] == 1, stats
+
+
+if __name__ == "__main__":
+    test_out_of_order_responses()
+    test_retry_does_not_hold_up_responses()
+    print("ok")
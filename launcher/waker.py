@@ -0,0 +1,64 @@
+import os
+import select
+import errno
+import fcntl
+
+
+class Waker(object):
+    """ self-pipe used to wake up a select based loop. wake() may be called
+    from any thread, or from a signal handler, and coalesces: any number of
+    wakes before the next wait() result in a single wakeup
+    """
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+    def fileno(self):
+        """ the readable end of the pipe, for use in select/poll """
+        return self._read_fd
+
+    def wake(self):
+        """ wake up the waiting loop. Never blocks """
+        try:
+            os.write(self._write_fd, b'x')
+        except OSError as e:
+            #a full pipe means a wakeup is already pending
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def clear(self):
+        """ consume all pending wakeups """
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def wait(self, timeout=None):
+        """ block until woken up or until the timeout expires
+        @param timeout float or None - max number of seconds to wait, None waits forever
+        @returns boolean - True if woken up (or interrupted by a signal), False on timeout
+        """
+        try:
+            readable, _, _ = select.select([self._read_fd], [], [], timeout)
+        except (select.error, OSError, IOError) as e:
+            #a signal arrived; its handler has likely called wake()
+            if e.args[0] == errno.EINTR:
+                self.clear()
+                return True
+            raise
+        if readable:
+            self.clear()
+            return True
+        return False
+
+    def close(self):
+        """ close both ends of the pipe """
+        os.close(self._read_fd)
+        os.close(self._write_fd)
@@ -0,0 +1,121 @@
+import subprocess
+import time
+
+from swfworker import backoff_delay
+
+
+class WarmPool(object):
+    """ Keeps a number of idle JVMs running the warmstart bootstrap, which
+    has already loaded the jar. A component launch takes one of them and
+    hands it the main to run on stdin, instead of starting a JVM from scratch.
+    An idle JVM that dies had its bootstrap crash: the pool backs off before
+    starting more, like relaunches of a crashing component
+    """
+
+    BOOTSTRAP = "com.balihoo.fulfillment.warmstart"
+
+    def __init__(self, cmdline, cwd, size):
+        """ WarmPool constructor
+        @param cmdline list - java command line, without the main class
+        @param cwd string - directory to run in, config uses relative paths from cwd
+        @param size int - number of idle JVMs to keep around
+        """
+        self._cmdline = cmdline + [self.BOOTSTRAP]
+        self._cwd = cwd
+        self._size = size
+        self._idle = []
+        #idle JVM -> time it was started
+        self._started = {}
+        #idle JVMs that died in a row, how many of them the backoff is for,
+        # and when the pool may start JVMs again
+        self._failures = 0
+        self._backed_off = 0
+        self._next_fill = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def idle(self):
+        """ number of idle JVMs that are still alive. Counts the ones that died """
+        alive = []
+        for proc in self._idle:
+            if proc.poll() is None:
+                alive.append(proc)
+            else:
+                self._started.pop(proc, None)
+                self._failures += 1
+        self._idle = alive
+        return len(self._idle)
+
+    def starting(self, grace):
+        """ number of idle JVMs started less than grace seconds ago
+        @param grace - number: max number of seconds a JVM counts as starting
+        """
+        now = time.time()
+        return len([proc for proc in self._idle if now - self._started.get(proc, 0) < grace])
+
+    def fill(self, admit=None, relaunch=None):
+        """ start JVMs until the pool is full again, one at a time for as long as
+        admit allows. After idle JVMs died, nothing is started until the backoff is over
+        @param admit function - optional, returns False when no JVM may start now
+        @param relaunch RelaunchPolicy - optional, the backoff after idle JVMs died
+        @returns int - number of JVMs started
+        """
+        now = time.time()
+        self.idle()
+        if relaunch:
+            if self._failures > self._backed_off:
+                self._next_fill = now + backoff_delay(self._failures - 1, relaunch.base, relaunch.cap)
+            elif self._failures and self._idle and now - min(self._started.get(proc, now) for proc in self._idle) >= relaunch.healthy_uptime:
+                #the bootstrap works again
+                self._failures = 0
+            self._backed_off = self._failures
+        if now < self._next_fill:
+            return 0
+        started = 0
+        while self.idle() < self._size and (admit is None or admit()):
+            proc = subprocess.Popen(
+                self._cmdline,
+                cwd=self._cwd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize = 1
+            )
+            self._idle.append(proc)
+            self._started[proc] = time.time()
+            started += 1
+        return started
+
+    def take(self, classpath, properties=None):
+        """ hand a main to the oldest idle JVM, the one most likely to be warm
+        @param classpath string - the classpath of the main to run
+        @param properties dictionary - optional system properties to set before running it
+        @returns Popen object or None - the adopted process, None if the pool is empty
+        """
+        line = " ".join([classpath] + ["%s=%s" % p for p in sorted((properties or {}).items())])
+        while self._idle:
+            proc = self._idle.pop(0)
+            self._started.pop(proc, None)
+            if proc.poll() is not None:
+                self._failures += 1
+                continue
+            try:
+                proc.stdin.write(line + "\n")
+                proc.stdin.flush()
+                self._failures = self._backed_off = 0
+                return proc
+            except (IOError, OSError):
+                #died since the poll; the pipe is gone
+                proc.wait()
+        return None
+
+    def close(self):
+        """ kill all idle JVMs """
+        for proc in self._idle:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        self._idle = []
+        self._started = {}
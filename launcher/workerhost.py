@@ -0,0 +1,136 @@
+import time
+from collections import OrderedDict
+
+from component import Component
+
+
+class HostedWorker(object):
+    """ State of one worker running inside a WorkerHost """
+
+    def __init__(self, classpath):
+        """ @param classpath string - the classpath of the worker's main """
+        self.classpath = classpath
+        self.name = classpath.split('.')[-1]
+        self.running = False
+        self.launchtime = 0
+        self.waiting = False
+        self.crashes = 0
+        self.relaunch_at = 0
+        #last time it was active by its own heartbeat frames, None without any
+        self.last_active = None
+        #disabled: not restarted when it exits
+        self.retired = False
+
+
+class WorkerHost(Component):
+    """ A group of workers sharing one JVM, the workerhost main.
+    The host process is monitored like any other component; each worker
+    inside it is started, tracked and restarted individually through the
+    host's stdin and stdout
+    """
+
+    HOST_CLASS = "com.balihoo.fulfillment.workers.workerhost"
+    PREFIX = "workerhost "
+
+    def __init__(self, jar, group, workers, nragent_path=None, **kwargs):
+        """ WorkerHost constructor
+        @param jar - string: the full path to the jarfile to run from
+        @param group - string: name of the group, used as the component name
+        @param workers - list of strings: classpaths of the worker mains to run in the host
+        @param nragent_path - string: optional path to a new relic agent
+        @param kwargs: passed on to Component
+        """
+        super(WorkerHost, self).__init__(jar, self.HOST_CLASS, nragent_path, **kwargs)
+        self._name = group
+        self._workers = OrderedDict((classpath, HostedWorker(classpath)) for classpath in workers)
+
+    @property
+    def workers(self):
+        return list(self._workers.values())
+
+    @property
+    def last_heard_from(self):
+        """ the last time the least active of the running workers was active.
+        The workers share the host's heartbeat, each tagging its frames, so a
+        hung worker is not covered up by the frames of the others. Without
+        tagged frames, the host is judged like any other component
+        """
+        host = super(WorkerHost, self).last_heard_from
+        if not self._heartbeat:
+            return host
+        running = [w for w in self._workers.values() if w.running and not w.retired]
+        for worker in running:
+            active = self._heartbeat.last_active(worker.classpath)
+            #frames from before a restart don't count against the new run
+            worker.last_active = None if active is None else max(active, worker.launchtime)
+        if not any(w.last_active is not None for w in running):
+            return host
+        return min(worker.launchtime if worker.last_active is None else worker.last_active
+                   for worker in running)
+
+    def exited_workers(self):
+        """ workers that are not running in a live host
+        @returns list of HostedWorker objects
+        """
+        if not self.is_alive():
+            return []
+        return [w for w in self._workers.values() if not w.running and not w.retired]
+
+    def launch(self):
+        """ launches the host process, if not running, and starts all workers in it """
+        if not self.is_alive():
+            for worker in self._workers.values():
+                worker.running = False
+            super(WorkerHost, self).launch()
+            for worker in self._workers.values():
+                if not worker.retired:
+                    self.start_worker(worker.classpath)
+        return self._pid
+
+    def start_worker(self, classpath):
+        """ start a worker in the running host
+        @param classpath string - one of the host's workers
+        """
+        worker = self._workers[classpath]
+        self._command("start " + classpath)
+        worker.running = True
+        worker.launchtime = time.time()
+        worker.waiting = False
+
+    def quit_worker(self, classpath):
+        """ ask a single worker in the host to quit
+        @param classpath string - one of the host's workers
+        """
+        self._command("quit " + classpath)
+
+    def retire_worker(self, classpath, retired):
+        """ take a worker out of service, asking it to quit, or put it back,
+        starting it if it is not running
+        @param classpath string - the worker's classpath
+        @param retired bool - True to take it out of service
+        @returns bool - False if the worker is not part of this host
+        """
+        worker = self._workers.get(classpath)
+        if worker is None:
+            return False
+        worker.retired = retired
+        if self.is_alive():
+            if retired and worker.running:
+                self.quit_worker(classpath)
+            elif not retired and not worker.running:
+                self.start_worker(classpath)
+        return True
+
+    def _command(self, command):
+        """ write a command line to the host's stdin """
+        self._proc.stdin.write(command + "\n")
+        self._proc.stdin.flush()
+
+    def _drain(self, q, max_lines):
+        """ reads queued lines like Component, tracking worker exits on the way """
+        for line in super(WorkerHost, self)._drain(q, max_lines):
+            if line.startswith(self.PREFIX):
+                fields = line.split()
+                if len(fields) == 3 and fields[1] == "exited" and fields[2] in self._workers:
+                    self._workers[fields[2]].running = False
+            yield line
@@ -0,0 +1,88 @@
+package com.balihoo.fulfillment
+
+import java.io.InputStream
+import java.util.jar.JarFile
+
+import scala.collection.convert.wrapAsScala._
+
+/**
+ * Generic bootstrap main for the launcher's warm pool.
+ * Loads the classes of the jar ahead of time, then waits for the name of
+ * the main to run on stdin and runs it in this JVM. The name may be followed
+ * by system properties to set first, as key=value separated by spaces.
+ *  Nothing is written to stdout while idle.
+ *  stdin is read a byte at a time, so everything after the class name is
+ *  left for the main (ping/quit).
+ *  Exits when stdin is closed, e.g. when the launcher goes away.
+ */
+object warmstart {
+
+  val classPrefix = "com/balihoo/fulfillment/"
+
+  def main(args: Array[String]) {
+    preload()
+    readLine(System.in) match {
+      case Some(line) if line.nonEmpty =>
+        val fields = line.split("\\s+")
+        for(property <- fields.tail) {
+          property.split("=", 2) match {
+            case Array(key, value) => System.setProperty(key, value)
+            case _ =>
+          }
+        }
+        run(fields.head, args)
+      case _ =>
+        //stdin closed before a main was handed over
+        System.exit(0)
+    }
+  }
+
+  /**
+   * load, but don't initialize, all the fulfillment classes in the jar this
+   * class was loaded from. Initialization is left to the main that runs.
+   */
+  def preload() = {
+    val loader = getClass.getClassLoader
+    try {
+      val jar = new JarFile(getClass.getProtectionDomain.getCodeSource.getLocation.getPath)
+      try {
+        for(entry <- jar.entries
+            if entry.getName.startsWith(classPrefix) && entry.getName.endsWith(".class")) {
+          val className = entry.getName.stripSuffix(".class").replace('/', '.')
+          try {
+            Class.forName(className, false, loader)
+          } catch {
+            case e:Throwable => //only a warmup, the main loads what it really needs
+          }
+        }
+      } finally {
+        jar.close()
+      }
+    } catch {
+      case e:Exception => //not running from a jar, nothing to preload
+    }
+  }
+
+  /**
+   * read a single line without buffering past the newline
+   * @return the line, or None if stdin was closed
+   */
+  def readLine(in: InputStream): Option[String] = {
+    val line = new StringBuilder
+    var c = in.read()
+    while(c != -1 && c != '\n') {
+      line += c.toChar
+      c = in.read()
+    }
+    if(c == -1 && line.isEmpty) None else Some(line.toString().trim)
+  }
+
+  def run(className: String, args: Array[String]) = {
+    val main = Class.forName(className).getMethod("main", classOf[Array[String]])
+    try {
+      main.invoke(null, args)
+    } catch {
+      case e:java.lang.reflect.InvocationTargetException => throw e.getCause
+    }
+  }
+}
@@ -0,0 +1,64 @@
+package com.balihoo.fulfillment.util
+
+import java.io.{FileOutputStream, IOException}
+
+import play.api.libs.json.{Json, JsObject}
+
+/**
+ * Periodic status frames to the launcher.
+ * The launcher passes the path of a fifo in the fulfillment.heartbeat system
+ * property. Every interval, a single line of json is written to it:
+ * the frame, plus the current heap use. Without the property this does nothing.
+ * Each frame is a single write, well below PIPE_BUF, so frames from several
+ * workers in one JVM don't interleave.
+ */
+class Heartbeat(frame: () => JsObject, intervalMs: Long = Heartbeat.intervalMs) {
+
+  private val _thread = Heartbeat.path map { path =>
+    val thread = new Thread(new Runnable {
+      def run() {
+        try {
+          val out = new FileOutputStream(path, true)
+          try {
+            while(true) {
+              out.write((Json.stringify(frame() ++ Heartbeat.heap) + "\n").getBytes("UTF-8"))
+              out.flush()
+              Thread.sleep(intervalMs)
+            }
+          } finally {
+            out.close()
+          }
+        } catch {
+          //launcher went away, or we were stopped
+          case e:IOException =>
+          case e:InterruptedException =>
+        }
+      }
+    }, "heartbeat")
+    thread.setDaemon(true)
+    thread.start()
+    thread
+  }
+
+  def stop() = {
+    _thread foreach { _.interrupt() }
+  }
+}
+
+object Heartbeat {
+  val pathProperty = "fulfillment.heartbeat"
+  val intervalProperty = "fulfillment.heartbeat.interval"
+
+  def path: Option[String] = Option(System.getProperty(pathProperty))
+
+  def intervalMs: Long = Option(System.getProperty(intervalProperty)).map(_.toLong).getOrElse(10000L)
+
+  def heap: JsObject = {
+    val runtime = Runtime.getRuntime
+    val mb = 1024 * 1024
+    Json.obj(
+      "heap" -> (runtime.totalMemory - runtime.freeMemory) / mb,
+      "heapmax" -> runtime.maxMemory / mb
+    )
+  }
+}
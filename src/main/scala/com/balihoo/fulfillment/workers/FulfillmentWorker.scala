@@ -5,7 +5,7 @@ package com.balihoo.fulfillment.workers
 import scala.collection.mutable
 import scala.language.implicitConversions
 import scala.collection.JavaConversions._
-import scala.util.{Success, Failure}
+import scala.util.{Success, Failure, Try}
 import scala.concurrent.{Future, Await, Promise, ExecutionContext}
 import scala.concurrent.duration._
 
@@ -75,18 +75,74 @@ abstract class FulfillmentWorker extends WithResources {
   var _lastTaskToken: String = ""
   var _doneFuture: Option[Future[Boolean]] = None
 
+  //for the launcher's heartbeat frames
+  @volatile var _lastActivity = System.currentTimeMillis
+  @volatile var _taskStarted = System.currentTimeMillis
+  @volatile var _inFlight = 0
+
+  //seconds a task may take before SWF times it out, None when unbounded
+  val taskTimeout: Option[Long] = Try(defaultTaskStartToCloseTimeout.trim.toLong).toOption
+
+  /**
+   * status frame for the launcher. idle is the time since the last status
+   * update, the launcher's measure of liveness. While a task is in flight,
+   * task is how long it has been running: the launcher counts that as
+   * activity up to tasktimeout, the task's start to close bound, and past
+   * it the worker as hung, like SWF does
+   */
+  def heartbeatFrame = {
+    val now = System.currentTimeMillis
+    Json.obj(
+      "name" -> name,
+      "status" -> entry.getStatus,
+      "inflight" -> _inFlight,
+      "completed" -> completedTasks,
+      "failed" -> failedTasks,
+      "canceled" -> canceledTasks,
+      "idle" -> (now - _lastActivity) / 1000,
+      "task" -> (if(_inFlight > 0) (now - _taskStarted) / 1000 else 0L)
+    ) ++ taskTimeout.map(t => Json.obj("tasktimeout" -> t)).getOrElse(Json.obj())
+  }
+
   def work() = {
 
     registerActivityType()
 
     updateStatus("Starting")
 
+    val heartbeat = new Heartbeat(() => heartbeatFrame)
+
     val getch = new Getch
     _doneFuture = Some(setupQuitKey(getch))
     getch.doWith {
       handleTaskFuture(swfAdapter.getTask)
       Await.result(_doneFuture.get, Duration.Inf )
     }
+    heartbeat.stop()
+    shutdown()
+  }
+
+  /**
+   * work without reading stdin, for workers sharing a JVM in a workerhost
+   * @param done succeeds when the worker should quit
+   * @param key the worker's main class, tagging its heartbeat frames: all the
+   *            workers in the host write to the same fifo
+   */
+  def work(done: Future[Boolean], key: String) = {
+
+    registerActivityType()
+
+    updateStatus("Starting")
+
+    val heartbeat = new Heartbeat(() => heartbeatFrame ++ Json.obj("worker" -> key))
+
+    _doneFuture = Some(done map { quit =>
+      updateStatus("Terminated by host", "WARN")
+      quit
+    })
+    handleTaskFuture(swfAdapter.getTask)
+    Await.result(_doneFuture.get, Duration.Inf )
+    heartbeat.stop()
     shutdown()
   }
 
@@ -127,6 +183,8 @@ abstract class FulfillmentWorker extends WithResources {
           case Some(task) =>
             try {
               _lastTaskToken = task.getTaskToken
+              _taskStarted = System.currentTimeMillis
+              _inFlight = 1
               val shortToken = _lastTaskToken takeRight 10
               updateStatus("Processing task.." + shortToken )
               val start = System.currentTimeMillis()
@@ -149,6 +207,7 @@ abstract class FulfillmentWorker extends WithResources {
                 val shortMsg = Json.stringify(Json.obj("message" -> e.getMessage, "stacktrace" -> e.getStackTraceString.take(150)))
                 failTask("UNEXPECTED ERROR!", shortMsg)
             } finally {
+              _inFlight = 0
               closeResources()
             }
           case None =>
@@ -191,6 +250,7 @@ abstract class FulfillmentWorker extends WithResources {
   def updateStatus(status:String, level:String="INFO") = {
     try {
       updateCounter += 1
+      _lastActivity = System.currentTimeMillis
       entry.setLast(UTCFormatter.format(DateTime.now))
       entry.setStatus(status)
       workerTable.update(entry)
@@ -342,13 +402,25 @@ abstract class FulfillmentWorkerApp {
   def createWorker(cfg:PropertiesLoader, splog:Splogger): FulfillmentWorker
 
   def main(args: Array[String]) {
+    run(args, _.work())
+  }
+
+  /**
+   * run in a workerhost, alongside other workers
+   * @param done succeeds when the worker should quit
+   */
+  def host(args: Array[String], done: Future[Boolean]) {
+    run(args, _.work(done, getClass.getName.stripSuffix("$")))
+  }
+
+  def run(args: Array[String], work: FulfillmentWorker => Unit) {
     val name = getClass.getSimpleName.stripSuffix("$")
     val splog = new Splogger(Splogger.mkFFName(name))
     splog("INFO", s"Started $name")
     try {
       val cfg = PropertiesLoader(args, name)
       val worker = createWorker(cfg, splog)
-      worker.work()
+      work(worker)
     }
     catch {
       case e:Exception =>
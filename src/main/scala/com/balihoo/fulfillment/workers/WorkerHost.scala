@@ -0,0 +1,81 @@
+package com.balihoo.fulfillment.workers
+
+import java.io.{BufferedReader, InputStreamReader}
+
+import scala.collection.mutable
+import scala.concurrent.Promise
+
+/**
+ * Runs any number of workers in one JVM, so they share the heap, JIT and
+ * jar classes. The launcher drives it through stdin, one command per line:
+ *   start <class>  run the worker object's main on a new thread
+ *   quit <class>   ask that worker to quit
+ *   ping           answered with pong
+ *   quit           ask all workers to quit, then exit
+ * and tracks the workers from the lines written to stdout:
+ *   workerhost started <class>
+ *   workerhost exited <class>
+ * Closing stdin is the same as quit.
+ * The workers share the host's heartbeat fifo; each tags its frames with its
+ * class in a worker field, so the launcher can tell a hung worker from the rest.
+ */
+object workerhost {
+
+  val prefix = "workerhost"
+
+  private val _workers = mutable.Map[String, (Thread, Promise[Boolean])]()
+
+  def main(args: Array[String]) {
+    val in = new BufferedReader(new InputStreamReader(System.in))
+    var line = in.readLine()
+    while(line != null && line.trim != "quit") {
+      line.trim.split("\\s+") match {
+        case Array("start", className) => start(className, args)
+        case Array("quit", className) => quit(className)
+        case Array("ping") => println("pong")
+        case _ => System.err.println(s"$prefix unknown command: $line")
+      }
+      line = in.readLine()
+    }
+    val threads = _workers.synchronized { _workers.keys.toList } flatMap quit
+    threads foreach { _.join() }
+  }
+
+  def start(className: String, args: Array[String]) = _workers.synchronized {
+    _workers.get(className) match {
+      case Some((thread, _)) if thread.isAlive =>
+        System.err.println(s"$prefix already running $className")
+      case _ =>
+        val done = Promise[Boolean]()
+        val thread = new Thread(new Runnable {
+          def run() {
+            try {
+              app(className).host(args, done.future)
+            } catch {
+              case e:Throwable =>
+                System.err.println(s"$prefix $className failed: ${e.getMessage}")
+            } finally {
+              println(s"$prefix exited $className")
+            }
+          }
+        }, className)
+        _workers(className) = (thread, done)
+        thread.start()
+        println(s"$prefix started $className")
+    }
+  }
+
+  /**
+   * @return the worker's thread, if it is running
+   */
+  def quit(className: String): Option[Thread] = _workers.synchronized {
+    _workers.get(className) map { case (thread, done) =>
+      done.trySuccess(true)
+      thread
+    }
+  }
+
+  def app(className: String): FulfillmentWorkerApp = {
+    Class.forName(className + "$").getField("MODULE$").get(null).asInstanceOf[FulfillmentWorkerApp]
+  }
+}